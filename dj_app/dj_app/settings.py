@@ -12,7 +12,7 @@ https://docs.djangoproject.com/en/3.2/ref/settings/
 import os
 from pathlib import Path
 
-from decouple import config
+from decouple import config, Csv
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -31,6 +31,12 @@ ALLOWED_HOSTS = ['backend', '0.0.0.0', '192.168.50.233']
 
 AUTH_USER_MODEL = 'users.CustomUser'
 
+# ModelBackend stays for sessions created before the cached backend
+AUTHENTICATION_BACKENDS = [
+    'users.backends.CachedModelBackend',
+    'django.contrib.auth.backends.ModelBackend',
+]
+
 # Application definition
 
 INSTALLED_APPS = [
@@ -47,6 +53,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'quiz.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -140,11 +147,47 @@ MEDIA_ROOT = os.path.join(BASE_DIR, 'media/')
 
 MEDIA_URL = '/media/'
 
+# internal nginx location the media view redirects to (nginx/nginx.conf.*), None serves media from Django
+MEDIA_ACCEL_PREFIX = '/protected-media/'
+
+# asyncpg pool behind the hot in-game endpoints (quiz/async_db.py), None turns it off
+ASYNC_DB_POOL = {
+    'min_size': 2,
+    'max_size': 10,
+}
+
+# every backend reads and invalidates the same cache, a per-process one would miss the other workers' writes
+CACHES = {
+    'default': {
+        'BACKEND': 'django_redis.cache.RedisCache',
+        'LOCATION': 'redis://redis-server:6379/2',
+    },
+    'sessions': {
+        'BACKEND': 'django_redis.cache.RedisCache',
+        'LOCATION': 'redis://redis-server:6379/1',
+    },
+}
+
+SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
+
+SESSION_CACHE_ALIAS = 'sessions'
+
+# a room's group is placed on one shard by its name, changing the list moves groups between nodes
+CHANNEL_REDIS_HOSTS = config('CHANNEL_REDIS_HOSTS', default='redis-server:6379', cast=Csv())
+
 CHANNEL_LAYERS = {
     "default": {
-        "BACKEND": "channels_redis.core.RedisChannelLayer",
+        "BACKEND": "quiz.layers.ShardedRedisChannelLayer",
         "CONFIG": {
-            "hosts": [("redis-server", 6379)],
+            "hosts": [(host.rsplit(':', 1)[0], int(host.rsplit(':', 1)[1])) for host in CHANNEL_REDIS_HOSTS],
         },
     },
-}
\ No newline at end of file
+}
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'loggers': {
+        # quiz.layers counts the messages group_send drops over capacity from this logger's INFO line
+        'channels_redis.core': {'level': 'INFO'},
+    },
+}
@@ -1,10 +1,12 @@
 from django.contrib import admin
 from django.urls import path, include
-from django.conf.urls.static import static
 from dj_app import settings
+from quiz.views import media, metrics
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('user/', include('users.urls')),
     path('quiz/', include('quiz.urls')),
-] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+    path('metrics', metrics, name='metrics'),
+    path(f'{settings.MEDIA_URL.strip("/")}/<path:path>', media, name='media'),
+]
@@ -0,0 +1,58 @@
+from typing import Coroutine, List, Optional
+
+import msgpack
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+
+from quiz.models import ArchivedGame, Participant, QuizGame
+
+# archived results never change, the TTL only bounds the memory they take
+ARCHIVE_TTL = 3600
+
+# one packed record per player: (participant id, user id, name, score, attempts, correct)
+FIELDS = ('id', 'user_id', 'name', 'score', 'attempts', 'correct')
+
+
+def _key(game_id: int) -> str:
+    return f'archive:{game_id}'
+
+
+def pack(results: List[dict]) -> bytes:
+    return msgpack.packb([[row[field] for field in FIELDS] for row in results])
+
+
+def unpack(data: bytes) -> List[dict]:
+    return [dict(zip(FIELDS, record)) for record in msgpack.unpackb(bytes(data))]
+
+
+def archive(game_id: int) -> List[dict]:
+    """
+    Stores the final table of a game as one ``ArchivedGame`` row, best score
+    first. Meant to run in the transaction that ends the game.
+    """
+    game = QuizGame.objects.values('name', 'quiz_id', 'game_master_id').get(id=game_id)
+    results = [{"id": p['id'], "user_id": p['user_id'], "name": p['user__username'], "score": p['score'],
+                "attempts": p['answer_attempts'], "correct": p['correct_answers']}
+               for p in Participant.objects.filter(game_id=game_id).order_by('-score', 'id').values(
+                   'id', 'user_id', 'user__username', 'score', 'answer_attempts', 'correct_answers')]
+    ArchivedGame.objects.bulk_create([ArchivedGame(id=game_id, results=pack(results), **game)], ignore_conflicts=True)
+    cache.set(_key(game_id), results, ARCHIVE_TTL)
+    return results
+
+
+def _load(game_id: int) -> Optional[List[dict]]:
+    data = ArchivedGame.objects.filter(id=game_id).values_list('results', flat=True).first()
+    if data is None:
+        return None
+    results = unpack(data)
+    cache.set(_key(game_id), results, ARCHIVE_TTL)
+    return results
+
+
+async def results(game_id: int) -> Coroutine:
+    """Final table of a finished game, None while it is running."""
+    # the cache is Redis, a lookup is network I/O and stays off the event loop
+    cached = await sync_to_async(cache.get, thread_sensitive=False)(_key(game_id))
+    if cached is not None:
+        return cached
+    return await sync_to_async(_load)(game_id)
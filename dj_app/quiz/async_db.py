@@ -0,0 +1,76 @@
+import asyncio
+import json
+import re
+from functools import lru_cache
+from typing import Coroutine
+
+import asyncpg
+from django.conf import settings
+
+from quiz.models import Participant, Question
+from quiz.queries import CLOSE_QUESTION_SQL, AWARD_SQL, BOARD_SQL, PLAYER_SCORE_SQL
+
+_pool = None
+
+
+def enabled() -> bool:
+    return settings.ASYNC_DB_POOL is not None and 'postgresql' in settings.DATABASES['default']['ENGINE']
+
+
+@lru_cache()
+def _pg(sql: str) -> str:
+    # the shared statements are written with psycopg2 placeholders
+    counter = iter(range(1, sql.count('%s') + 1))
+    return re.sub('%s', lambda match: f'${next(counter)}', sql)
+
+
+async def _init_connection(conn: asyncpg.Connection) -> None:
+    # decode jsonb the way psycopg2 does
+    await conn.set_type_codec('jsonb', encoder=json.dumps, decoder=json.loads, schema='pg_catalog')
+
+
+async def _create_pool() -> asyncpg.pool.Pool:
+    db = settings.DATABASES['default']
+    return await asyncpg.create_pool(host=db['HOST'], port=db['PORT'], user=db['USER'], password=db['PASSWORD'],
+                                     database=db['NAME'], init=_init_connection, **settings.ASYNC_DB_POOL)
+
+
+async def get_pool() -> asyncpg.pool.Pool:
+    """
+    The pool is bound to the loop that created it. Daphne runs one loop for
+    its whole life, anything that starts new loops (async_to_sync in tests,
+    management commands) gets a new pool and the old one is dropped.
+    """
+    global _pool
+    loop = asyncio.get_running_loop()
+    if _pool is None or _pool[0] is not loop:
+        if _pool is not None and not _pool[0].is_closed() and _pool[1].done() and not _pool[1].exception():
+            _pool[1].result().terminate()
+        _pool = (loop, loop.create_task(_create_pool()))
+    return await _pool[1]
+
+
+async def player_score(user_id: int, quiz_game_id: int) -> Coroutine:
+    row = await (await get_pool()).fetchrow(_pg(PLAYER_SCORE_SQL), user_id, quiz_game_id)
+    if row is None:
+        raise Participant.DoesNotExist
+    return {"score": row[0], "round": row[1], "id": row[2]}
+
+
+async def board_rows(quiz_game_id: int, round: int) -> Coroutine:
+    return await (await get_pool()).fetch(_pg(BOARD_SQL), quiz_game_id, round)
+
+
+async def corr_ans(question_id: int, user_id: int) -> Coroutine:
+    """
+    Same statements as the sync scoring path, returns the awarded row or None
+    when the question was already closed.
+    """
+    async with (await get_pool()).acquire() as conn:
+        async with conn.transaction():
+            if await conn.fetchval(_pg(CLOSE_QUESTION_SQL), question_id, user_id) is None:
+                return None
+            row = await conn.fetchrow(_pg(AWARD_SQL), question_id, user_id)
+            if row is None:
+                raise Question.DoesNotExist
+    return tuple(row)
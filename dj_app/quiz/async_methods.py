@@ -1,13 +1,30 @@
 import json
 import random
 import string
-from typing import Coroutine
+from typing import Coroutine, Optional
 
 from asgiref.sync import sync_to_async
-from django.contrib.auth.models import User
+from django.core.files.storage import default_storage
+from django.db import connection, transaction
+from django.db.models import F, ProtectedError
 from django.http import HttpRequest
+from django.utils import timezone
 
-from quiz.models import Section, Quiz, QuestionCategory, Question, InGameQuestion, QuizGame, Participant, QuestionType
+from quiz import archive, async_db, leaderboard, lifecycle
+from quiz.board_cache import round_board, round_manifest, mark_stale
+from quiz.catalog_cache import cached_catalog
+from quiz.media import attach_media, pick_variant, process_uploads
+from quiz.models import Section, Quiz, QuestionCategory, Question, QuizGame, Participant, QuestionType, \
+    AnsweredQuestion
+from quiz.queries import CLOSE_QUESTION_SQL, AWARD_SQL, PENALTY_SQL, SUPER_AWARD_SQL, SUPER_PENALTY_SQL
+
+
+# answer to an edit of a quiz a live game plays: boards and AWARD_SQL read the prototype as it is
+IN_PLAY = {"detail": "Quiz is in play"}
+
+
+def _in_play(quiz_id: int) -> bool:
+    return QuizGame.objects.filter(quiz_id=quiz_id, ended=False).exists()
 
 
 def get_code(length):
@@ -23,24 +40,12 @@ async def get_player(request: HttpRequest) -> Coroutine:
     return await sync_to_async(_get_player)(request)
 
 
-def _get_user(request: HttpRequest) -> User:
-    return request.user
-
-
-def _check_user_auth(request: HttpRequest) -> bool:
-    return _get_user(request).is_anonymous
-
-
-async def check_user_auth(request: HttpRequest) -> Coroutine:
-    return await sync_to_async(_check_user_auth)(request)
-
-
 def _get_sections() -> dict:
     return {"sections": [[section.id, section.name] for section in Section.objects.all()]}
 
 
 async def get_sections() -> Coroutine:
-    return await sync_to_async(_get_sections)()
+    return await cached_catalog('sections', _get_sections)
 
 
 def _get_quiz_list(request: HttpRequest) -> list:
@@ -58,7 +63,7 @@ def _get_game_quiz_list() -> list:
 
 
 async def get_game_quiz_list() -> Coroutine:
-    return await sync_to_async(_get_game_quiz_list)()
+    return await cached_catalog('game_quiz_list', _get_game_quiz_list)
 
 
 def _get_themes(id: int) -> list:
@@ -88,32 +93,23 @@ async def get_theme_round(theme_id: int) -> Coroutine:
     return await sync_to_async(_get_theme_round)(theme_id)
 
 
-def _get_question_detail(question_id: int) -> dict:
+def _get_question_detail(question_id: int, width: Optional[int] = None) -> dict:
     question = Question.objects.get(id=question_id)
     resp = {"text": question.text, "value": question.value, "type": question.type_id}
     if question.type_id == 2:
-        resp['image'] = "/api" + question.image.url if question.image else None
+        image = pick_variant(question.image_variants, question.image.name, width)
+        resp['image'] = "/api" + default_storage.url(image) if image else None
     elif question.type_id == 3:
         resp['audio'] = "/api" + question.audio.url if question.audio else None
     return resp
 
 
-async def get_question_detail(question_id: int) -> Coroutine:
-    return await sync_to_async(_get_question_detail)(question_id)
+async def get_question_detail(question_id: int, width: Optional[int] = None) -> Coroutine:
+    return await sync_to_async(_get_question_detail)(question_id, width)
 
 
-def _get_ig_question_detail(question_id: int) -> dict:
-    question = InGameQuestion.objects.get(id=question_id)
-    resp = {"text": question.text, "value": question.value, "type": question.type_id}
-    if question.type_id == 2:
-        resp['image'] = "/api" + question.image.url if question.image else None
-    elif question.type_id == 3:
-        resp['audio'] = "/api" + question.audio.url if question.audio else None
-    return resp
-
-
-async def get_ig_question_detail(question_id: int) -> Coroutine:
-    return await sync_to_async(_get_ig_question_detail)(question_id)
+async def get_ig_question_detail(question_id: int, width: Optional[int] = None) -> Coroutine:
+    return await sync_to_async(_get_question_detail)(question_id, width)
 
 
 def _quiz_cr(title: str, section: int, request: HttpRequest) -> dict:
@@ -126,6 +122,8 @@ async def quiz_cr(title: str, section: int, request: HttpRequest) -> Coroutine:
 
 
 def _theme_cr(quiz: int, name: str) -> dict:
+    if _in_play(quiz):
+        return IN_PLAY
     if QuestionCategory.objects.filter(quiz_id=quiz, name=name).exists():
         return {"detail": "Such theme already exists in this quiz"}
     theme = QuestionCategory.objects.create(name=name, quiz_id=quiz)
@@ -136,8 +134,14 @@ async def theme_cr(quiz: int, name: str) -> Coroutine:
     return await sync_to_async(_theme_cr)(quiz, name)
 
 
-def _question_cr(request: HttpRequest) -> dict:
+def _uploads(request: HttpRequest) -> dict:
+    return process_uploads(request.FILES)
+
+
+def _question_cr(request: HttpRequest, media: dict) -> dict:
     theme = QuestionCategory.objects.prefetch_related('questions').get(id=request.POST['theme'])
+    if _in_play(theme.quiz_id):
+        return IN_PLAY
     values = list()
     for q in theme.questions.all():
         values.append(q.value)
@@ -145,21 +149,24 @@ def _question_cr(request: HttpRequest) -> dict:
     for value in range(500, 0, -100):
         if value not in values:
             new_value = value
-    question = Question.objects.create(text=request.POST['text'], category_id=int(request.POST['theme']),
-                                       type_id=int(request.POST['type']), value=new_value,
-                                       image=request.FILES['image'] if 'image' in request.FILES else None,
-                                       audio=request.FILES['audio'] if 'audio' in request.FILES else None)
+    question = Question(text=request.POST['text'], category_id=int(request.POST['theme']),
+                        type_id=int(request.POST['type']), value=new_value)
+    attach_media(question, media)
+    question.save()
     return {"id": question.id}
 
 
 async def question_cr(request: HttpRequest) -> Coroutine:
-    return await sync_to_async(_question_cr)(request)
+    media = await sync_to_async(_uploads, thread_sensitive=False)(request)
+    return await sync_to_async(_question_cr)(request, media)
 
 
-def _quiz_upd(request: HttpRequest, quiz_id: int) -> None:
+def _quiz_upd(request: HttpRequest, quiz_id: int) -> Optional[dict]:
     quiz = Quiz.objects.get(id=quiz_id)
     update_fields = list()
     if request.method == 'PUT':
+        if _in_play(quiz.id):
+            return IN_PLAY
         data = json.loads(request.body)
         if 'title' in data:
             update_fields.append('title')
@@ -169,16 +176,29 @@ def _quiz_upd(request: HttpRequest, quiz_id: int) -> None:
             quiz.section = Section.objects.get(id=data['section'])
         quiz.save(update_fields=update_fields)
     elif request.method == 'DELETE':
-        quiz.delete()
+        games = dict(QuizGame.objects.filter(quiz=quiz).values_list('id', 'ended'))
+        if not all(games.values()):
+            return IN_PLAY
+        if games:
+            # ended games are archived already, their rows just wait for the reaper
+            Participant.objects.filter(game_id__in=games).delete()
+            QuizGame.objects.filter(id__in=games).delete()
+        try:
+            quiz.delete()
+        except ProtectedError:
+            # a game started on the quiz meanwhile
+            return IN_PLAY
 
 
 async def quiz_upd(request: HttpRequest, quiz_id: int) -> Coroutine:
     return await sync_to_async(_quiz_upd)(request, quiz_id)
 
 
-def _theme_upd(request: HttpRequest, theme_id: int) -> None:
+def _theme_upd(request: HttpRequest, theme_id: int) -> Optional[dict]:
     theme = QuestionCategory.objects.get(id=theme_id)
     update_fields = list()
+    if _in_play(theme.quiz_id):
+        return IN_PLAY
     if request.method == 'PUT':
         data = json.loads(request.body)
         if 'name' in data:
@@ -193,35 +213,35 @@ async def theme_upd(request: HttpRequest, theme_id: int) -> Coroutine:
     return await sync_to_async(_theme_upd)(request, theme_id)
 
 
-def _question_upd(request: HttpRequest, question_id: int) -> None:
-    question = Question.objects.get(id=question_id)
+def _question_upd(request: HttpRequest, question_id: int, media: dict) -> Optional[dict]:
+    question = Question.objects.select_related('category').get(id=question_id)
     update_fields = list()
+    if _in_play(question.category.quiz_id):
+        return IN_PLAY
     if request.method == 'POST':
         print(request.POST)
         if 'text' in request.POST:
             update_fields.append('text')
             question.text = request.POST['text']
-        if 'audio' in request.FILES:
-            update_fields.append('audio')
-            question.audio = request.FILES['audio']
         if 'type' in request.POST:
             update_fields.append('type')
             question.type_id = int(request.POST['type'])
-        if 'image' in request.FILES:
-            update_fields.append('image')
-            question.image = request.FILES['image']
+        update_fields += attach_media(question, media)
         question.save(update_fields=update_fields)
     elif request.method == 'DELETE':
         question.delete()
 
 
 async def question_upd(request: HttpRequest, question_id: int) -> Coroutine:
-    return await sync_to_async(_question_upd)(request, question_id)
+    media = await sync_to_async(_uploads, thread_sensitive=False)(request)
+    return await sync_to_async(_question_upd)(request, question_id, media)
 
 
-def _round_change(data: dict) -> None:
+def _round_change(data: dict) -> Optional[dict]:
     origin_t = QuestionCategory.objects.get(id=data['theme_id'])
     destination_t = QuestionCategory.objects.get(id=int(data['target_id']))
+    if _in_play(origin_t.quiz_id) or _in_play(destination_t.quiz_id):
+        return IN_PLAY
     value_1 = origin_t.round
     value_2 = destination_t.round
     destination_t.round = value_1
@@ -236,20 +256,8 @@ async def round_change(data: dict) -> Coroutine:
 
 def _g_quiz_cr(request: HttpRequest) -> dict:
     data = json.loads(request.body)
-    prototype_quiz = Quiz.objects.prefetch_related('q_category', 'q_category__question').get(id=data['data_id'])
-    new_quiz = Quiz.objects.create(title=prototype_quiz.title, section=prototype_quiz.section, completed=True)
-    new_quiz_game = QuizGame.objects.create(name=data['game_name'], quiz=new_quiz, game_master=request.user, room_name=get_code(15))
-    themes = list()
-    questions = list()
-    for theme in prototype_quiz.q_category.all():
-        new_theme = QuestionCategory(name=theme.name, round=theme.round, quiz=new_quiz)
-        themes.append(new_theme)
-        for question in theme.questions.all():
-            new_question = InGameQuestion(text=question.text, value=question.value, type=question.type,
-                                          category=new_theme, image=question.image, audio=question.audio)
-            questions.append(new_question)
-    QuestionCategory.objects.bulk_create(themes)
-    InGameQuestion.objects.bulk_create(questions)
+    new_quiz_game = QuizGame.objects.create(name=data['game_name'], quiz_id=data['data_id'], game_master=request.user,
+                                            room_name=get_code(15))
     return {"id": new_quiz_game.id}
 
 
@@ -257,18 +265,14 @@ async def g_quiz_cr(request: HttpRequest) -> Coroutine:
     return await sync_to_async(_g_quiz_cr)(request)
 
 
-def _qg_players(quiz_game_id: int) -> list:
-    quiz_game = QuizGame.objects.prefetch_related('participants', 'participants__user').get(id=quiz_game_id)
-    return [{"id": player.id, "name": player.user.username} for player in
-            quiz_game.participants.all().order_by('user__username')]
-
-
 async def qg_players(quiz_game_id: int) -> Coroutine:
-    return await sync_to_async(_qg_players)(quiz_game_id)
+    return await leaderboard.roster(int(quiz_game_id))
 
 
 def _round_arrange(data: dict) -> dict:
     theme = QuestionCategory.objects.get(id=data['theme_id'])
+    if _in_play(theme.quiz_id):
+        return IN_PLAY
     if QuestionCategory.objects.filter(quiz=theme.quiz, round=data['round']).count() >= 5:
         return {"detail": "Too many themes for single round"}
     theme.round = data['round']
@@ -280,9 +284,11 @@ async def round_arrange(data: dict) -> Coroutine:
     return await sync_to_async(_round_arrange)(data)
 
 
-def _value_change(data: dict) -> None:
-    origin_q = Question.objects.get(id=data['origin_id'])
-    destination_q = Question.objects.get(id=data['destination_id'])
+def _value_change(data: dict) -> Optional[dict]:
+    origin_q = Question.objects.select_related('category').get(id=data['origin_id'])
+    destination_q = Question.objects.select_related('category').get(id=data['destination_id'])
+    if _in_play(origin_q.category.quiz_id) or _in_play(destination_q.category.quiz_id):
+        return IN_PLAY
     value_1 = origin_q.value
     value_2 = destination_q.value
     destination_q.value = value_1
@@ -295,97 +301,95 @@ async def value_change(data: dict) -> Coroutine:
     return await sync_to_async(_value_change)(data)
 
 
-def _round_qg(quiz_game_id: int, round: int) -> dict:
-    quiz_game = QuizGame.objects.prefetch_related('quiz', 'quiz__q_category', 'quiz__q_category__question').get(
-        id=quiz_game_id)
-    result = dict()
-    for theme in quiz_game.quiz.q_category.filter(round=round):
-        result[theme.name] = [{"id": q.id, "text": q.text, "value": q.value, "type": q.type_id,
-                               "audio": q.audio.url if q.audio else None,
-                               "image": q.image.url if q.image else None,
-                               "fresh": q.fresh} for q in
-                              theme.question.all().order_by('value')]
-    return result
+async def round_qg(quiz_game_id: int, round: int, width: Optional[int] = None) -> Coroutine:
+    return await round_board(quiz_game_id, round, width)
 
 
-async def round_qg(quiz_game_id: int, round: int) -> Coroutine:
-    return await sync_to_async(_round_qg)(quiz_game_id, round)
+async def round_mf(quiz_game_id: int, round: int, width: Optional[int] = None) -> Coroutine:
+    return await round_manifest(quiz_game_id, round, width)
 
 
 def _r_completed(quiz_game_id: int, round: int) -> dict:
-    quiz_game = QuizGame.objects.prefetch_related('quiz', 'quiz__q_category', 'quiz__q_category__question').get(
-        id=quiz_game_id)
-    result = False
-    for theme in quiz_game.quiz.q_category.filter(round=round):
-        for q in theme.question.all():
-            if q.fresh:
-                result = True
-                return {"alive": result}
-    quiz_game.current_round += 1
-    quiz_game.save(update_fields=['current_round'])
-    return {"alive": result}
+    answered = AnsweredQuestion.objects.filter(game_id=quiz_game_id).values('question_id')
+    if Question.objects.filter(category__quiz__quiz_game=quiz_game_id, category__round=round).exclude(
+            id__in=answered).exists():
+        return {"alive": True}
+    QuizGame.objects.filter(id=quiz_game_id).update(current_round=F('current_round') + 1)
+    return {"alive": False}
 
 
 async def r_completed(quiz_game_id: int, round: int) -> Coroutine:
     return await sync_to_async(_r_completed)(quiz_game_id, round)
 
 
-def _corr_ans(data: dict) -> None:
-    player = Participant.objects.get(user_id=data['player_id'], active=True)
-    question = InGameQuestion.objects.prefetch_related('category').get(id=data['question_id'])
-    points = question.category.round * question.value
-    player.score += points
-    player.answer_attempts += 1
-    player.correct_answers += 1
-    question.fresh = False
-    player.save(update_fields=['score', 'answer_attempts', 'correct_answers'])
-    question.save(update_fields=['fresh'])
+def _fetch_row(cursor, sql: str, params: list) -> Optional[tuple]:
+    cursor.execute(sql, params)
+    return cursor.fetchone()
+
+
+async def _scored(row: Optional[tuple]) -> Optional[dict]:
+    # row is what the scoring statements return: score, participant id, game id, attempts, correct answers
+    if row is None:
+        return None
+    if row[2] is not None:
+        await leaderboard.record(row[2], [(row[1], row[0], row[3], row[4])])
+        await lifecycle.touch(row[2])
+    return {"score": row[0]}
+
+
+def _corr_ans(data: dict) -> Optional[tuple]:
+    with transaction.atomic(), connection.cursor() as cursor:
+        closed = _fetch_row(cursor, CLOSE_QUESTION_SQL, [data['question_id'], data['player_id']])
+        if closed is None:
+            return None
+        row = _fetch_row(cursor, AWARD_SQL, [data['question_id'], data['player_id']])
+        if row is None:
+            raise Question.DoesNotExist
+    mark_stale(closed[0], int(data['question_id']))
+    return row
 
 
 async def corr_ans(data: dict) -> Coroutine:
-    return await sync_to_async(_corr_ans)(data)
+    if not async_db.enabled():
+        return await _scored(await sync_to_async(_corr_ans)(data))
+    row = await async_db.corr_ans(int(data['question_id']), int(data['player_id']))
+    if row is not None:
+        await sync_to_async(mark_stale, thread_sensitive=False)(row[2], int(data['question_id']))
+    return await _scored(row)
 
 
-def _wrong_ans(data: dict) -> None:
-    player = Participant.objects.get(user_id=data['player_id'], active=True)
-    question = InGameQuestion.objects.prefetch_related('category').get(id=data['question_id'])
-    points = question.category.round * question.value
-    player.score -= points
-    player.answer_attempts += 1
-    player.save(update_fields=['score', 'answer_attempts'])
+def _wrong_ans(data: dict) -> Optional[tuple]:
+    with connection.cursor() as cursor:
+        return _fetch_row(cursor, PENALTY_SQL, [data['question_id'], data['player_id']])
 
 
 async def wrong_ans(data: dict) -> Coroutine:
-    return await sync_to_async(_wrong_ans)(data)
+    return await _scored(await sync_to_async(_wrong_ans)(data))
 
 
-def _super_corr_ans(data: dict) -> None:
-    player = Participant.objects.get(id=data['player_id'], active=True)
-    player.score += player.super_bet
-    player.answer_attempts += 1
-    player.correct_answers += 1
-    player.save(update_fields=['score', 'answer_attempts', 'correct_answers'])
+def _super_corr_ans(data: dict) -> Optional[tuple]:
+    with connection.cursor() as cursor:
+        return _fetch_row(cursor, SUPER_AWARD_SQL, [data['player_id']])
 
 
 async def super_corr_ans(data: dict) -> Coroutine:
-    return await sync_to_async(_super_corr_ans)(data)
+    return await _scored(await sync_to_async(_super_corr_ans)(data))
 
 
-def _super_wrong_ans(data: dict) -> None:
-    player = Participant.objects.get(id=data['player_id'], active=True)
-    player.score -= player.super_bet
-    player.answer_attempts += 1
-    player.save(update_fields=['score', 'answer_attempts'])
+def _super_wrong_ans(data: dict) -> Optional[tuple]:
+    with connection.cursor() as cursor:
+        return _fetch_row(cursor, SUPER_PENALTY_SQL, [data['player_id']])
 
 
 async def super_wrong_ans(data: dict) -> Coroutine:
-    return await sync_to_async(_super_wrong_ans)(data)
+    return await _scored(await sync_to_async(_super_wrong_ans)(data))
 
 
 def _game_start(data: dict) -> None:
     game = QuizGame.objects.get(id=data['game_id'])
     game.started = True
-    game.save(update_fields=['started'])
+    game.last_activity = timezone.now()
+    game.save(update_fields=['started', 'last_activity'])
 
 
 async def game_start(data: dict) -> Coroutine:
@@ -396,33 +400,32 @@ def _score_pl(request: HttpRequest) -> dict:
     quiz_game_id = request.GET.get('quiz_game_id')
     game = QuizGame.objects.get(id=quiz_game_id)
     participant = Participant.objects.get(user=request.user, active=True)
-    return {"score": participant.score, "round": game.current_round}
+    return {"score": participant.score, "round": game.current_round, "id": participant.id}
 
 
 async def score_pl(request: HttpRequest) -> Coroutine:
-    return await sync_to_async(_score_pl)(request)
-
-
-def _dashboard(quiz_game_id: int) -> list:
-    quiz_game = QuizGame.objects.prefetch_related('participants', 'participants__user').get(id=quiz_game_id)
-    return [{"id": p.id, "name": p.user.username, "score": p.score} for p in
-            quiz_game.participants.all().order_by('-score')]
+    quiz_game_id = int(request.GET.get('quiz_game_id'))
+    if not async_db.enabled():
+        info = await sync_to_async(_score_pl)(request)
+    else:
+        info = await async_db.player_score(request.user.id, quiz_game_id)
+    info['rank'] = await leaderboard.rank(quiz_game_id, info.pop('id'))
+    return info
 
 
-async def dashboard(quiz_game_id: int) -> Coroutine:
-    return await sync_to_async(_dashboard)(quiz_game_id)
+async def dashboard(quiz_game_id: int, top: Optional[int] = None) -> Coroutine:
+    return await leaderboard.top(int(quiz_game_id), top)
 
 
 def _get_ans(quiz_game_id: int, q_id: int) -> dict:
-    question = InGameQuestion.objects.get(id=q_id)
-    quiz_game = QuizGame.objects.prefetch_related('participants', 'participants__user').get(id=quiz_game_id)
     result = list()
-    for p in quiz_game.participants.all().order_by('-score'):
-        if not p.super_bet or not p.super_answer:
+    for p in Participant.objects.filter(game_id=quiz_game_id).order_by('-score').values(
+            'id', 'user__username', 'super_bet', 'super_answer'):
+        if not p['super_bet'] or not p['super_answer']:
             return {"ready": False}
-        result.append({"id": p.id, "name": p.user.username, "bet": p.super_bet, "answer": p.super_answer})
-    question.fresh = False
-    question.save(update_fields=['fresh'])
+        result.append({"id": p['id'], "name": p['user__username'], "bet": p['super_bet'], "answer": p['super_answer']})
+    AnsweredQuestion.objects.get_or_create(game_id=quiz_game_id, question_id=q_id)
+    mark_stale(int(quiz_game_id), int(q_id))
     return {"answers": result, "ready": True}
 
 
@@ -431,29 +434,31 @@ async def get_ans(quiz_game_id: int, q_id: int) -> Coroutine:
 
 
 def _g_list() -> list:
-    return [{"id": g.id, "name": g.name, "room": g.room_name} for g in QuizGame.objects.filter(started=False)]
+    return [{"id": g.id, "name": g.name, "room": g.room_name}
+            for g in QuizGame.objects.filter(started=False, ended=False)]
 
 
 async def g_list() -> Coroutine:
     return await sync_to_async(_g_list)()
 
 
-def _connect_player(request: HttpRequest) -> None:
+def _connect_player(request: HttpRequest) -> tuple:
     data = json.loads(request.body)
     game = QuizGame.objects.get(id=data['game_id'])
-    if not Participant.objects.filter(user=request.user, game=game, active=True).exists():
-        Participant.objects.create(user=request.user, game=game)
+    player = Participant.objects.filter(user=request.user, game=game, active=True).first()
+    if player is None:
+        player = Participant.objects.create(user=request.user, game=game)
+    return game.id, {"id": player.id, "name": request.user.username, "score": player.score,
+                     "attempts": player.answer_attempts, "correct": player.correct_answers}
 
 
 async def connect_player(request: HttpRequest) -> Coroutine:
-    return await sync_to_async(_connect_player)(request)
+    await leaderboard.join(*await sync_to_async(_connect_player)(request))
 
 
 def _bet(request: HttpRequest) -> None:
     data = json.loads(request.body)
-    participant = Participant.objects.get(user=request.user, active=True)
-    participant.super_bet = data["bet"]
-    participant.save(update_fields=['super_bet'])
+    Participant.objects.filter(user=request.user, active=True).update(super_bet=data["bet"])
 
 
 async def bet(request: HttpRequest) -> Coroutine:
@@ -462,50 +467,48 @@ async def bet(request: HttpRequest) -> Coroutine:
 
 def _super_ans(request: HttpRequest) -> None:
     data = json.loads(request.body)
-    participant = Participant.objects.get(user=request.user, active=True)
-    participant.super_answer = data["answer"]
-    participant.save(update_fields=['super_answer'])
+    Participant.objects.filter(user=request.user, active=True).update(super_answer=data["answer"])
 
 
 async def super_ans(request: HttpRequest) -> Coroutine:
     return await sync_to_async(_super_ans)(request)
 
 
-def _res_table(game_id: int) -> list:
-    quiz_game = QuizGame.objects.prefetch_related('participants', 'participants__user').get(id=game_id)
+async def res_table(game_id: int) -> Coroutine:
     result = list()
-    for p in quiz_game.participants.all().order_by('-score'):
-        percent = p.correct_answers / p.answer_attempts * 100
-        result.append({"id": p.id, "name": p.user.username, "score": p.score,
-                       "percent": f'{int(percent)} %'})
+    # a finished game is read from its archive, the live board only while it runs
+    results = await archive.results(int(game_id))
+    if results is None:
+        results = await leaderboard.standings(int(game_id))
+    for p in results:
+        percent = p['correct'] / p['attempts'] * 100 if p['attempts'] else 0
+        result.append({"id": p['id'], "name": p['name'], "score": p['score'], "percent": f'{int(percent)} %'})
     return result
 
 
-async def res_table(game_id: int) -> Coroutine:
-    return await sync_to_async(_res_table)(game_id)
-
-
-def _game_end(data: dict) -> None:
-    game = QuizGame.objects.prefetch_related('participants', 'quiz').get(id=data["game_id"])
-    q_set = game.participants.all()
-    for p in q_set:
-        p.active = False
-    Participant.objects.bulk_update(q_set, ['active'])
-    game.quiz.delete()
-
-
 async def game_end(data: dict) -> Coroutine:
-    return await sync_to_async(_game_end)(data)
+    # the game's rows are deleted later by the reaper (quiz/lifecycle.py)
+    results = await lifecycle.end(int(data["game_id"]))
+    await leaderboard.retire(int(data["game_id"]), results)
 
 
-def _no_body(question_id: int) -> None:
-    question = InGameQuestion.objects.get(id=question_id)
-    question.fresh = False
-    question.save(update_fields=['fresh'])
+def _no_body(request: HttpRequest, data: dict) -> Optional[dict]:
+    game_id = data.get('game_id')
+    if not game_id:
+        # clients that don't send it mean the live game of theirs that plays the question
+        games = list(QuizGame.objects.filter(game_master=request.user, ended=False,
+                                             quiz__q_category__questions=data['question_id']).values_list(
+            'id', flat=True))
+        if len(games) != 1:
+            return {"detail": "Wrong game_id"}
+        game_id = games[0]
+    AnsweredQuestion.objects.get_or_create(game_id=game_id, question_id=data['question_id'])
+    mark_stale(int(game_id), int(data['question_id']))
+    lifecycle.touch_sync(int(game_id))
 
 
-async def no_body(question_id: int) -> Coroutine:
-    return await sync_to_async(_no_body)(question_id)
+async def no_body(request: HttpRequest, data: dict) -> Coroutine:
+    return await sync_to_async(_no_body)(request, data)
 
 
 def _q_detail(question_id: int) -> dict:
@@ -538,11 +541,11 @@ async def quiz_det(quiz_id: int) -> Coroutine:
 def _check_room(request: HttpRequest) -> dict:
     role = request.GET.get('role')
     if role == 'creator':
-        game = QuizGame.objects.get(game_master=request.user)
-        return {"room": game.room_name}
+        return {"room": QuizGame.objects.values_list('room_name', flat=True).get(game_master=request.user,
+                                                                                  ended=False)}
     else:
-        player = Participant.objects.get(user=request.user, active=True)
-        return {"room": player.game.room_name}
+        return {"room": Participant.objects.values_list('game__room_name', flat=True).get(user=request.user,
+                                                                                        active=True)}
 
 
 async def check_room(request: HttpRequest) -> Coroutine:
@@ -554,4 +557,4 @@ def _get_types() -> dict:
 
 
 async def get_types() -> Coroutine:
-    return await sync_to_async(_get_types)()
\ No newline at end of file
+    return await cached_catalog('types', _get_types)
\ No newline at end of file
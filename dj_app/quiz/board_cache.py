@@ -0,0 +1,126 @@
+import hashlib
+import json
+from typing import Coroutine, Optional, Tuple
+
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+
+from django.db.models import Exists, OuterRef
+
+from quiz import async_db
+from quiz.catalog_cache import catalog_version, invalidate
+from quiz.media import pick_variant, asset_info
+from quiz.models import QuestionCategory, AnsweredQuestion, QuizGame
+
+BOARD_TTL = 3600
+MANIFEST_TTL = 3600
+
+
+def _media_url(name: str):
+    return default_storage.url(name) if name else None
+
+
+def _board_entry(rows) -> dict:
+    # rows are (theme, id, text, value, type, audio, image, image variants, answered), see BOARD_SQL;
+    # media are kept as storage names, the variant and the url are picked per request
+    board = dict()
+    ids = list()
+    for name, q_id, text, value, type_id, audio, image, variants, answered in rows:
+        questions = board.setdefault(name, [])
+        if q_id is None:
+            continue
+        ids.append(q_id)
+        questions.append({"id": q_id, "text": text, "value": value, "type": type_id, "audio": audio or None,
+                          "image": image or None, "images": variants or {}, "fresh": not answered})
+    return {"board": board, "ids": ids}
+
+
+def _build_board(quiz_game_id: int, round: int, key: str) -> dict:
+    answered = AnsweredQuestion.objects.filter(game_id=quiz_game_id, question_id=OuterRef('questions__id'))
+    rows = QuestionCategory.objects.filter(quiz__quiz_game=quiz_game_id, round=round).annotate(
+        answered=Exists(answered)).order_by('id', 'questions__value').values_list(
+        'name', 'questions__id', 'questions__text', 'questions__value', 'questions__type_id', 'questions__audio',
+        'questions__image', 'questions__image_variants', 'answered')
+    entry = _board_entry(rows)
+    cache.set(key, entry, BOARD_TTL)
+    return entry
+
+
+def _cached_entry(quiz_game_id: int, round: int) -> Tuple[int, str, Optional[dict]]:
+    version = catalog_version(f'board:{quiz_game_id}')
+    key = f'board:{quiz_game_id}:{round}:{version}'
+    return version, key, cache.get(key)
+
+
+def _stale(quiz_game_id: int, question_ids: list) -> set:
+    return {int(key.rsplit(':', 1)[1])
+            for key in cache.get_many([f'board:stale:{quiz_game_id}:{q_id}' for q_id in question_ids])}
+
+
+async def _round_entry(quiz_game_id: int, round: int) -> Tuple[dict, str]:
+    # the cache is shared Redis: lookups run in a thread, but not the one the database calls queue on
+    version, key, entry = await sync_to_async(_cached_entry, thread_sensitive=False)(quiz_game_id, round)
+    if entry is None and async_db.enabled():
+        entry = _board_entry(await async_db.board_rows(quiz_game_id, round))
+        await sync_to_async(cache.set, thread_sensitive=False)(key, entry, BOARD_TTL)
+    elif entry is None:
+        entry = await sync_to_async(_build_board)(quiz_game_id, round, key)
+    return entry, version
+
+
+async def round_board(quiz_game_id: int, round: int, width: Optional[int] = None) -> Coroutine:
+    """
+    Board of one round, built with a single query and cached per
+    (game, round, version). Questions answered since the build are patched
+    in from their stale markers, images are picked for the client ``width``.
+    """
+    quiz_game_id, round = int(quiz_game_id), int(round)
+    entry, version = await _round_entry(quiz_game_id, round)
+    stale = await sync_to_async(_stale, thread_sensitive=False)(quiz_game_id, entry['ids'])
+    for questions in entry['board'].values():
+        for question in questions:
+            question['image'] = _media_url(pick_variant(question.pop('images'), question['image'], width))
+            question['audio'] = _media_url(question['audio'])
+            if question['id'] in stale:
+                question['fresh'] = False
+    return entry['board']
+
+
+async def round_manifest(quiz_game_id: int, round: int, width: Optional[int] = None) -> Coroutine:
+    """
+    Every image and audio file of a round with its size and sha256, for
+    clients to prefetch when the round starts. Images are the variants
+    ``round_board`` serves for the same ``width``. It is rebuilt when the
+    board version changes and carries a hash of its assets as its own
+    version, the same on every backend.
+    """
+    quiz_game_id, round = int(quiz_game_id), int(round)
+    entry, version = await _round_entry(quiz_game_id, round)
+    key = f'manifest:{quiz_game_id}:{round}:{version}:{width}'
+    manifest = await sync_to_async(cache.get, thread_sensitive=False)(key)
+    if manifest is not None:
+        return manifest
+    # the same files ig_question_detail hands out: the image of an image question, the audio of an audio one
+    assets = [(question['id'], kind, name) for questions in entry['board'].values() for question in questions
+              for kind, name in (('image', pick_variant(question['images'], question['image'], width)
+                                  if question['type'] == 2 else None),
+                                 ('audio', question['audio'] if question['type'] == 3 else None)) if name]
+    info = await sync_to_async(asset_info)([name for q_id, kind, name in assets])
+    assets = [dict(question=q_id, kind=kind, url="/api" + _media_url(name), **info[name])
+              for q_id, kind, name in assets if name in info]
+    digest = hashlib.sha256(json.dumps(assets, sort_keys=True).encode()).hexdigest()[:16]
+    manifest = {"version": digest, "assets": assets}
+    await sync_to_async(cache.set, thread_sensitive=False)(key, manifest, MANIFEST_TTL)
+    return manifest
+
+
+def mark_stale(quiz_game_id: int, *question_ids: int) -> None:
+    # markers outlive every board entry built before them, the entries expire after BOARD_TTL as well
+    cache.set_many({f'board:stale:{quiz_game_id}:{q_id}': True for q_id in question_ids}, BOARD_TTL)
+
+
+def invalidate_boards(quiz_id: int) -> None:
+    # games share their quiz's questions, so an edit has to reach every board built from it
+    for quiz_game_id in QuizGame.objects.filter(quiz_id=quiz_id).values_list('id', flat=True):
+        invalidate(f'board:{quiz_game_id}')
@@ -0,0 +1,51 @@
+import json
+import time
+from typing import Callable, Coroutine, Optional, Tuple
+
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+
+CATALOG_TTL = 300
+# outlives every entry built under a version, a version that expires only orphans entries that are gone too
+VERSION_TTL = 24 * 3600
+
+
+def _version_key(name: str) -> str:
+    return f'catalog:{name}:version'
+
+
+def catalog_version(name: str) -> int:
+    # a millisecond stamp rather than 1, so a version lost to eviction never
+    # matches entries built before it
+    return cache.get_or_set(_version_key(name), int(time.time() * 1000), VERSION_TTL)
+
+
+def _cached(name: str) -> Tuple[int, Optional[bytes]]:
+    version = catalog_version(name)
+    return version, cache.get(f'catalog:{name}:{version}')
+
+
+def _build(name: str, version: int, builder: Callable) -> bytes:
+    payload = json.dumps(builder()).encode()
+    cache.set(f'catalog:{name}:{version}', payload, CATALOG_TTL)
+    return payload
+
+
+async def cached_catalog(name: str, builder: Callable) -> Coroutine:
+    """
+    Pre-serialized JSON for a catalog endpoint. Hits are answered straight
+    from the cache, only a miss goes to the database.
+    """
+    # the cache is shared Redis: the lookup runs in a thread, but not the one the database calls queue on
+    version, payload = await sync_to_async(_cached, thread_sensitive=False)(name)
+    if payload is None:
+        payload = await sync_to_async(_build)(name, version, builder)
+    return payload
+
+
+def invalidate(*names: str) -> None:
+    for name in names:
+        try:
+            cache.incr(_version_key(name))
+        except ValueError:
+            catalog_version(name)
@@ -1,77 +1,144 @@
+import asyncio
 import json
+import logging
+import time
 
 from asgiref.sync import sync_to_async
 from channels.db import database_sync_to_async
 from channels.generic.websocket import AsyncWebsocketConsumer
 
+from quiz import metrics, protocol, room_engine
+from quiz.shared_state import claim_buzz
 from users.models import CustomUser
 
+logger = logging.getLogger(__name__)
+
 
 class GameRoomConsumer(AsyncWebsocketConsumer):
     async def connect(self):
         self.gamename = self.scope['url_route']['kwargs']['gamename']
         self.game_group_name = f'game_{self.gamename}'
+        metrics.socket_opened(self.gamename)
         await self.channel_layer.group_add(
             self.game_group_name,
             self.channel_name
         )
-        await self.accept()
+        self.engine = room_engine.attach(self.gamename, self.channel_layer)
+        self.binary = protocol.MSGPACK_SUBPROTOCOL in self.scope.get('subprotocols', ())
+        self.outbox = list()
+        self.flusher = None
+        await self.accept(protocol.MSGPACK_SUBPROTOCOL if self.binary else None)
 
-    async def receive(self, text_data=None, byte_data=None):
-        text_data_json = json.loads(text_data)
+    async def receive(self, text_data=None, bytes_data=None):
+        started, stamp = time.perf_counter(), time.time()
+        text_data_json = json.loads(text_data) if text_data is not None else protocol.decode(bytes_data)
+        if text_data_json is None:
+            return
         message = text_data_json['message']
+        try:
+            await self.handle(text_data_json, message, stamp)
+        finally:
+            metrics.socket_message(message, time.perf_counter() - started)
+
+    async def handle(self, text_data_json: dict, message: str, stamp: float) -> None:
         if message == 'ready':
+            started = time.perf_counter()
+            if not await claim_buzz(self.channel_layer, self.gamename, text_data_json.get('question_id', ''),
+                                    self.scope['user'].id):
+                return
+            logger.debug('room %s: buzz arbitrated in %.2f ms', self.gamename,
+                         (time.perf_counter() - started) * 1000)
+            self.engine.post({'message': 'buzzed', 'question_id': text_data_json.get('question_id', ''),
+                              'user_id': self.scope['user'].id})
             await self.channel_layer.group_send(
                 self.game_group_name,
                 {
                     'type': 'block_buttons',
+                    'stamp': stamp,
                     'message': 'block',
                     'username': self.scope['user'].username,
                     'user_id': self.scope['user'].id
                 }
             )
-        elif message == 'unlock':
-            await self.channel_layer.group_send(
-                self.game_group_name,
-                {
-                    'type': 'unlock_buttons',
-                    'message': 'unlocked'
-                }
-            )
-        elif message == 'update':
-            await self.channel_layer.group_send(
-                self.game_group_name,
-                {
-                    'type': 'update_buttons',
-                    'message': 'updated'
-                }
-            )
+        elif message in ('unlock', 'update'):
+            # the engine releases the buzz lock and tells the room, once it checked that the game master sent it
+            self.engine.post({'message': message, 'sender_id': self.scope['user'].id, 'stamp': stamp})
+        elif message in room_engine.ENGINE_MESSAGES:
+            # the engine releases the buzz lock on a verdict, once it checked that the game master sent it
+            text_data_json['sender_id'] = self.scope['user'].id
+            text_data_json['reply_to'] = self.channel_name
+            self.engine.post(text_data_json)
+
+    async def push(self, event: dict) -> None:
+        """
+        JSON clients get a text frame per event. Binary clients get the events
+        of the next ``COALESCE_SECONDS`` in one MessagePack frame.
+        """
+        if not self.binary:
+            await self.send(text_data=json.dumps(event))
+            return
+        self.outbox.append(event)
+        if self.flusher is None:
+            self.flusher = asyncio.ensure_future(self.flush_outbox())
+
+    async def flush_outbox(self) -> None:
+        await asyncio.sleep(protocol.COALESCE_SECONDS)
+        events, self.outbox, self.flusher = self.outbox, list(), None
+        await self.send(bytes_data=protocol.encode(events))
 
     async def block_buttons(self, event):
-        await self.send(text_data=json.dumps({
+        await self.push({
             'message': event['message'],
             'username': event['username'],
             'user_id': event['user_id']
-        }))
+        })
 
     async def unlock_buttons(self, event):
-        await self.send(text_data=json.dumps({
+        await self.push({
             'message': event['message'],
-        }))
+        })
 
     async def update_buttons(self, event):
-        await self.send(text_data=json.dumps({
+        await self.push({
             'message': event['message'],
-        }))
+        })
+
 
+    async def room_delta(self, event):
+        await self.push({key: value for key, value in event.items() if key not in ('type', 'stamp')})
+
+    async def room_state(self, event):
+        await self.push({key: value for key, value in event.items() if key not in ('type', 'stamp')})
+
+    async def timer_started(self, event):
+        await self.push({key: value for key, value in event.items() if key not in ('type', 'stamp')})
+
+    async def timer_expired(self, event):
+        await self.push({key: value for key, value in event.items() if key not in ('type', 'stamp')})
+
+    async def super_answers(self, event):
+        # sent to the room, only the game master's sockets pass it on
+        if event['to'] == self.scope['user'].id:
+            await self.push({key: value for key, value in event.items() if key not in ('type', 'stamp', 'to')})
 
     def get_name(self):
         return CustomUser.objects.all()[0].username
 
 
+    async def dispatch(self, message):
+        # channels_redis hands the same dict to every local member of the group, it is read, not popped
+        stamp = message.get('stamp')
+        await super().dispatch(message)
+        if stamp is not None:
+            metrics.WS_DELIVERY_SECONDS.labels(message['type']).observe(time.time() - stamp)
+
     async def disconnect(self, close_code):
+        metrics.socket_closed(self.gamename)
+        if getattr(self, 'flusher', None) is not None:
+            self.flusher.cancel()
         await self.channel_layer.group_discard(
             self.game_group_name,
             self.channel_name
         )
+        await room_engine.detach(self.engine)
 
@@ -0,0 +1,184 @@
+import asyncio
+import collections
+import functools
+import logging
+import time
+import weakref
+from typing import Dict, Set
+
+import channels_redis
+from channels.exceptions import ChannelFull
+from channels.layers import InMemoryChannelLayer
+from channels_redis.core import RedisChannelLayer, BoundedQueue
+from django.core.exceptions import ImproperlyConfigured
+
+from quiz.metrics import LAYER_FANOUT, LAYER_DROPPED, LAYER_BUFFERED, LAYER_DELIVERIES
+
+# ShardedRedisChannelLayer overrides internals of this release, requirements.txt pins it
+CHANNELS_REDIS_VERSION = '3.3.'
+
+_layers = weakref.WeakSet()
+
+logger = logging.getLogger(__name__)
+
+for _reason in ('capacity', 'buffer'):
+    LAYER_DROPPED.labels(_reason)
+for _path in ('local', 'redis'):
+    LAYER_DELIVERIES.labels(_path)
+
+
+def _stamped(message: dict) -> dict:
+    # consumers report the time from here, or from the receive that set it, to their send
+    if 'stamp' in message:
+        return message
+    return dict(message, stamp=time.time())
+
+
+class _CountingQueue(BoundedQueue):
+    def put_nowait(self, item):
+        if self.full():
+            LAYER_DROPPED.labels('buffer').inc()
+        return super().put_nowait(item)
+
+
+class _OverCapacity(logging.Filter):
+    """
+    channels_redis only logs how many channels of a group_send were over
+    capacity, at INFO: the LOGGING setting keeps that level on its logger.
+    """
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.msg.startswith('%s of %s channels over capacity'):
+            LAYER_DROPPED.labels('capacity').inc(record.args[0])
+        return True
+
+
+logging.getLogger('channels_redis.core').addFilter(_OverCapacity())
+
+
+class ShardedRedisChannelLayer(RedisChannelLayer):
+    """
+    ``RedisChannelLayer`` over several Redis hosts. A group lives on the shard
+    its name hashes to, so every key of a room sits on one node. Members of a
+    group that are consumers of this process get group messages straight
+    into their receive buffer, Redis only carries them to other workers;
+    with nginx sending all sockets of a room to one worker a room's traffic
+    never leaves the process.
+
+    Also reports group fan-out, messages dropped over capacity and the
+    messages buffered in this process for local consumers.
+    """
+
+    def __init__(self, *args, **kwargs):
+        if not channels_redis.__version__.startswith(CHANNELS_REDIS_VERSION):
+            raise ImproperlyConfigured(f'ShardedRedisChannelLayer needs channels_redis {CHANNELS_REDIS_VERSION}x, '
+                                       f'{channels_redis.__version__} is installed')
+        super().__init__(*args, **kwargs)
+        self.receive_buffer = collections.defaultdict(functools.partial(_CountingQueue, self.capacity))
+        # groups of the consumers in this process, by channel
+        self.local_groups: Dict[str, Set[str]] = dict()
+        self.reader = None
+        _layers.add(self)
+
+    def buffered(self) -> int:
+        return sum(queue.qsize() for queue in self.receive_buffer.values())
+
+    def _is_local(self, channel: str) -> bool:
+        return '!' in channel and self.non_local_name(channel).endswith(self.client_prefix + '!')
+
+    async def receive(self, channel):
+        """
+        Consumers of this process only wait on their buffer. A single reader
+        task moves their messages from Redis into the buffers, so a message
+        delivered in-process is not stuck behind a receiver blocked on Redis.
+        """
+        if '!' not in channel:
+            return await super().receive(channel)
+        assert self._is_local(channel), 'Wrong client prefix'
+        loop = asyncio.get_event_loop()
+        if self.reader is None or self.reader[0] is not loop or self.reader[1].done():
+            self.reader = (loop, loop.create_task(self._read(self.non_local_name(channel))))
+        queue = self.receive_buffer[channel]
+        try:
+            return await queue.get()
+        except asyncio.CancelledError:
+            if queue.empty():
+                self.receive_buffer.pop(channel, None)
+            raise
+
+    async def _read(self, real_channel: str) -> None:
+        while True:
+            try:
+                message_channel, message = await self.receive_single(real_channel)
+            except Exception:
+                logger.exception('receiving on %s failed', real_channel)
+                await asyncio.sleep(1)
+                continue
+            for channel in message_channel if isinstance(message_channel, list) else [message_channel]:
+                self.receive_buffer[channel].put_nowait(message)
+
+    async def group_add(self, group, channel):
+        await super().group_add(group, channel)
+        if self._is_local(channel):
+            self.local_groups.setdefault(channel, set()).add(group)
+
+    async def group_discard(self, group, channel):
+        await super().group_discard(group, channel)
+        groups = self.local_groups.get(channel)
+        if groups is not None:
+            groups.discard(group)
+            if not groups:
+                del self.local_groups[channel]
+
+    async def send(self, channel, message):
+        message = _stamped(message)
+        if channel in self.local_groups:
+            LAYER_DELIVERIES.labels('local').inc()
+            self.receive_buffer[channel].put_nowait(message)
+            return
+        try:
+            await super().send(channel, message)
+        except ChannelFull:
+            LAYER_DROPPED.labels('capacity').inc()
+            raise
+        LAYER_DELIVERIES.labels('redis').inc()
+
+    async def group_send(self, group, message):
+        await super().group_send(group, _stamped(message))
+
+    def _map_channel_keys_to_connection(self, channel_names, message):
+        # the only place group_send exposes the member list (channels_redis 3.3); the members returned
+        # here are the ones it pushes through Redis
+        LAYER_FANOUT.observe(len(channel_names))
+        remote = list()
+        for channel in channel_names:
+            if channel in self.local_groups:
+                self.receive_buffer[channel].put_nowait(message)
+            else:
+                remote.append(channel)
+        LAYER_DELIVERIES.labels('local').inc(len(channel_names) - len(remote))
+        LAYER_DELIVERIES.labels('redis').inc(len(remote))
+        return super()._map_channel_keys_to_connection(remote, message)
+
+
+class InstrumentedInMemoryChannelLayer(InMemoryChannelLayer):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        _layers.add(self)
+
+    def buffered(self) -> int:
+        return sum(queue.qsize() for queue in self.channels.values())
+
+    async def send(self, channel, message):
+        try:
+            await super().send(channel, _stamped(message))
+        except ChannelFull:
+            LAYER_DROPPED.labels('capacity').inc()
+            raise
+
+    async def group_send(self, group, message):
+        LAYER_FANOUT.observe(len(self.groups.get(group, ())))
+        await super().group_send(group, _stamped(message))
+
+
+LAYER_BUFFERED.set_function(lambda: sum(layer.buffered() for layer in list(_layers)))
@@ -0,0 +1,270 @@
+import bisect
+import logging
+import time
+from typing import Dict, List, Optional, Tuple
+
+from asgiref.sync import sync_to_async
+from channels.layers import get_channel_layer
+
+from quiz.models import QuizGame, Participant
+from quiz.shared_state import redis_connection
+
+LEADERBOARD_TTL = 6 * 3600
+
+# (participant id, score, answer attempts, correct answers)
+Entry = Tuple[int, int, int, int]
+
+# scores are recorded whether the board is built or not, a build running meanwhile must not undo them
+RECORD_LUA = """
+    for i = 1, #ARGV - 1, 4 do
+        redis.call('ZADD', KEYS[1], ARGV[i + 1], ARGV[i])
+        redis.call('HSET', KEYS[3], ARGV[i], ARGV[i + 2] .. ':' .. ARGV[i + 3])
+    end
+    redis.call('EXPIRE', KEYS[1], ARGV[#ARGV])
+    redis.call('EXPIRE', KEYS[3], ARGV[#ARGV])
+    return 1
+"""
+
+# rows read from the database only fill in players nothing was recorded for since
+BUILD_LUA = """
+    for i = 1, #ARGV - 1, 5 do
+        redis.call('ZADD', KEYS[1], 'NX', ARGV[i + 1], ARGV[i])
+        redis.call('HSET', KEYS[2], ARGV[i], ARGV[i + 2])
+        redis.call('HSETNX', KEYS[3], ARGV[i], ARGV[i + 3] .. ':' .. ARGV[i + 4])
+    end
+    for _, key in ipairs(KEYS) do
+        redis.call('EXPIRE', key, ARGV[#ARGV])
+    end
+    return 1
+"""
+
+# a player who joins a built board; an unbuilt one picks them up when it is built
+JOIN_LUA = """
+    if redis.call('EXISTS', KEYS[2]) == 1 then
+        redis.call('HSET', KEYS[2], ARGV[1], ARGV[3])
+        redis.call('ZADD', KEYS[1], 'NX', ARGV[2], ARGV[1])
+        redis.call('HSETNX', KEYS[3], ARGV[1], ARGV[4] .. ':' .. ARGV[5])
+    end
+    return 1
+"""
+
+logger = logging.getLogger(__name__)
+
+
+class _LocalBoard:
+    """
+    In-process stand-in for the sorted set: ``order`` holds (-score, id)
+    pairs sorted, so top-K is a slice and a rank is a bisect.
+    """
+
+    def __init__(self, rows: List[dict]):
+        self.names = {row['id']: row['name'] for row in rows}
+        self.scores = dict()
+        self.stats = dict()
+        self.order = list()
+        self.expires = time.monotonic() + LEADERBOARD_TTL
+        for row in rows:
+            self.set(row['id'], row['score'], row['attempts'], row['correct'])
+
+    def set(self, participant_id: int, score: int, attempts: int, correct: int) -> None:
+        if participant_id in self.scores:
+            del self.order[bisect.bisect_left(self.order, (-self.scores[participant_id], participant_id))]
+        bisect.insort(self.order, (-score, participant_id))
+        self.scores[participant_id] = score
+        self.stats[participant_id] = (attempts, correct)
+
+
+_local: Dict[int, _LocalBoard] = dict()
+# entries recorded while the local board of a game is being read from the database
+_building: Dict[int, Dict[int, Entry]] = dict()
+
+
+def _keys(channel_layer, game_id: int) -> List[str]:
+    base = f"{getattr(channel_layer, 'prefix', 'asgi')}:leaderboard:{game_id}"
+    return [base, f'{base}:names', f'{base}:stats']
+
+
+def _rows(game_id: int) -> List[dict]:
+    rows = [{"id": p['id'], "name": p['user__username'], "score": p['score'], "attempts": p['answer_attempts'],
+             "correct": p['correct_answers']}
+            for p in Participant.objects.filter(game_id=game_id).values(
+                'id', 'user__username', 'score', 'answer_attempts', 'correct_answers')]
+    if not rows and not QuizGame.objects.filter(id=game_id).exists():
+        raise QuizGame.DoesNotExist
+    return rows
+
+
+async def _ensure(conn, keys: List[str], game_id: int) -> None:
+    if not await conn.exists(keys[1]):
+        rows = await sync_to_async(_rows)(game_id)
+        if rows:
+            await conn.eval(BUILD_LUA, keys=keys, args=[
+                value for row in rows
+                for value in (row['id'], row['score'], row['name'], row['attempts'], row['correct'])
+            ] + [LEADERBOARD_TTL])
+
+
+def _live(board: Optional[_LocalBoard]) -> bool:
+    return board is not None and board.expires >= time.monotonic()
+
+
+async def _local_board(game_id: int) -> _LocalBoard:
+    board = _local.get(game_id)
+    if _live(board):
+        return board
+    now = time.monotonic()
+    for expired in [g_id for g_id, kept in _local.items() if kept.expires < now]:
+        del _local[expired]
+    recorded = _building.setdefault(game_id, dict())
+    try:
+        rows = await sync_to_async(_rows)(game_id)
+    finally:
+        if _building.get(game_id) is recorded:
+            del _building[game_id]
+    # another read of the same game may have built the board meanwhile, it is as fresh and kept current
+    if _live(_local.get(game_id)):
+        return _local[game_id]
+    board = _local[game_id] = _LocalBoard(rows)
+    for participant_id, score, attempts, correct in recorded.values():
+        if participant_id in board.names:
+            board.set(participant_id, score, attempts, correct)
+    return board
+
+
+async def top(game_id: int, limit: Optional[int] = None) -> List[dict]:
+    """Best ``limit`` players, all of them by default, highest score first."""
+    layer = get_channel_layer()
+    keys = _keys(layer, game_id)
+    connection = redis_connection(layer, keys[0])
+    if connection is None:
+        board = await _local_board(game_id)
+        return [{"id": p_id, "name": board.names[p_id], "score": -score}
+                for score, p_id in board.order[:limit]]
+    async with connection as conn:
+        await _ensure(conn, keys, game_id)
+        leaders = await conn.zrevrange(keys[0], 0, -1 if limit is None else limit - 1, withscores=True)
+        if not leaders:
+            return list()
+        names = await conn.hmget(keys[1], *[member for member, score in leaders])
+    return [{"id": int(member), "name": name.decode(), "score": int(score)}
+            for (member, score), name in zip(leaders, names)]
+
+
+async def rank(game_id: int, participant_id: int) -> Optional[int]:
+    """1-based place of the participant, None if they are not in the game."""
+    layer = get_channel_layer()
+    keys = _keys(layer, game_id)
+    connection = redis_connection(layer, keys[0])
+    if connection is None:
+        board = await _local_board(game_id)
+        if participant_id not in board.scores:
+            return None
+        return bisect.bisect_left(board.order, (-board.scores[participant_id], participant_id)) + 1
+    async with connection as conn:
+        await _ensure(conn, keys, game_id)
+        place = await conn.zrevrank(keys[0], participant_id)
+    return None if place is None else place + 1
+
+
+async def standings(game_id: int) -> List[dict]:
+    """The whole table with answer statistics, for the results screen."""
+    layer = get_channel_layer()
+    keys = _keys(layer, game_id)
+    connection = redis_connection(layer, keys[0])
+    if connection is None:
+        board = await _local_board(game_id)
+        return [{"id": p_id, "name": board.names[p_id], "score": -score, "attempts": board.stats[p_id][0],
+                 "correct": board.stats[p_id][1]} for score, p_id in board.order]
+    async with connection as conn:
+        await _ensure(conn, keys, game_id)
+        leaders = await conn.zrevrange(keys[0], 0, -1, withscores=True)
+        if not leaders:
+            return list()
+        members = [member for member, score in leaders]
+        names = await conn.hmget(keys[1], *members)
+        stats = await conn.hmget(keys[2], *members)
+    result = list()
+    for (member, score), name, stat in zip(leaders, names, stats):
+        attempts, correct = stat.decode().split(':')
+        result.append({"id": int(member), "name": name.decode(), "score": int(score), "attempts": int(attempts),
+                       "correct": int(correct)})
+    return result
+
+
+async def roster(game_id: int) -> List[dict]:
+    """Players by name, the order the game master picks them in."""
+    layer = get_channel_layer()
+    keys = _keys(layer, game_id)
+    connection = redis_connection(layer, keys[0])
+    if connection is None:
+        names = (await _local_board(game_id)).names
+    else:
+        async with connection as conn:
+            await _ensure(conn, keys, game_id)
+            names = {int(member): name.decode() for member, name in (await conn.hgetall(keys[1])).items()}
+    return [{"id": p_id, "name": name} for p_id, name in sorted(names.items(), key=lambda item: item[1])]
+
+
+async def record(game_id: int, entries: List[Entry]) -> None:
+    """
+    Applies scores that are already written to the database. They are kept
+    even while the board is not built yet, building it from the database
+    never overwrites them.
+    """
+    if not entries:
+        return
+    layer = get_channel_layer()
+    keys = _keys(layer, game_id)
+    connection = redis_connection(layer, keys[0])
+    if connection is None:
+        board = _local.get(game_id)
+        if board is not None:
+            for participant_id, score, attempts, correct in entries:
+                if participant_id in board.names:
+                    board.set(participant_id, score, attempts, correct)
+        if game_id in _building:
+            _building[game_id].update((entry[0], entry) for entry in entries)
+        return
+    async with connection as conn:
+        await conn.eval(RECORD_LUA, keys=keys,
+                        args=[value for entry in entries for value in entry] + [LEADERBOARD_TTL])
+
+
+async def join(game_id: int, row: dict) -> None:
+    """Adds a player who joined after the board was built, ``row`` as ``_rows`` gives it."""
+    layer = get_channel_layer()
+    keys = _keys(layer, game_id)
+    connection = redis_connection(layer, keys[0])
+    if connection is None:
+        board = _local.get(game_id)
+        if board is not None and row['id'] not in board.names:
+            board.names[row['id']] = row['name']
+            board.set(row['id'], row['score'], row['attempts'], row['correct'])
+        return
+    async with connection as conn:
+        await conn.eval(JOIN_LUA, keys=keys,
+                        args=[row['id'], row['score'], row['name'], row['attempts'], row['correct']])
+
+
+async def forget(game_id: int) -> None:
+    layer = get_channel_layer()
+    keys = _keys(layer, game_id)
+    connection = redis_connection(layer, keys[0])
+    if connection is None:
+        _local.pop(game_id, None)
+        return
+    async with connection as conn:
+        await conn.delete(*keys)
+
+
+async def retire(game_id: int, results: List[dict]) -> None:
+    """
+    Drops the board of a finished game, its final table is in the archive.
+    Scores that differ from the archived ones mean some scoring path
+    skipped ``record``.
+    """
+    kept = {entry['id']: entry['score'] for entry in await top(game_id)}
+    drift = [row['id'] for row in results if kept.get(row['id']) != row['score']]
+    if drift:
+        logger.warning('game %s: leaderboard drifted for participants %s', game_id, drift)
+    await forget(game_id)
@@ -0,0 +1,96 @@
+import logging
+import time
+from datetime import timedelta
+from typing import Coroutine, Dict, List
+
+from asgiref.sync import sync_to_async
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from quiz.archive import archive
+from quiz.models import QuizGame, Participant, Quiz
+
+# games are torn down this many at a time, one transaction each
+REAP_BATCH = 50
+# a game nobody played for this long is abandoned, same as the life of its leaderboard
+ABANDONED_AFTER = timedelta(hours=6)
+# the room engine and the HTTP scoring views refresh QuizGame.last_activity at most this often
+ACTIVITY_SECONDS = 60
+
+logger = logging.getLogger(__name__)
+
+# when this worker last refreshed last_activity of a game scored over HTTP
+_touched: Dict[int, float] = dict()
+
+
+def _end(game_id: int) -> List[dict]:
+    # players are free to join another game right away, the rows go with the reaper
+    with transaction.atomic():
+        results = archive(game_id)
+        QuizGame.objects.filter(id=game_id).update(ended=True)
+        Participant.objects.filter(game_id=game_id, active=True).update(active=False)
+    return results
+
+
+async def end(game_id: int) -> Coroutine:
+    return await sync_to_async(_end)(game_id)
+
+
+def _due(game_id: int) -> bool:
+    now = time.monotonic()
+    if now - _touched.get(game_id, 0.0) < ACTIVITY_SECONDS:
+        return False
+    for stale in [g_id for g_id, touched in _touched.items() if now - touched >= ACTIVITY_SECONDS]:
+        del _touched[stale]
+    _touched[game_id] = now
+    return True
+
+
+def touch_sync(game_id: int) -> None:
+    """``touch`` for views already running in a sync thread."""
+    if _due(game_id):
+        QuizGame.objects.filter(id=game_id).update(last_activity=timezone.now())
+
+
+async def touch(game_id: int) -> Coroutine:
+    """Keeps a game played over HTTP away from the reaper, one write per ``ACTIVITY_SECONDS``."""
+    if _due(game_id):
+        await sync_to_async(QuizGame.objects.filter(id=game_id).update)(last_activity=timezone.now())
+
+
+def _reap_batch(batch: int) -> List[int]:
+    cutoff = timezone.now() - ABANDONED_AFTER
+    with transaction.atomic():
+        games = list(QuizGame.objects.select_for_update(skip_locked=True).filter(
+            Q(ended=True) | Q(last_activity__lt=cutoff)).values_list('id', 'ended', 'quiz_id')[:batch])
+        game_ids = [game_id for game_id, ended, quiz_id in games]
+        if game_ids:
+            # ended games were archived by end(), abandoned ones keep their table the same way
+            for game_id, ended, quiz_id in games:
+                if not ended:
+                    archive(game_id)
+            Participant.objects.filter(game_id__in=game_ids).delete()
+            QuizGame.objects.filter(id__in=game_ids).delete()
+            # games created before they ran on the prototype played a creator-less clone of it
+            Quiz.objects.filter(id__in={quiz_id for game_id, ended, quiz_id in games}, creator__isnull=True,
+                                quiz_game__isnull=True).delete()
+    return game_ids
+
+
+async def reap(batch: int = REAP_BATCH) -> Coroutine:
+    """
+    Deletes ended games and the ones idle for ``ABANDONED_AFTER`` with their
+    participants, ``batch`` games per transaction, so the request path never
+    pays for the cascade and the live tables only hold running games.
+    Abandoned games are archived first, their results stay readable.
+    Returns the number of games deleted.
+    """
+    reaped = 0
+    while True:
+        game_ids = await sync_to_async(_reap_batch)(batch)
+        reaped += len(game_ids)
+        if game_ids:
+            logger.info('reaped games %s', game_ids)
+        if len(game_ids) < batch:
+            return reaped
@@ -0,0 +1,86 @@
+import asyncio
+import time
+from typing import Callable, List
+
+from asgiref.sync import sync_to_async
+from django.core.management.base import BaseCommand, CommandError
+from django.test import RequestFactory
+
+from quiz import async_db
+from quiz.async_methods import _score_pl, _corr_ans
+from quiz.board_cache import _board_entry, _build_board
+from quiz.management.seed import seed_game
+from quiz.models import AnsweredQuestion, Question
+
+
+def percentile(samples: List[float], share: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * share))]
+
+
+class Command(BaseCommand):
+    help = 'Compares p50/p99 latency of the asyncpg path with the sync_to_async wrappers on a seeded game'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=500)
+        parser.add_argument('--concurrency', type=int, default=20)
+        parser.add_argument('--players', type=int, default=20)
+
+    def handle(self, *args, **options):
+        if not async_db.enabled():
+            raise CommandError('the asyncpg path needs PostgreSQL and ASYNC_DB_POOL')
+        seeded = seed_game(players=options['players'])
+        try:
+            asyncio.run(self.run(seeded, options['iterations'], options['concurrency']))
+        finally:
+            seeded.delete()
+
+    async def measure(self, call: Callable, iterations: int, concurrency: int, reset: Callable = None) -> List[float]:
+        samples = list()
+
+        async def timed(index):
+            started = time.perf_counter()
+            await call(index)
+            samples.append((time.perf_counter() - started) * 1000)
+
+        for batch in range(0, iterations, concurrency):
+            await asyncio.gather(*[timed(index) for index in range(batch, min(batch + concurrency, iterations))])
+            if reset is not None:
+                await reset()
+        return samples
+
+    async def run(self, seeded, iterations: int, concurrency: int) -> None:
+        game_id = seeded.game.id
+        player = seeded.players[0]
+        request = RequestFactory().get('/', {'quiz_game_id': game_id})
+        request.user = player
+        questions = await sync_to_async(list)(
+            Question.objects.filter(category__quiz=seeded.quiz).values_list('id', flat=True))
+        if len(questions) < concurrency:
+            raise CommandError(f'the seeded quiz has only {len(questions)} questions, lower --concurrency')
+
+        async def reset():
+            await sync_to_async(AnsweredQuestion.objects.filter(game_id=game_id).delete)()
+
+        def question(index):
+            return questions[index % concurrency]
+
+        cases = [
+            ('player_score', lambda i: sync_to_async(_score_pl)(request),
+             lambda i: async_db.player_score(player.id, game_id), None),
+            ('quiz_game_round', lambda i: sync_to_async(_build_board)(game_id, 1, 'bench'),
+             lambda i: self.async_board(game_id), None),
+            ('corr_answer', lambda i: sync_to_async(_corr_ans)({"question_id": question(i), "player_id": player.id}),
+             lambda i: async_db.corr_ans(question(i), player.id), reset),
+        ]
+        await async_db.get_pool()
+        self.stdout.write(f'{"endpoint":<20}{"path":<16}{"p50 ms":>10}{"p99 ms":>10}')
+        for name, sync_call, async_call, case_reset in cases:
+            for path, call in (('sync_to_async', sync_call), ('asyncpg', async_call)):
+                samples = await self.measure(call, iterations, concurrency, case_reset)
+                self.stdout.write(f'{name:<20}{path:<16}{percentile(samples, 0.5):>10.2f}'
+                                  f'{percentile(samples, 0.99):>10.2f}')
+
+    @staticmethod
+    async def async_board(game_id: int) -> dict:
+        return _board_entry(await async_db.board_rows(game_id, 1))
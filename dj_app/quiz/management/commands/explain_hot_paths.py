@@ -0,0 +1,77 @@
+import time
+from typing import List
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import QuerySet
+
+from quiz.management.seed import seed_game, SeededGame
+from quiz.models import QuizGame, Participant, QuestionCategory, Question
+
+
+class Command(BaseCommand):
+    help = 'Seeds a history of games and shows the plan of every hot lookup with and without its index'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--games', type=int, default=200)
+        parser.add_argument('--players', type=int, default=20)
+        parser.add_argument('--open', type=int, default=5, help='games that are not started yet')
+        parser.add_argument('--repeat', type=int, default=200, help='runs per query for the mean time')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError('partial and covering indexes are only created on PostgreSQL')
+        seeded = self.seed(options['games'], options['players'], options['open'])
+        try:
+            regular = seeded[-1].players[0]
+            game = seeded[-1].game
+            category = QuestionCategory.objects.filter(quiz_id=game.quiz_id, round=1).first()
+            cases = [
+                ('participant_active_user_idx', Participant.objects.filter(user=regular, active=True)),
+                ('participant_game_score_idx', Participant.objects.filter(game=game).order_by('-score')),
+                ('quizgame_open_idx', QuizGame.objects.filter(started=False, ended=False).values('id', 'name',
+                                                                                                 'room_name')),
+                ('category_quiz_round_idx', QuestionCategory.objects.filter(quiz_id=game.quiz_id, round=1)),
+                ('question_category_value_idx', Question.objects.filter(category=category).order_by('value')),
+            ]
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE')
+            for index, queryset in cases:
+                self.stdout.write(self.style.MIGRATE_HEADING(index))
+                self.compare(index, queryset, options['repeat'])
+        finally:
+            for game in seeded:
+                game.delete()
+
+    def seed(self, games: int, players: int, open_games: int) -> List[SeededGame]:
+        """
+        Every finished game gets its own players plus the players of the last
+        game, so the lookups by user have to skip a long inactive history.
+        """
+        seeded = [seed_game(players=players, started=number < games - open_games) for number in range(games)]
+        finished = [game.game for game in seeded[:-1]]
+        Participant.objects.filter(game__in=finished).update(active=False)
+        Participant.objects.bulk_create([Participant(user=user, game=game, active=False, score=100 * number)
+                                         for number, game in enumerate(finished) for user in seeded[-1].players])
+        return seeded
+
+    def compare(self, index: str, queryset: QuerySet, repeat: int) -> None:
+        self.report('with', queryset, repeat)
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                cursor.execute(f'DROP INDEX {connection.ops.quote_name(index)}')
+            self.report('without', queryset, repeat)
+            transaction.set_rollback(True)
+
+    def report(self, label: str, queryset: QuerySet, repeat: int) -> None:
+        plan = queryset.explain(analyze=True)
+        sql, params = queryset.query.sql_with_params()
+        with connection.cursor() as cursor:
+            started = time.perf_counter()
+            for _ in range(repeat):
+                cursor.execute(sql, params)
+                cursor.fetchall()
+        mean = (time.perf_counter() - started) * 1000 / repeat
+        self.stdout.write(f'  {label} index, {mean:.3f} ms per query:')
+        for line in plan.splitlines():
+            self.stdout.write(f'    {line}')
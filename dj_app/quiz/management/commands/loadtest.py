@@ -0,0 +1,208 @@
+import asyncio
+import json
+import random
+import time
+from collections import defaultdict
+from importlib import import_module
+from typing import Dict, List
+
+import aiohttp
+import msgpack
+from django.conf import settings
+from django.contrib.auth import SESSION_KEY, BACKEND_SESSION_KEY, HASH_SESSION_KEY
+from django.core.management.base import BaseCommand
+
+from quiz import protocol
+from quiz.management.commands.bench_async_db import percentile
+from quiz.management.seed import seed_game, SeededGame
+from quiz.models import Question
+from users.models import CustomUser
+
+
+def _session(user: CustomUser) -> str:
+    session = import_module(settings.SESSION_ENGINE).SessionStore()
+    session[SESSION_KEY] = str(user.pk)
+    session[BACKEND_SESSION_KEY] = 'users.backends.CachedModelBackend'
+    session[HASH_SESSION_KEY] = user.get_session_auth_hash()
+    session.save()
+    return session.session_key
+
+
+class Stats:
+    def __init__(self):
+        self.latency: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+        self.requests: Dict[str, int] = defaultdict(int)
+        self.received = 0
+        self.sent = 0
+        self.frames = 0
+        self.bytes = 0
+
+
+class Room:
+    """
+    One seeded game driven over the real endpoints. Every socket reads in its
+    own task; a step waits until each of them has seen the broadcast it
+    expects and records the time since the step's first send.
+    """
+
+    def __init__(self, seeded: SeededGame, questions: List[int], sessions: Dict[int, str], stats: Stats,
+                 http: aiohttp.ClientSession, url: str, timeout: float, binary: bool):
+        self.seeded = seeded
+        self.questions = questions
+        self.sessions = sessions
+        self.stats = stats
+        self.http = http
+        self.url = url
+        self.timeout = timeout
+        self.binary = binary
+        self.sockets = dict()
+        self.readers = list()
+        self.expected = None
+        self.winner = None
+
+    async def call(self, user: CustomUser, name: str, payload: dict) -> bool:
+        started = time.perf_counter()
+        self.stats.requests[name] += 1
+        try:
+            async with self.http.post(f'{self.url}/quiz/{name}', data=json.dumps(payload),
+                                      cookies={settings.SESSION_COOKIE_NAME: self.sessions[user.id]}) as response:
+                await response.read()
+                if response.status >= 400:
+                    self.stats.errors[f'http {name} {response.status}'] += 1
+                    return False
+        except aiohttp.ClientError as error:
+            self.stats.errors[f'http {name} {type(error).__name__}'] += 1
+            return False
+        self.stats.latency[f'http {name}'].append((time.perf_counter() - started) * 1000)
+        return True
+
+    async def send(self, user: CustomUser, message: dict) -> None:
+        self.stats.sent += 1
+        if self.binary:
+            fields = {key: value for key, value in message.items() if key != 'message'}
+            await self.sockets[user.id].send_bytes(msgpack.packb([protocol.CODES[message['message']], fields]))
+        else:
+            await self.sockets[user.id].send_str(json.dumps(message))
+
+    async def read(self, socket) -> None:
+        async for message in socket:
+            if message.type == aiohttp.WSMsgType.TEXT:
+                events = [json.loads(message.data)]
+            elif message.type == aiohttp.WSMsgType.BINARY:
+                events = [dict(fields, message=protocol.NAMES[code]) for code, fields in msgpack.unpackb(message.data)]
+            else:
+                break
+            self.stats.frames += 1
+            self.stats.bytes += len(message.data)
+            for data in events:
+                self.read_event(data)
+
+    def read_event(self, data: dict) -> None:
+        self.stats.received += 1
+        expected = self.expected
+        if data.get('message') == 'block':
+            self.winner = data['user_id']
+        if expected is not None and data.get('message') == expected['kind']:
+            elapsed = (time.perf_counter() - expected['started']) * 1000
+            self.stats.latency[f"ws {expected['kind']}"].append(elapsed)
+            expected['left'] -= 1
+            if expected['left'] == 0:
+                expected['done'].set()
+
+    async def broadcast(self, kind: str, sends) -> None:
+        self.expected = {"kind": kind, "started": time.perf_counter(), "left": len(self.sockets),
+                         "done": asyncio.Event()}
+        await asyncio.gather(*sends)
+        try:
+            await asyncio.wait_for(self.expected['done'].wait(), self.timeout)
+        except asyncio.TimeoutError:
+            self.stats.errors[f'ws {kind} timeout'] += self.expected['left']
+        self.expected = None
+
+    async def buzz(self, question_id: int) -> CustomUser:
+        # a few players hit the button at once, only the first one may block the board
+        racers = random.sample(self.seeded.players, min(3, len(self.seeded.players)))
+        self.winner = None
+        await self.broadcast('block', [self.send(player, {"message": "ready", "question_id": question_id})
+                                       for player in racers])
+        return next((player for player in racers if player.id == self.winner), racers[0])
+
+    async def run(self) -> None:
+        game_master, game = self.seeded.game_master, self.seeded.game
+        await asyncio.gather(*[self.call(player, 'connect', {"game_id": game.id}) for player in self.seeded.players])
+        for user in [game_master] + self.seeded.players:
+            try:
+                socket = await self.http.ws_connect(
+                    f"{self.url.replace('http', 'ws', 1)}/ws/game/{game.room_name}/",
+                    headers={'Cookie': f'{settings.SESSION_COOKIE_NAME}={self.sessions[user.id]}'},
+                    protocols=(protocol.MSGPACK_SUBPROTOCOL,) if self.binary else ())
+            except aiohttp.ClientError as error:
+                self.stats.errors[f'ws connect {type(error).__name__}'] += 1
+                continue
+            self.sockets[user.id] = socket
+            self.readers.append(asyncio.ensure_future(self.read(socket)))
+        await self.call(game_master, 'start_game', {"game_id": game.id})
+        for question_id in self.questions:
+            player = await self.buzz(question_id)
+            if random.random() < 0.5:
+                await self.call(game_master, 'wrong_answer', {"question_id": question_id, "player_id": player.id})
+                await self.broadcast('unlocked', [self.send(game_master, {"message": "unlock"})])
+                player = await self.buzz(question_id)
+            await self.call(game_master, 'corr_answer', {"question_id": question_id, "player_id": player.id})
+            await self.broadcast('updated', [self.send(game_master, {"message": "update"})])
+        for socket in self.sockets.values():
+            await socket.close()
+        await asyncio.gather(*self.readers, return_exceptions=True)
+
+
+class Command(BaseCommand):
+    help = ('Plays seeded games against a running server (daphne with the Redis or the in-memory channel layer) '
+            'and reports broadcast latency, throughput and errors. Run it with the same settings as the server.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://127.0.0.1:3001')
+        parser.add_argument('--rooms', type=int, default=50)
+        parser.add_argument('--players', type=int, default=20)
+        parser.add_argument('--questions', type=int, default=10, help='questions played in every room')
+        parser.add_argument('--timeout', type=float, default=5, help='seconds to wait for a broadcast')
+        parser.add_argument('--binary', action='store_true', help='use the MessagePack protocol instead of JSON')
+
+    def handle(self, *args, **options):
+        themes = max(1, -(-options['questions'] // 5))
+        seeded = [seed_game(players=options['players'], rounds=1, themes=themes, started=False)
+                  for _ in range(options['rooms'])]
+        try:
+            sessions = {user.id: _session(user) for game in seeded for user in [game.game_master] + game.players}
+            questions = {game.game.id: list(Question.objects.filter(category__quiz=game.quiz).order_by(
+                'category_id', 'value').values_list('id', flat=True))[:options['questions']] for game in seeded}
+            stats = Stats()
+            started = time.perf_counter()
+            asyncio.run(self.run(seeded, questions, sessions, stats, options))
+            self.report(stats, time.perf_counter() - started)
+        finally:
+            for game in seeded:
+                game.delete()
+
+    async def run(self, seeded: List[SeededGame], questions: dict, sessions: dict, stats: Stats, options) -> None:
+        connector = aiohttp.TCPConnector(limit=0)
+        async with aiohttp.ClientSession(connector=connector, headers={'Content-Type': 'application/json'}) as http:
+            rooms = [Room(game, questions[game.game.id], sessions, stats, http, options['url'], options['timeout'],
+                          options['binary']) for game in seeded]
+            await asyncio.gather(*[room.run() for room in rooms])
+
+    def report(self, stats: Stats, elapsed: float) -> None:
+        self.stdout.write(f'{"step":<24}{"count":>8}{"p50 ms":>10}{"p95 ms":>10}{"p99 ms":>10}{"max ms":>10}')
+        for name, samples in sorted(stats.latency.items()):
+            self.stdout.write(f'{name:<24}{len(samples):>8}{percentile(samples, 0.5):>10.2f}'
+                              f'{percentile(samples, 0.95):>10.2f}{percentile(samples, 0.99):>10.2f}'
+                              f'{max(samples):>10.2f}')
+        requests = sum(stats.requests.values())
+        self.stdout.write(f'\n{elapsed:.1f} s, {stats.sent} ws messages sent, {stats.received} received '
+                          f'({stats.received / elapsed:.0f}/s), {requests} http requests ({requests / elapsed:.0f}/s)')
+        self.stdout.write(f'{stats.frames} frames received, {stats.bytes} bytes '
+                          f'({stats.bytes / max(1, stats.received):.1f} per message)')
+        errors = sum(stats.errors.values())
+        self.stdout.write(f'errors: {errors} ({errors / max(1, requests + stats.sent) * 100:.2f} % of operations)')
+        for name, count in sorted(stats.errors.items()):
+            self.stdout.write(f'  {name}: {count}')
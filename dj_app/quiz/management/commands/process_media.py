@@ -0,0 +1,25 @@
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+
+from quiz.media import process_image, process_audio
+from quiz.models import Question
+
+
+class Command(BaseCommand):
+    help = 'Runs images and audio uploaded before the media pipeline through it'
+
+    def handle(self, *args, **options):
+        processed = 0
+        for question in Question.objects.exclude(image='').exclude(image__isnull=True).filter(image_variants={}):
+            with default_storage.open(question.image.name) as file:
+                question.image_variants = process_image(file)
+            question.image = question.image_variants[max(question.image_variants, key=int)]
+            question.save(update_fields=['image', 'image_variants'])
+            processed += 1
+        for question in Question.objects.exclude(audio='').exclude(audio__isnull=True).exclude(
+                audio__startswith='assets/'):
+            with default_storage.open(question.audio.name) as file:
+                question.audio = process_audio(file)
+            question.save(update_fields=['audio'])
+            processed += 1
+        self.stdout.write(f'{processed} files processed')
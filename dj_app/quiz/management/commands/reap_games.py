@@ -0,0 +1,25 @@
+import asyncio
+
+from django.core.management.base import BaseCommand
+
+from quiz import lifecycle
+
+
+class Command(BaseCommand):
+    help = 'Deletes ended and abandoned games in batches, once or every --interval seconds'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=0, help='seconds between passes, 0 runs one pass')
+        parser.add_argument('--batch', type=int, default=lifecycle.REAP_BATCH, help='games per transaction')
+
+    def handle(self, *args, **options):
+        asyncio.run(self.run(options['interval'], options['batch']))
+
+    async def run(self, interval: float, batch: int) -> None:
+        while True:
+            reaped = await lifecycle.reap(batch)
+            if reaped or not interval:
+                self.stdout.write(f'{reaped} games reaped')
+            if not interval:
+                return
+            await asyncio.sleep(interval)
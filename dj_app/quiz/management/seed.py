@@ -0,0 +1,53 @@
+from dataclasses import dataclass
+from typing import List
+
+from django.contrib.auth.hashers import make_password
+
+from quiz.async_methods import get_code
+from quiz.models import Section, QuestionType, Quiz, QuestionCategory, Question, QuizGame, Participant
+from users.models import CustomUser
+
+
+@dataclass
+class SeededGame:
+    tag: str
+    password: str
+    game_master: CustomUser
+    quiz: Quiz
+    game: QuizGame
+    players: List[CustomUser]
+
+    def delete(self) -> None:
+        section_id = self.quiz.section_id
+        self.quiz.delete()
+        Section.objects.filter(id=section_id).delete()
+        CustomUser.objects.filter(id__in=[self.game_master.id] + [p.id for p in self.players]).delete()
+
+
+def seed_game(players: int = 20, rounds: int = 3, themes: int = 5, started: bool = True) -> SeededGame:
+    """
+    A complete quiz (``rounds`` x ``themes`` x 5 questions) with a game and
+    ``players`` participants. All users share one password so the hash is
+    computed once.
+    """
+    tag = get_code(8)
+    password = make_password(tag)
+    game_master = CustomUser.objects.create(email=f'gm-{tag}@seed.local', username=f'gm-{tag}', password=password)
+    section = Section.objects.create(name=f'seed {tag}', special_color='#808080')
+    question_type = QuestionType.objects.order_by('id').first() or QuestionType.objects.create(name='text')
+    quiz = Quiz.objects.create(creator=game_master, title=f'seed {tag}', section=section, completed=True)
+    questions = list()
+    for round in range(1, rounds + 1):
+        for number in range(themes):
+            theme = QuestionCategory.objects.create(name=f'theme {round}.{number}', round=round, quiz=quiz)
+            questions += [Question(text=f'question {value}', value=value, type=question_type, category=theme)
+                          for value in range(100, 600, 100)]
+    Question.objects.bulk_create(questions)
+    game = QuizGame.objects.create(name=f'seed {tag}', quiz=quiz, game_master=game_master, room_name=get_code(15),
+                                   started=started)
+    users = [CustomUser(email=f'player{number}-{tag}@seed.local', username=f'p{number}-{tag}', password=password)
+             for number in range(players)]
+    CustomUser.objects.bulk_create(users)
+    users = list(CustomUser.objects.filter(email__endswith=f'-{tag}@seed.local', email__startswith='player'))
+    Participant.objects.bulk_create([Participant(user=user, game=game) for user in users])
+    return SeededGame(tag, tag, game_master, quiz, game, users)
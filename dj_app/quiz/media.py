@@ -0,0 +1,182 @@
+import hashlib
+import logging
+import os
+import shutil
+import subprocess
+import tempfile
+from io import BytesIO
+from typing import Dict, List, Optional
+
+from django.core.cache import cache
+from django.core.files import File
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+IMAGE_WIDTHS = (480, 960, 1600)
+IMAGE_QUALITY = 80
+AUDIO_ARGS = ['-vn', '-af', 'loudnorm=I=-16:TP=-1.5:LRA=11', '-ac', '1', '-ar', '44100', '-b:a', '96k']
+# ffmpeg runs in the request, off the ORM's thread; a file it can't get through in this many seconds is kept as uploaded
+AUDIO_TIMEOUT = 60
+# stored files never change, the TTL only bounds the cache their sizes and hashes take
+ASSET_TTL = 24 * 3600
+
+logger = logging.getLogger(__name__)
+
+
+class RejectedUpload(ValueError):
+    """An uploaded file that is not processed or stored at all."""
+
+
+def _digest(upload) -> str:
+    sha = hashlib.sha256()
+    for chunk in upload.chunks():
+        sha.update(chunk)
+    upload.seek(0)
+    return sha.hexdigest()
+
+
+def _folder(digest: str) -> str:
+    # uploads are addressed by their content, the same file uploaded twice is processed and kept once
+    return f'assets/{digest[:2]}/{digest}'
+
+
+def _save(name: str, content) -> str:
+    if not default_storage.exists(name):
+        default_storage.save(name, content)
+    return name
+
+
+def _original(upload, folder: str) -> str:
+    return _save(f'{folder}/original{os.path.splitext(upload.name)[1].lower()}', upload)
+
+
+def _flatten(image: Image.Image) -> Image.Image:
+    image = ImageOps.exif_transpose(image)
+    if image.mode in ('RGBA', 'LA', 'P'):
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, 'white')
+        background.paste(image, mask=image.getchannel('A'))
+        return background
+    return image.convert('RGB')
+
+
+def process_image(upload) -> Dict[str, str]:
+    """
+    Progressive JPEGs at every width of ``IMAGE_WIDTHS`` up to the size of the
+    original, which is never upscaled. Returns file names by width; a file
+    Pillow can't read is kept as uploaded under the largest width. An image
+    over Pillow's pixel limit raises ``RejectedUpload``.
+    """
+    folder = _folder(_digest(upload))
+    try:
+        with Image.open(upload) as source:
+            image = _flatten(source)
+    except Image.DecompressionBombError:
+        raise RejectedUpload(f'{upload.name} is too large an image')
+    except (UnidentifiedImageError, OSError):
+        logger.warning('%s is not a readable image, stored as uploaded', upload.name)
+        upload.seek(0)
+        return {str(IMAGE_WIDTHS[-1]): _original(upload, folder)}
+    variants = dict()
+    for width in IMAGE_WIDTHS:
+        name = f'{folder}/{width}.jpg'
+        if not default_storage.exists(name):
+            variant = image
+            if image.width > width:
+                variant = image.resize((width, max(1, round(image.height * width / image.width))), Image.LANCZOS)
+            buffer = BytesIO()
+            variant.save(buffer, 'JPEG', quality=IMAGE_QUALITY, optimize=True, progressive=True)
+            _save(name, ContentFile(buffer.getvalue()))
+        variants[str(width)] = name
+        if image.width <= width:
+            break
+    return variants
+
+
+def process_audio(upload) -> str:
+    """
+    Loudness-normalized mono MP3. Without ffmpeg, or when it fails or takes
+    longer than ``AUDIO_TIMEOUT``, the file is kept as uploaded.
+    """
+    folder = _folder(_digest(upload))
+    name = f'{folder}/audio.mp3'
+    if default_storage.exists(name):
+        return name
+    ffmpeg = shutil.which('ffmpeg')
+    if ffmpeg is None:
+        logger.warning('ffmpeg is not installed, %s stored as uploaded', upload.name)
+        return _original(upload, folder)
+    with tempfile.TemporaryDirectory() as workdir:
+        source = os.path.join(workdir, 'source')
+        target = os.path.join(workdir, 'audio.mp3')
+        with open(source, 'wb') as file:
+            for chunk in upload.chunks():
+                file.write(chunk)
+        try:
+            result = subprocess.run([ffmpeg, '-y', '-loglevel', 'error', '-i', source] + AUDIO_ARGS + [target],
+                                    stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=AUDIO_TIMEOUT)
+        except subprocess.TimeoutExpired:
+            logger.warning('ffmpeg timed out on %s, stored as uploaded', upload.name)
+            upload.seek(0)
+            return _original(upload, folder)
+        if result.returncode != 0:
+            logger.warning('ffmpeg failed on %s: %s', upload.name, result.stderr.decode(errors='replace').strip())
+            upload.seek(0)
+            return _original(upload, folder)
+        with open(target, 'rb') as file:
+            return _save(name, File(file))
+
+
+def process_uploads(files) -> dict:
+    """
+    Runs the uploaded image and audio through the pipeline and returns the
+    question fields they set. Pillow and ffmpeg take seconds, so callers run
+    this outside the thread the ORM calls of the process share.
+    """
+    fields = dict()
+    if 'image' in files:
+        variants = process_image(files['image'])
+        fields.update(image_variants=variants, image=variants[max(variants, key=int)])
+    if 'audio' in files:
+        fields['audio'] = process_audio(files['audio'])
+    return fields
+
+
+def attach_media(question, fields: dict) -> List[str]:
+    """Sets the fields ``process_uploads`` returned on ``question``, returns their names."""
+    for name, value in fields.items():
+        setattr(question, name, value)
+    return list(fields)
+
+
+def pick_variant(variants: Dict[str, str], fallback: Optional[str], width: Optional[int]) -> Optional[str]:
+    """
+    The narrowest variant at least ``width`` pixels wide, the widest one when
+    none is or no width is given. Questions uploaded before the variants
+    existed only have ``fallback``.
+    """
+    if not variants:
+        return fallback or None
+    widths = sorted(int(w) for w in variants)
+    chosen = next((w for w in widths if width and w >= width), widths[-1])
+    return variants[str(chosen)]
+
+
+def asset_info(names: List[str]) -> Dict[str, dict]:
+    """
+    Size and sha256 of stored files, cached for ``ASSET_TTL``. Missing files
+    are left out.
+    """
+    info = {key[len('asset:'):]: value for key, value in cache.get_many([f'asset:{name}' for name in names]).items()}
+    for name in set(names) - set(info):
+        if not default_storage.exists(name):
+            continue
+        sha = hashlib.sha256()
+        with default_storage.open(name) as file:
+            for chunk in file.chunks():
+                sha.update(chunk)
+        info[name] = {"size": default_storage.size(name), "hash": sha.hexdigest()}
+        cache.set(f'asset:{name}', info[name], ASSET_TTL)
+    return info
+
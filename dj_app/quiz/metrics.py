@@ -0,0 +1,160 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import ContextVar
+from typing import Dict
+
+from asgiref.sync import SyncToAsync
+from django.db.backends.signals import connection_created
+from django.http import HttpRequest, HttpResponse
+from prometheus_client import Counter, Gauge, Histogram
+
+SECONDS_BUCKETS = (.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 3, 4, 6, 8, 12, 16, 24, 32, 64)
+
+REQUEST_SECONDS = Histogram('quiz_http_request_seconds', 'Time to respond, by URL pattern',
+                            ['route', 'method'], buckets=SECONDS_BUCKETS)
+RESPONSES = Counter('quiz_http_responses', 'Responses by URL pattern and status', ['route', 'method', 'status'])
+REQUEST_QUERIES = Histogram('quiz_http_request_queries', 'ORM queries run by one request',
+                            ['route'], buckets=QUERY_BUCKETS)
+REQUEST_QUERY_SECONDS = Histogram('quiz_http_request_query_seconds', 'Time one request spent in ORM queries',
+                                  ['route'], buckets=SECONDS_BUCKETS)
+QUERY_SECONDS = Histogram('quiz_db_query_seconds', 'Time of a single ORM query, consumers included',
+                          buckets=SECONDS_BUCKETS)
+EXECUTOR_WAIT = Histogram('quiz_executor_wait_seconds', 'Time a sync_to_async call waits for the worker thread',
+                          buckets=SECONDS_BUCKETS)
+EXECUTOR_PENDING = Gauge('quiz_executor_pending', 'sync_to_async calls queued or running')
+
+WS_KINDS = ('ready', 'unlock', 'update', 'correct', 'wrong', 'nobody', 'round_completed', 'super_correct',
+            'super_wrong', 'sync', 'snapshot', 'bets_open', 'super_bet', 'super_answer', 'super_answers')
+FANOUT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+HTTP_METHODS = ('GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS')
+
+WS_SOCKETS = Gauge('quiz_ws_room_sockets', 'Open sockets of this process by room', ['room'])
+WS_RECEIVED = Counter('quiz_ws_received', 'Socket messages by kind', ['kind'])
+WS_RECEIVE_SECONDS = Histogram('quiz_ws_receive_seconds', 'Time to handle a socket message, group_send included',
+                               ['kind'], buckets=SECONDS_BUCKETS)
+WS_DELIVERY_SECONDS = Histogram('quiz_ws_delivery_seconds', 'From the receive or send that caused an event to its '
+                                'send on a socket', ['event'], buckets=SECONDS_BUCKETS)
+LAYER_FANOUT = Histogram('quiz_layer_group_fanout', 'Channels addressed by one group_send', buckets=FANOUT_BUCKETS)
+LAYER_DELIVERIES = Counter('quiz_layer_deliveries', 'Messages to consumers, in-process or through Redis', ['path'])
+LAYER_DROPPED = Counter('quiz_layer_dropped', 'Messages dropped by the channel layer', ['reason'])
+LAYER_BUFFERED = Gauge('quiz_layer_buffered_messages', 'Messages received for local consumers, not read yet')
+TIMERS_PENDING = Gauge('quiz_timers_pending', 'Game countdowns scheduled on the timer wheels of this process')
+
+
+class _RequestStats:
+    __slots__ = ('queries', 'seconds')
+
+    def __init__(self):
+        self.queries = 0
+        self.seconds = 0.0
+
+
+# sync_to_async copies the context into the worker thread, the stats object is shared with it
+_current = ContextVar('quiz_request_stats', default=None)
+
+
+def _record_query(execute, sql, params, many, context):
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        elapsed = time.perf_counter() - started
+        QUERY_SECONDS.observe(elapsed)
+        stats = _current.get()
+        if stats is not None:
+            stats.queries += 1
+            stats.seconds += elapsed
+
+
+def _instrument(sender, connection, **kwargs) -> None:
+    if _record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_record_query)
+
+
+class TimedExecutor(ThreadPoolExecutor):
+    """
+    Records how long every call waited in the queue. With Django 3.2 all
+    thread-sensitive ``sync_to_async`` calls of the process share one thread,
+    so a long wait here means the views are queueing for it.
+    """
+
+    def submit(self, fn, *args, **kwargs):
+        queued = time.perf_counter()
+
+        def run():
+            EXECUTOR_WAIT.observe(time.perf_counter() - queued)
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                EXECUTOR_PENDING.dec()
+
+        EXECUTOR_PENDING.inc()
+        return super().submit(run)
+
+
+def install() -> None:
+    """Wraps every new database connection and the shared sync_to_async thread."""
+    connection_created.connect(_instrument, dispatch_uid='quiz.metrics')
+    if not isinstance(SyncToAsync.single_thread_executor, TimedExecutor):
+        SyncToAsync.single_thread_executor = TimedExecutor(max_workers=1)
+
+
+_room_sockets: Dict[str, int] = dict()
+
+
+def socket_opened(room: str) -> None:
+    _room_sockets[room] = _room_sockets.get(room, 0) + 1
+    WS_SOCKETS.labels(room).set(_room_sockets[room])
+
+
+def socket_closed(room: str) -> None:
+    # rooms come and go, a finished one must not stay a series
+    if room not in _room_sockets:
+        return
+    left = _room_sockets.pop(room) - 1
+    if left > 0:
+        _room_sockets[room] = left
+        WS_SOCKETS.labels(room).set(left)
+    else:
+        WS_SOCKETS.remove(room)
+
+
+def socket_message(kind: str, elapsed: float) -> None:
+    kind = kind if kind in WS_KINDS else 'other'
+    WS_RECEIVED.labels(kind).inc()
+    WS_RECEIVE_SECONDS.labels(kind).observe(elapsed)
+
+
+def _route(request: HttpRequest) -> str:
+    # the URL pattern, not the path, keeps the label set bounded
+    match = request.resolver_match
+    return match.route if match is not None else 'unmatched'
+
+
+def _method(request: HttpRequest) -> str:
+    # clients can send any verb, the label set stays bounded the same way
+    return request.method if request.method in HTTP_METHODS else 'other'
+
+
+class MetricsMiddleware:
+    async_capable = True
+    sync_capable = False
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    async def __call__(self, request: HttpRequest) -> HttpResponse:
+        stats = _RequestStats()
+        token = _current.set(stats)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        route, method = _route(request), _method(request)
+        REQUEST_SECONDS.labels(route, method).observe(time.perf_counter() - started)
+        RESPONSES.labels(route, method, response.status_code).inc()
+        REQUEST_QUERIES.labels(route).observe(stats.queries)
+        REQUEST_QUERY_SECONDS.labels(route).observe(stats.seconds)
+        return response
@@ -0,0 +1,57 @@
+# Generated by Django 3.2.7 on 2026-10-18 20:03
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def keep_game_state(apps, schema_editor):
+    """
+    Games used to run on a clone of their quiz filled with InGameQuestion rows.
+    The clones still played get plain questions and their answered ones move
+    to AnsweredQuestion, the clones no game plays any more are deleted.
+    """
+    Quiz = apps.get_model('quiz', 'Quiz')
+    QuizGame = apps.get_model('quiz', 'QuizGame')
+    Question = apps.get_model('quiz', 'Question')
+    InGameQuestion = apps.get_model('quiz', 'InGameQuestion')
+    AnsweredQuestion = apps.get_model('quiz', 'AnsweredQuestion')
+    clone_ids = set(InGameQuestion.objects.values_list('category__quiz_id', flat=True))
+    games = dict()
+    for game_id, quiz_id in QuizGame.objects.filter(quiz_id__in=clone_ids).values_list('id', 'quiz_id'):
+        games.setdefault(quiz_id, []).append(game_id)
+    Quiz.objects.filter(id__in=clone_ids - games.keys()).delete()
+    answered = list()
+    for old in InGameQuestion.objects.filter(category__quiz_id__in=games.keys()).select_related('category'):
+        question = Question.objects.create(text=old.text, value=old.value, type_id=old.type_id,
+                                           category_id=old.category_id, image=old.image.name, audio=old.audio.name)
+        if not old.fresh:
+            answered += [AnsweredQuestion(game_id=game_id, question=question) for game_id in games[old.category.quiz_id]]
+    AnsweredQuestion.objects.bulk_create(answered)
+    # the deferred foreign key checks have to run before InGameQuestion is dropped in the same transaction
+    schema_editor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quiz', '0021_alter_quizgame_room_name'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AnsweredQuestion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('game', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='answered', to='quiz.quizgame', verbose_name='игра')),
+                ('question', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='quiz.question', verbose_name='вопрос')),
+            ],
+        ),
+        migrations.RunPython(keep_game_state, migrations.RunPython.noop),
+        migrations.DeleteModel(
+            name='InGameQuestion',
+        ),
+        migrations.AddConstraint(
+            model_name='answeredquestion',
+            constraint=models.UniqueConstraint(fields=('game', 'question'), name='unique_answered_question'),
+        ),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 3.2.7 on 2026-10-18 20:17
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quiz', '0022_auto_20261018_2003'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='participant',
+            name='game',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='participants', to='quiz.quizgame'),
+        ),
+        migrations.AlterField(
+            model_name='question',
+            name='category',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='questions', to='quiz.questioncategory', verbose_name='категории'),
+        ),
+        migrations.AlterField(
+            model_name='questioncategory',
+            name='quiz',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='q_category', to='quiz.quiz', verbose_name='квиз'),
+        ),
+        migrations.AddIndex(
+            model_name='participant',
+            index=models.Index(condition=models.Q(('active', True)), fields=['user'], name='participant_active_user_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='participant',
+            index=models.Index(fields=['game', '-score'], name='participant_game_score_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='question',
+            index=models.Index(fields=['category', 'value'], name='question_category_value_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='questioncategory',
+            index=models.Index(fields=['quiz', 'round'], name='category_quiz_round_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='quizgame',
+            index=models.Index(condition=models.Q(('started', False)), fields=['id'], include=('name', 'room_name'), name='quizgame_open_idx'),
+        ),
+    ]
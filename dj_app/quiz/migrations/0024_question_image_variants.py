@@ -0,0 +1,18 @@
+# Generated by Django 3.2.7 on 2026-10-18 20:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quiz', '0023_auto_20261018_2017'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='question',
+            name='image_variants',
+            field=models.JSONField(blank=True, default=dict, verbose_name='размеры изображения'),
+        ),
+    ]
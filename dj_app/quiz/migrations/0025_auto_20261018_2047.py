@@ -0,0 +1,40 @@
+# Generated by Django 3.2.7 on 2026-10-18 20:47
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quiz', '0024_question_image_variants'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='quizgame',
+            name='quizgame_open_idx',
+        ),
+        migrations.AddField(
+            model_name='quizgame',
+            name='ended',
+            field=models.BooleanField(default=False, verbose_name='завершена ли игра'),
+        ),
+        migrations.AddField(
+            model_name='quizgame',
+            name='last_activity',
+            field=models.DateTimeField(default=django.utils.timezone.now, verbose_name='последняя активность'),
+        ),
+        migrations.AddIndex(
+            model_name='quizgame',
+            index=models.Index(condition=models.Q(('ended', False), ('started', False)), fields=['id'], include=('name', 'room_name'), name='quizgame_open_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='quizgame',
+            index=models.Index(fields=['last_activity'], name='quizgame_activity_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='quizgame',
+            index=models.Index(condition=models.Q(('ended', True)), fields=['id'], name='quizgame_ended_idx'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 3.2.7 on 2026-10-18 20:50
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('quiz', '0025_auto_20261018_2047'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedGame',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False, verbose_name='id игры')),
+                ('name', models.CharField(max_length=64, verbose_name='название игры')),
+                ('finished', models.DateTimeField(default=django.utils.timezone.now, verbose_name='дата окончания')),
+                ('results', models.BinaryField(verbose_name='результаты игроков')),
+                ('game_master', models.ForeignKey(db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='archived_games', to=settings.AUTH_USER_MODEL, verbose_name='ведущий')),
+                ('quiz', models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='archived_games', to='quiz.quiz', verbose_name='квиз для игры')),
+            ],
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 3.2.7 on 2026-10-18 21:13
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quiz', '0026_archivedgame'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='quizgame',
+            name='quiz',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='quiz_game', to='quiz.quiz', verbose_name='квиз для игры'),
+        ),
+    ]
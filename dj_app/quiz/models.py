@@ -1,4 +1,5 @@
 from django.db import models
+from django.utils import timezone
 
 from users.models import CustomUser
 
@@ -21,46 +22,90 @@ class Quiz(models.Model):
 
 class QuizGame(models.Model):
     name = models.CharField(max_length=64, verbose_name='название игры')
-    quiz = models.ForeignKey(Quiz, verbose_name='квиз для игры', related_name='quiz_game', on_delete=models.CASCADE, null=True, blank=True)
+    # a quiz is deleted only once no game plays it
+    quiz = models.ForeignKey(Quiz, verbose_name='квиз для игры', related_name='quiz_game', on_delete=models.PROTECT,
+                             null=True, blank=True)
     timer = models.BooleanField(default=False, verbose_name='игра с таймером')
     current_round = models.PositiveSmallIntegerField(default=1, verbose_name='текущий раунд')
     game_master = models.ForeignKey(CustomUser, verbose_name='ведущий', on_delete=models.CASCADE, related_name='games',
                                     null=True)
     started = models.BooleanField(default=False, verbose_name='стартовала ли игра')
     room_name = models.CharField(max_length=32, default='test')
+    ended = models.BooleanField(default=False, verbose_name='завершена ли игра')
+    last_activity = models.DateTimeField(default=timezone.now, verbose_name='последняя активность')
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['id'], include=['name', 'room_name'],
+                         condition=models.Q(started=False, ended=False), name='quizgame_open_idx'),
+            models.Index(fields=['last_activity'], name='quizgame_activity_idx'),
+            models.Index(fields=['id'], condition=models.Q(ended=True), name='quizgame_ended_idx'),
+        ]
+
+
+class ArchivedGame(models.Model):
+    id = models.BigIntegerField(primary_key=True, verbose_name='id игры')
+    name = models.CharField(max_length=64, verbose_name='название игры')
+    # no constraints, so deleting a quiz or a user never has to walk the archive
+    quiz = models.ForeignKey(Quiz, verbose_name='квиз для игры', related_name='archived_games',
+                             on_delete=models.DO_NOTHING, db_constraint=False, null=True, blank=True)
+    game_master = models.ForeignKey(CustomUser, verbose_name='ведущий', related_name='archived_games',
+                                    on_delete=models.DO_NOTHING, db_constraint=False, null=True)
+    finished = models.DateTimeField(default=timezone.now, verbose_name='дата окончания')
+    results = models.BinaryField(verbose_name='результаты игроков')
 
 
 class Participant(models.Model):
     user = models.ForeignKey(CustomUser, verbose_name='создатель', on_delete=models.CASCADE)
     score = models.IntegerField(default=0)
-    game = models.ForeignKey(QuizGame, related_name='participants', on_delete=models.SET_NULL, null=True, blank=True)
+    game = models.ForeignKey(QuizGame, related_name='participants', on_delete=models.SET_NULL, null=True, blank=True,
+                             db_index=False)
     active = models.BooleanField(default=True)
     super_bet = models.PositiveSmallIntegerField(null=True, blank=True)
     super_answer = models.CharField(max_length=128, null=True, blank=True)
     answer_attempts = models.PositiveSmallIntegerField(default=0)
     correct_answers = models.PositiveSmallIntegerField(default=0)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['user'], condition=models.Q(active=True), name='participant_active_user_idx'),
+            models.Index(fields=['game', '-score'], name='participant_game_score_idx'),
+        ]
+
 
 class QuestionCategory(models.Model):
     name = models.CharField(max_length=64, verbose_name='название категории')
     round = models.PositiveSmallIntegerField(null=True, blank=True, verbose_name='текущий раунд')
-    quiz = models.ForeignKey(Quiz, verbose_name='квиз', related_name='q_category', on_delete=models.CASCADE)
+    quiz = models.ForeignKey(Quiz, verbose_name='квиз', related_name='q_category', on_delete=models.CASCADE,
+                             db_index=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['quiz', 'round'], name='category_quiz_round_idx'),
+        ]
 
 
 class Question(models.Model):
     text = models.CharField(max_length=512, verbose_name='текст вопроса')
     value = models.PositiveSmallIntegerField(verbose_name='стоимость вопроса', null=True, blank=True)
     type = models.ForeignKey(QuestionType, verbose_name='тип вопроса', on_delete=models.CASCADE)
-    category = models.ForeignKey(QuestionCategory, verbose_name='категории', related_name='questions', on_delete=models.CASCADE)
+    category = models.ForeignKey(QuestionCategory, verbose_name='категории', related_name='questions',
+                                 on_delete=models.CASCADE, db_index=False)
     image = models.ImageField(upload_to='q_images/', null=True, blank=True)
+    image_variants = models.JSONField(default=dict, blank=True, verbose_name='размеры изображения')
     audio = models.FileField(upload_to='q_audio/', null=True, blank=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['category', 'value'], name='question_category_value_idx'),
+        ]
 
-class InGameQuestion(models.Model):
-    text = models.CharField(max_length=512, verbose_name='текст вопроса')
-    value = models.PositiveSmallIntegerField(verbose_name='стоимость вопроса', null=True, blank=True)
-    type = models.ForeignKey(QuestionType, verbose_name='тип вопроса', on_delete=models.CASCADE)
-    category = models.ForeignKey(QuestionCategory, verbose_name='категории', related_name='question', on_delete=models.CASCADE)
-    image = models.ImageField(upload_to='q_images/', null=True, blank=True)
-    audio = models.FileField(upload_to='q_audio/', null=True, blank=True)
-    fresh = models.BooleanField(default=True, verbose_name='бы ли дан ответ на вопрос')
\ No newline at end of file
+
+class AnsweredQuestion(models.Model):
+    game = models.ForeignKey(QuizGame, verbose_name='игра', related_name='answered', on_delete=models.CASCADE)
+    question = models.ForeignKey(Question, verbose_name='вопрос', on_delete=models.CASCADE)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['game', 'question'], name='unique_answered_question'),
+        ]
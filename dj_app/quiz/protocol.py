@@ -0,0 +1,54 @@
+from typing import List, Optional
+
+import msgpack
+
+# clients that ask for this subprotocol get binary frames, everyone else keeps JSON text frames
+MSGPACK_SUBPROTOCOL = 'quiz.msgpack.v1'
+# events for one socket that come within this window go out as one frame
+COALESCE_SECONDS = 0.005
+
+CODES = {
+    # from clients
+    'ready': 1,
+    'unlock': 2,
+    'update': 3,
+    'correct': 4,
+    'wrong': 5,
+    'nobody': 6,
+    'round_completed': 7,
+    'super_correct': 8,
+    'super_wrong': 9,
+    'sync': 10,
+    'snapshot': 11,
+    'bets_open': 12,
+    'super_bet': 13,
+    'super_answer': 14,
+    'super_answers': 15,
+    # to clients
+    'block': 32,
+    'unlocked': 33,
+    'updated': 34,
+    'delta': 35,
+    'state': 36,
+    'timer': 37,
+    'expired': 38,
+    'answers': 39,
+}
+NAMES = {code: name for name, code in CODES.items()}
+
+
+def decode(data: bytes) -> Optional[dict]:
+    """A client frame is ``[code, {fields}]``; None for an unknown code or a malformed frame."""
+    try:
+        code, fields = msgpack.unpackb(data)
+        if code not in NAMES:
+            return None
+        return dict(fields, message=NAMES[code])
+    except (ValueError, TypeError, msgpack.ExtraData, msgpack.FormatError):
+        return None
+
+
+def encode(events: List[dict]) -> bytes:
+    """A server frame is a list of ``[code, {fields}]``, oldest event first."""
+    return msgpack.packb([[CODES[event['message']], {key: value for key, value in event.items() if key != 'message'}]
+                          for event in events])
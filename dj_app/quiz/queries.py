@@ -0,0 +1,56 @@
+CLOSE_QUESTION_SQL = """
+    INSERT INTO quiz_answeredquestion (game_id, question_id)
+    SELECT game_id, CAST(%s AS bigint) FROM quiz_participant WHERE user_id = %s AND active AND game_id IS NOT NULL
+    ON CONFLICT DO NOTHING
+    RETURNING game_id
+"""
+
+AWARD_SQL = """
+    UPDATE quiz_participant
+    SET score = quiz_participant.score + q.value * c.round, answer_attempts = quiz_participant.answer_attempts + 1,
+        correct_answers = quiz_participant.correct_answers + 1
+    FROM quiz_question q JOIN quiz_questioncategory c ON c.id = q.category_id
+    WHERE q.id = %s AND quiz_participant.user_id = %s AND quiz_participant.active
+    RETURNING quiz_participant.score, quiz_participant.id, quiz_participant.game_id,
+        quiz_participant.answer_attempts, quiz_participant.correct_answers
+"""
+
+PENALTY_SQL = """
+    UPDATE quiz_participant
+    SET score = quiz_participant.score - q.value * c.round, answer_attempts = quiz_participant.answer_attempts + 1
+    FROM quiz_question q JOIN quiz_questioncategory c ON c.id = q.category_id
+    WHERE q.id = %s AND quiz_participant.user_id = %s AND quiz_participant.active
+    RETURNING quiz_participant.score, quiz_participant.id, quiz_participant.game_id,
+        quiz_participant.answer_attempts, quiz_participant.correct_answers
+"""
+
+SUPER_AWARD_SQL = """
+    UPDATE quiz_participant
+    SET score = score + COALESCE(super_bet, 0), answer_attempts = answer_attempts + 1,
+        correct_answers = correct_answers + 1
+    WHERE id = %s AND active
+    RETURNING score, id, game_id, answer_attempts, correct_answers
+"""
+
+SUPER_PENALTY_SQL = """
+    UPDATE quiz_participant
+    SET score = score - COALESCE(super_bet, 0), answer_attempts = answer_attempts + 1
+    WHERE id = %s AND active
+    RETURNING score, id, game_id, answer_attempts, correct_answers
+"""
+
+BOARD_SQL = """
+    SELECT c.name, q.id, q.text, q.value, q.type_id, q.audio, q.image, q.image_variants,
+        EXISTS (SELECT 1 FROM quiz_answeredquestion a WHERE a.game_id = g.id AND a.question_id = q.id)
+    FROM quiz_quizgame g
+    JOIN quiz_questioncategory c ON c.quiz_id = g.quiz_id
+    LEFT JOIN quiz_question q ON q.category_id = c.id
+    WHERE g.id = %s AND c.round = %s
+    ORDER BY c.id, q.value
+"""
+
+PLAYER_SCORE_SQL = """
+    SELECT p.score, g.current_round, p.id
+    FROM quiz_participant p, quiz_quizgame g
+    WHERE p.user_id = %s AND p.active AND g.id = %s
+"""
@@ -0,0 +1,547 @@
+import asyncio
+import logging
+import time
+from typing import Dict, List, Optional
+
+from channels.db import database_sync_to_async
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Value, When
+from django.utils import timezone
+
+from quiz import leaderboard, timers
+from quiz.lifecycle import ACTIVITY_SECONDS
+from quiz.board_cache import mark_stale
+from quiz.shared_state import release_buzz
+from quiz.models import QuizGame, Participant, Question, AnsweredQuestion
+
+FLUSH_BATCH = 50
+# a failed flush is retried this many seconds later, the batch stays in memory meanwhile
+FLUSH_RETRY_SECONDS = 5
+# written as increments, so scores the HTTP views change meanwhile are kept
+SCORE_FIELDS = ('score', 'answer_attempts', 'correct_answers')
+ENGINE_MESSAGES = ('correct', 'wrong', 'nobody', 'round_completed', 'super_correct', 'super_wrong', 'sync',
+                   'snapshot', 'bets_open', 'super_bet', 'super_answer', 'super_answers')
+MAX_BET = 32767
+# countdowns of games with QuizGame.timer set
+ANSWER_SECONDS = 30
+BET_SECONDS = 60
+# a snapshot rereads the room from the database at most this often, however many sockets ask
+SNAPSHOT_SECONDS = 1
+
+logger = logging.getLogger(__name__)
+
+
+def _load_room(room_name: str) -> dict:
+    game = QuizGame.objects.get(room_name=room_name)
+    answered = set(AnsweredQuestion.objects.filter(game=game).values_list('question_id', flat=True))
+    board = {q['id']: {"value": q['value'] or 0, "round": q['category__round'] or 0, "fresh": q['id'] not in answered}
+             for q in Question.objects.filter(category__quiz_id=game.quiz_id).values('id', 'value', 'category__round')}
+    return {"game_id": game.id, "game_master_id": game.game_master_id, "current_round": game.current_round,
+            "timer": game.timer, "board": board, "players": _load_players(game.id)}
+
+
+def _load_players(game_id: int) -> dict:
+    return {p['id']: p for p in Participant.objects.filter(game_id=game_id, active=True).values(
+        'id', 'user_id', 'user__username', 'score', 'super_bet', 'super_answer', 'answer_attempts',
+        'correct_answers')}
+
+
+def _flush_room(game_id: int, current_round: Optional[int], deltas: dict, questions: list, touch: bool,
+                bets: list = ()) -> List[dict]:
+    """
+    Writes a batch of the engine's changes in one transaction. ``deltas``
+    maps participant ids to what to add to ``SCORE_FIELDS``; returns the
+    resulting rows of those participants. Raises ``QuizGame.DoesNotExist``
+    and writes nothing once the game ended or was reaped.
+    """
+    rows = list()
+    game = dict()
+    if current_round is not None:
+        game['current_round'] = current_round
+    if touch:
+        game['last_activity'] = timezone.now()
+    with transaction.atomic():
+        # the game row stays locked until the batch is in, the reaper skips locked games
+        live = QuizGame.objects.filter(id=game_id, ended=False)
+        if not (live.update(**game) if game else live.select_for_update().values_list('id', flat=True)):
+            raise QuizGame.DoesNotExist
+        if deltas:
+            Participant.objects.filter(id__in=deltas).update(**{
+                field: F(field) + Case(*[When(id=p_id, then=Value(delta[number])) for p_id, delta in deltas.items()],
+                                       default=Value(0), output_field=IntegerField())
+                for number, field in enumerate(SCORE_FIELDS)})
+            rows = list(Participant.objects.filter(id__in=deltas).values('id', *SCORE_FIELDS))
+        if bets:
+            Participant.objects.bulk_update(
+                [Participant(id=p['id'], super_bet=p['super_bet'], super_answer=p['super_answer']) for p in bets],
+                ['super_bet', 'super_answer'])
+        if questions:
+            AnsweredQuestion.objects.bulk_create(
+                [AnsweredQuestion(game_id=game_id, question_id=q_id) for q_id in questions], ignore_conflicts=True)
+    mark_stale(game_id, *questions)
+    return rows
+
+
+class RoomEngine:
+    """
+    Authoritative in-memory state of one live room.
+
+    Every mutation goes through ``inbox`` and is applied by a single task, so
+    the state never needs locking. Changes are written back to the models in
+    one transaction once the inbox drains or ``FLUSH_BATCH`` mutations pile up,
+    and only then the group is told to refresh. Scores are written as
+    increments and read back, so the HTTP scoring views can run alongside.
+    A batch that fails to write stays in memory and is retried. Once a flush
+    finds the game ended or reaped, the engine drops the batch and every
+    later message.
+
+    Clients that understand deltas don't need that refresh: every applied
+    mutation is pushed to the group right away as a ``delta`` carrying the
+    room ``version``, the questions that went stale, the changed scores and
+    the new round, if any. A ``snapshot`` message returns the full state at
+    the current version to the asking socket. It is read from the database,
+    so it holds what engines of other workers wrote too.
+
+    In games with a timer the engine also runs the answer window of the
+    player who buzzed and the super-round bet window the game master opens.
+    Both sit on the worker's timer wheel; starting one sends ``timer`` with
+    the deadline to the group, running out sends ``expired``.
+
+    Super-round bets and answers are collected here too, in memory, along
+    with the ones sent over HTTP, which are read back from the database
+    while the set is incomplete. Once every player is in, or once the bet
+    window ran out and everyone who bet answered, they are written in one
+    batch with the super-round question closed, and the whole set goes to
+    the game master as ``answers``; after that they are locked.
+    """
+
+    def __init__(self, room_name: str, channel_layer):
+        self.room_name = room_name
+        self.group_name = f'game_{room_name}'
+        self.channel_layer = channel_layer
+        self.inbox = asyncio.Queue()
+        self.connections = 0
+        self.task = None
+        self.loaded = False
+        self.game_id = None
+        self.game_master_id = None
+        self.timer = False
+        self.timers = dict()
+        self.bets = dict()
+        self.answers = dict()
+        self.bets_closed = False
+        self.answers_sent = False
+        self.super_question = None
+        self.dirty_bets = set()
+        self.current_round = 1
+        self.board = dict()
+        self.players = dict()
+        # participant id -> what to add to SCORE_FIELDS on the next flush
+        self.dirty_players = dict()
+        self.dirty_questions = set()
+        self.round_dirty = False
+        self.touched = 0.0
+        self.retry = None
+        self.synced = 0.0
+        self.ended = False
+        self.version = 0
+        self.changed_players = set()
+        self.changed_questions = set()
+        self.round_changed = False
+
+    def start(self) -> None:
+        if self.task is None or self.task.done():
+            self.task = asyncio.ensure_future(self.run())
+
+    def post(self, message: dict) -> None:
+        self.inbox.put_nowait(message)
+
+    async def stop(self) -> None:
+        self.inbox.put_nowait(None)
+        if self.task is not None:
+            await self.task
+
+    async def run(self) -> None:
+        pending = 0
+        while True:
+            message = await self.inbox.get()
+            if message is None:
+                for kind in list(self.timers):
+                    self.stop_timer(kind)
+                if self.retry is not None:
+                    self.retry.cancel()
+                try:
+                    await self.flush()
+                except Exception:
+                    logger.exception('room %s: last flush failed, its changes are lost', self.room_name)
+                return
+            if self.ended:
+                continue
+            try:
+                if not self.loaded:
+                    await self.load()
+                if await self.handle(message):
+                    pending += 1
+            except (QuizGame.DoesNotExist, KeyError, TypeError, ValueError) as error:
+                logger.warning('room %s: dropped %s message: %r', self.room_name, message.get('message'), error)
+            except Exception:
+                logger.exception('room %s: %s message failed', self.room_name, message.get('message'))
+            if self.dirty() and (self.inbox.empty() or pending >= FLUSH_BATCH):
+                try:
+                    await self.flush()
+                except Exception:
+                    logger.exception('room %s: flush failed, retrying in %s s', self.room_name, FLUSH_RETRY_SECONDS)
+                    if self.retry is None or self.retry.slot is None:
+                        self.retry = timers.schedule(FLUSH_RETRY_SECONDS, self.post, {'message': 'retry'})
+                    continue
+                pending = 0
+                if self.ended:
+                    continue
+                await self.channel_layer.group_send(self.group_name, {
+                    'type': 'update_buttons',
+                    'message': 'updated'
+                })
+
+    async def handle(self, message: dict) -> bool:
+        kind = message['message']
+        if kind == 'retry':
+            return False
+        if kind == 'snapshot':
+            if time.monotonic() - self.synced > SNAPSHOT_SECONDS:
+                await self.sync()
+            await self.channel_layer.send(message['reply_to'], dict(type='room_state', **self.snapshot()))
+            return False
+        if kind == 'sync':
+            # a flush and a reload of the room, not for every socket to trigger
+            if message.get('sender_id') == self.game_master_id:
+                await self.sync()
+            return False
+        if kind == 'buzzed':
+            await self.start_timer('answer', ANSWER_SECONDS, question_id=message['question_id'],
+                                   user_id=message['user_id'])
+            return False
+        if kind in ('unlock', 'update'):
+            # frees the buzzer, a player could do it to press again right after losing
+            if message.get('sender_id') == self.game_master_id:
+                await self.release(kind, message.get('stamp'))
+            return False
+        if kind == 'bets_open':
+            if message.get('sender_id') == self.game_master_id:
+                self.bets_closed = False
+                self.super_question = message.get('question_id')
+                await self.start_timer('bet', BET_SECONDS)
+            return False
+        if kind in ('super_bet', 'super_answer'):
+            await self.collect(message)
+            return False
+        if kind == 'super_answers':
+            if message.get('sender_id') == self.game_master_id:
+                await self.channel_layer.send(message['reply_to'], dict(
+                    type='super_answers', to=self.game_master_id, **self.answer_set()))
+            return False
+        if kind == 'timeout':
+            await self.expire(message)
+            return False
+        if not await self.apply(message):
+            return False
+        await self.publish()
+        return True
+
+    async def release(self, kind: str, stamp: Optional[float]) -> None:
+        await release_buzz(self.channel_layer, self.room_name)
+        self.stop_timer('answer')
+        if kind == 'update':
+            await self.sync()
+        event = {'type': 'unlock_buttons', 'message': 'unlocked'} if kind == 'unlock' else \
+            {'type': 'update_buttons', 'message': 'updated'}
+        if stamp is not None:
+            event['stamp'] = stamp
+        await self.channel_layer.group_send(self.group_name, event)
+
+    async def load(self) -> None:
+        state = await database_sync_to_async(_load_room)(self.room_name)
+        self.game_id = state['game_id']
+        self.game_master_id = state['game_master_id']
+        self.timer = state['timer']
+        self.current_round = state['current_round']
+        self.board = state['board']
+        self.players = state['players']
+        self.loaded = True
+        self.synced = time.monotonic()
+
+    def dirty(self) -> bool:
+        return bool(self.dirty_players or self.dirty_questions or self.round_dirty or self.dirty_bets)
+
+    async def flush(self) -> None:
+        if not self.dirty():
+            return
+        deltas, dirty_questions, round_dirty, dirty_bets = (
+            self.dirty_players, self.dirty_questions, self.round_dirty, self.dirty_bets)
+        bets = [self.players[p_id] for p_id in dirty_bets if p_id in self.players]
+        questions = [q_id for q_id in dirty_questions if not self.board[q_id]['fresh']]
+        current_round = self.current_round if round_dirty else None
+        self.dirty_players, self.dirty_questions, self.round_dirty, self.dirty_bets = dict(), set(), False, set()
+        # keeps a played game away from the reaper without an extra write per flush
+        touch = time.monotonic() - self.touched > ACTIVITY_SECONDS
+        try:
+            rows = await database_sync_to_async(_flush_room)(self.game_id, current_round, deltas, questions, touch,
+                                                             bets)
+        except QuizGame.DoesNotExist:
+            # the game ended, maybe on another worker, the batch has no game to go to
+            logger.info('room %s: game %s is over, %d changes dropped', self.room_name, self.game_id,
+                        len(deltas) + len(dirty_questions) + len(dirty_bets) + round_dirty)
+            self.end()
+            return
+        except Exception:
+            # nothing was written, the batch goes with the next flush
+            for p_id, delta in deltas.items():
+                kept = self.dirty_players.get(p_id, (0, 0, 0))
+                self.dirty_players[p_id] = [old + new for old, new in zip(kept, delta)]
+            self.dirty_questions |= dirty_questions
+            self.round_dirty = self.round_dirty or round_dirty
+            self.dirty_bets |= dirty_bets
+            raise
+        if touch:
+            self.touched = time.monotonic()
+        for row in rows:
+            player = self.players.get(row['id'])
+            if player is None:
+                continue
+            # points the HTTP views gave meanwhile
+            if player['score'] != row['score']:
+                self.changed_players.add(row['id'])
+            player.update(row)
+        await leaderboard.record(self.game_id, [(row['id'], row['score'], row['answer_attempts'],
+                                                 row['correct_answers']) for row in rows])
+        await self.publish()
+
+    async def sync(self) -> None:
+        # picks up changes made around the engine, e.g. by the HTTP scoring views
+        await self.flush()
+        state = await database_sync_to_async(_load_room)(self.room_name)
+        for q_id, question in state['board'].items():
+            if q_id in self.board and self.board[q_id]['fresh'] != question['fresh']:
+                self.changed_questions.add(q_id)
+        for p_id, player in state['players'].items():
+            if p_id not in self.players or self.players[p_id]['score'] != player['score']:
+                self.changed_players.add(p_id)
+        self.round_changed = self.current_round != state['current_round']
+        self.current_round = state['current_round']
+        self.board = state['board']
+        self.players = state['players']
+        self.synced = time.monotonic()
+        await self.publish()
+
+    async def publish(self) -> None:
+        if not (self.changed_players or self.changed_questions or self.round_changed):
+            return
+        self.version += 1
+        await self.channel_layer.group_send(self.group_name, {
+            'type': 'room_delta',
+            'message': 'delta',
+            'version': self.version,
+            'stale': sorted(q_id for q_id in self.changed_questions if not self.board[q_id]['fresh']),
+            'scores': [self.score_entry(self.players[p_id]) for p_id in sorted(self.changed_players)
+                       if p_id in self.players],
+            'round': self.current_round if self.round_changed else None,
+        })
+        self.changed_players, self.changed_questions, self.round_changed = set(), set(), False
+
+    def end(self) -> None:
+        """Stops taking messages, the game is over."""
+        self.ended = True
+        for kind in list(self.timers):
+            self.stop_timer(kind)
+
+    async def start_timer(self, kind: str, seconds: float, **details) -> None:
+        if not self.timer:
+            return
+        self.stop_timer(kind)
+        timeout = dict(details, message='timeout', timer=kind)
+        self.timers[kind] = (timers.schedule(seconds, self.post, timeout), timeout)
+        await self.channel_layer.group_send(self.group_name, dict(
+            details, type='timer_started', message='timer', timer=kind, seconds=seconds,
+            deadline=time.time() + seconds))
+
+    def stop_timer(self, kind: str) -> None:
+        timer, _ = self.timers.pop(kind, (None, None))
+        if timer is not None:
+            timer.cancel()
+
+    async def expire(self, timeout: dict) -> None:
+        kind = timeout['timer']
+        # the window may have been closed or restarted after this timeout was queued
+        if self.timers.get(kind, (None, None))[1] is not timeout:
+            return
+        del self.timers[kind]
+        if kind == 'answer':
+            await release_buzz(self.channel_layer, self.room_name)
+        if kind == 'bet':
+            self.bets_closed = True
+        await self.channel_layer.group_send(self.group_name, dict(
+            {key: value for key, value in timeout.items() if key != 'message'}, type='timer_expired',
+            message='expired'))
+        if kind == 'bet':
+            # players who didn't bet sit the super round out, the set no longer waits for them
+            await self.complete()
+
+    async def collect(self, message: dict) -> None:
+        if self.answers_sent:
+            return
+        player = await self.player_by_user(message.get('sender_id'))
+        if player is None:
+            return
+        if message['message'] == 'super_bet':
+            bet = int(message['bet'])
+            if self.bets_closed or not 0 < bet <= MAX_BET:
+                return
+            self.bets[player['id']] = bet
+        else:
+            self.answers[player['id']] = str(message['answer'])[:Participant._meta.get_field('super_answer').max_length]
+        await self.complete()
+
+    def missing(self) -> list:
+        """Players the answer set still waits for."""
+        missing = list()
+        for p_id, p in self.players.items():
+            bet = self.bets.get(p_id, p['super_bet'])
+            if self.bets_closed and not bet:
+                continue
+            if not (bet and self.answers.get(p_id, p['super_answer'])):
+                missing.append(p_id)
+        return missing
+
+    async def complete(self) -> None:
+        if self.answers_sent:
+            return
+        if self.missing():
+            # they may have bet or answered over HTTP, on any worker
+            self.merge_players(await database_sync_to_async(_load_players)(self.game_id))
+            if self.missing():
+                return
+        for p_id, p in self.players.items():
+            p['super_bet'] = self.bets.get(p_id, p['super_bet'])
+            p['super_answer'] = self.answers.get(p_id, p['super_answer'])
+        self.dirty_bets.update(self.players)
+        if self.super_question is not None and int(self.super_question) in self.board:
+            self.close_question(int(self.super_question))
+        await self.flush()
+        self.answers_sent = True
+        await self.channel_layer.group_send(self.group_name, dict(
+            type='super_answers', to=self.game_master_id, **self.answer_set()))
+
+    def answer_set(self) -> dict:
+        """What ``get_answers`` returns, from the collected state."""
+        if not self.answers_sent:
+            return {"message": "answers", "ready": False}
+        return {"message": "answers", "ready": True, "answers": [
+            {"id": p['id'], "name": p['user__username'], "bet": p['super_bet'], "answer": p['super_answer']}
+            for p in sorted(self.players.values(), key=lambda p: -p['score']) if p['super_bet']]}
+
+    def snapshot(self) -> dict:
+        return {"message": "state", "version": self.version, "round": self.current_round,
+                "stale": sorted(q_id for q_id, q in self.board.items() if not q['fresh']),
+                "scores": [self.score_entry(p) for p in self.players.values()]}
+
+    @staticmethod
+    def score_entry(player: dict) -> dict:
+        return {"id": player['id'], "user_id": player['user_id'], "score": player['score']}
+
+    def merge_players(self, loaded: dict) -> None:
+        # scores stay as they are here, they may hold increments that are not flushed yet
+        for p_id, player in loaded.items():
+            if p_id in self.players:
+                self.players[p_id].update(super_bet=player['super_bet'], super_answer=player['super_answer'])
+            else:
+                self.players[p_id] = player
+
+    async def player_by_user(self, user_id: int) -> Optional[dict]:
+        for player in self.players.values():
+            if player['user_id'] == user_id:
+                return player
+        # somebody joined after the room was loaded
+        self.merge_players(await database_sync_to_async(_load_players)(self.game_id))
+        for player in self.players.values():
+            if player['user_id'] == user_id:
+                return player
+        return None
+
+    async def player_by_id(self, participant_id: int) -> Optional[dict]:
+        if participant_id not in self.players:
+            self.merge_players(await database_sync_to_async(_load_players)(self.game_id))
+        return self.players.get(participant_id)
+
+    async def apply(self, message: dict) -> bool:
+        if message.get('sender_id') != self.game_master_id:
+            return False
+        kind = message['message']
+        if kind in ('correct', 'wrong'):
+            player = await self.player_by_user(int(message['player_id']))
+            question = self.board.get(int(message['question_id']))
+            if player is None or question is None:
+                return False
+            points = question['round'] * question['value']
+            self.stop_timer('answer')
+            if kind == 'correct':
+                self.score(player, points, True)
+                self.close_question(int(message['question_id']))
+                await release_buzz(self.channel_layer, self.room_name)
+            else:
+                self.score(player, -points, False)
+        elif kind in ('super_correct', 'super_wrong'):
+            player = await self.player_by_id(int(message['player_id']))
+            if player is None:
+                return False
+            if kind == 'super_correct':
+                self.score(player, player['super_bet'] or 0, True)
+            else:
+                self.score(player, -(player['super_bet'] or 0), False)
+        elif kind == 'nobody':
+            if int(message['question_id']) not in self.board:
+                return False
+            self.stop_timer('answer')
+            self.close_question(int(message['question_id']))
+            await release_buzz(self.channel_layer, self.room_name)
+        elif kind == 'round_completed':
+            if any(q['fresh'] for q in self.board.values() if q['round'] == self.current_round):
+                return False
+            self.current_round += 1
+            self.round_dirty = True
+            self.round_changed = True
+        else:
+            return False
+        return True
+
+    def score(self, player: dict, points: int, correct: bool) -> None:
+        player['score'] += points
+        player['answer_attempts'] += 1
+        player['correct_answers'] += correct
+        delta = self.dirty_players.setdefault(player['id'], [0, 0, 0])
+        delta[0] += points
+        delta[1] += 1
+        delta[2] += correct
+        self.changed_players.add(player['id'])
+
+    def close_question(self, question_id: int) -> None:
+        self.board[question_id]['fresh'] = False
+        self.dirty_questions.add(question_id)
+        self.changed_questions.add(question_id)
+
+
+_engines: Dict[str, RoomEngine] = dict()
+
+
+def attach(room_name: str, channel_layer) -> RoomEngine:
+    engine = _engines.get(room_name)
+    if engine is None:
+        engine = _engines[room_name] = RoomEngine(room_name, channel_layer)
+    engine.connections += 1
+    engine.start()
+    return engine
+
+
+async def detach(engine: RoomEngine) -> None:
+    engine.connections -= 1
+    if engine.connections <= 0 and _engines.get(engine.room_name) is engine:
+        del _engines[engine.room_name]
+        await engine.stop()
@@ -0,0 +1,55 @@
+import time
+from typing import Dict, Tuple
+
+# a lock nobody releases, e.g. the game master left, frees the room after this long
+BUZZ_TTL_MS = 60000
+
+_local_buzz: Dict[str, Tuple[str, int, float]] = dict()
+
+
+def redis_connection(channel_layer, key: str):
+    """
+    Connection to the Redis shard the channel layer keeps ``key`` on, or
+    None when the layer is not Redis-backed (in-memory layer in development).
+    """
+    if not hasattr(channel_layer, 'connection'):
+        return None
+    return channel_layer.connection(channel_layer.consistent_hash(key))
+
+
+def _buzz_key(channel_layer, room: str) -> str:
+    return f"{getattr(channel_layer, 'prefix', 'asgi')}:buzz:{room}"
+
+
+def _room_connection(channel_layer, room: str):
+    # hashed like the room's group, so the lock sits on the shard that carries the room's messages
+    return redis_connection(channel_layer, f'game_{room}')
+
+
+async def claim_buzz(channel_layer, room: str, question_id: str, user_id: int) -> bool:
+    """
+    First ``ready`` in a room wins, every later one loses until the lock is
+    released with ``release_buzz``, whatever question it names.
+    """
+    key = _buzz_key(channel_layer, room)
+    question_id = str(question_id)
+    connection = _room_connection(channel_layer, room)
+    if connection is None:
+        current = _local_buzz.get(key)
+        if current and current[2] > time.monotonic():
+            return False
+        _local_buzz[key] = (question_id, user_id, time.monotonic() + BUZZ_TTL_MS / 1000)
+        return True
+    async with connection as conn:
+        return bool(await conn.set(key, f'{question_id}:{user_id}', pexpire=BUZZ_TTL_MS,
+                                   exist=conn.SET_IF_NOT_EXIST))
+
+
+async def release_buzz(channel_layer, room: str) -> None:
+    key = _buzz_key(channel_layer, room)
+    connection = _room_connection(channel_layer, room)
+    if connection is None:
+        _local_buzz.pop(key, None)
+        return
+    async with connection as conn:
+        await conn.delete(key)
@@ -0,0 +1,32 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from quiz.board_cache import invalidate_boards
+from quiz.catalog_cache import invalidate
+from quiz.models import Quiz, Section, QuestionType, Question, QuestionCategory
+
+
+@receiver([post_save, post_delete], sender=Section)
+def section_changed(sender, **kwargs):
+    invalidate('sections', 'game_quiz_list')
+
+
+@receiver([post_save, post_delete], sender=QuestionType)
+def type_changed(sender, **kwargs):
+    invalidate('types')
+
+
+@receiver([post_save, post_delete], sender=Quiz)
+def quiz_changed(sender, **kwargs):
+    invalidate('game_quiz_list')
+
+
+@receiver([post_save, post_delete], sender=QuestionCategory)
+def theme_changed(sender, instance, **kwargs):
+    invalidate_boards(instance.quiz_id)
+
+
+@receiver([post_save, post_delete], sender=Question)
+def question_changed(sender, instance, **kwargs):
+    quiz_id = QuestionCategory.objects.filter(id=instance.category_id).values_list('quiz_id', flat=True).first()
+    invalidate_boards(quiz_id)
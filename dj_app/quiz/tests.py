@@ -1,3 +1,837 @@
-from django.test import TestCase
+import asyncio
+import io
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+import msgpack
+from asgiref.sync import async_to_sync, sync_to_async
+from channels.layers import InMemoryChannelLayer, get_channel_layer
+from channels.testing import WebsocketCommunicator
+from django.conf import settings
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import DatabaseError, connection
+from django.db.migrations.executor import MigrationExecutor
+from django.db.models import F
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from PIL import Image
+from prometheus_client import REGISTRY
+
+from quiz import layers, leaderboard, lifecycle, media, protocol, room_engine, timers
+from quiz.management.seed import seed_game
+from quiz.consumers import GameRoomConsumer
+from quiz.models import AnsweredQuestion, Question, QuestionCategory, Quiz, QuizGame, Participant
+from users.models import CustomUser
+
+MEDIA_ROOT = tempfile.mkdtemp()
+
+# the suite runs on the ORM path only: asyncpg can't see rows of the test transaction
+BENCHMARK_SETTINGS = {
+    'ASYNC_DB_POOL': None,
+    'CACHES': {
+        'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'default'},
+        'sessions': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'sessions'},
+    },
+    'CHANNEL_LAYERS': {'default': {'BACKEND': 'quiz.layers.InstrumentedInMemoryChannelLayer'}},
+    'MEDIA_ROOT': MEDIA_ROOT,
+    'MEDIA_ACCEL_PREFIX': '/protected-media/',
+}
+
+
+@override_settings(**BENCHMARK_SETTINGS)
+class EndpointBenchmark(TestCase):
+    """
+    Every request goes through ``call``, which fails when a view runs more
+    queries than its budget and records the time it took. Caches are cleared
+    before each test, so the budgets are for cold caches. With
+    ``BENCHMARK_REPORT`` set in the environment the timings are printed when
+    the class is done.
+    """
+    players = 20
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.timings = list()
+
+    @classmethod
+    def tearDownClass(cls):
+        if cls.timings and os.environ.get('BENCHMARK_REPORT'):
+            sys.stderr.write(f'\n{cls.__name__}\n{"endpoint":<36}{"queries":>8}{"budget":>8}{"ms":>10}\n')
+            for name, queries, budget, elapsed in cls.timings:
+                sys.stderr.write(f'{name:<36}{queries:>8}{budget:>8}{elapsed:>10.2f}\n')
+        super().tearDownClass()
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.seeded = seed_game(players=cls.players, started=False)
+
+    def setUp(self):
+        for cache in caches.all():
+            cache.clear()
+        leaderboard._local.clear()
+        lifecycle._touched.clear()
+        self.client = self.login(self.seeded.game_master)
+
+    @staticmethod
+    def login(user) -> Client:
+        client = Client()
+        client.force_login(user, backend='users.backends.CachedModelBackend')
+        return client
+
+    def call(self, method: str, url: str, budget: int, data=None, client: Client = None, status: int = 200,
+             json_body: bool = True):
+        client = client or self.client
+        kwargs = dict()
+        if method != 'get' and json_body:
+            data, kwargs = json.dumps(data), {'content_type': 'application/json'}
+        with CaptureQueriesContext(connection) as queries:
+            started = time.perf_counter()
+            response = getattr(client, method)(url, data, **kwargs)
+            elapsed = (time.perf_counter() - started) * 1000
+        self.timings.append((f'{method.upper()} {url}', len(queries), budget, elapsed))
+        self.assertEqual(response.status_code, status, response.content)
+        self.assertLessEqual(len(queries), budget, '\n'.join(query['sql'] for query in queries.captured_queries))
+        return response
+
+
+def _png(width: int, height: int) -> io.BytesIO:
+    file = io.BytesIO()
+    Image.new('RGB', (width, height), (200, 10, 10)).save(file, 'PNG')
+    file.seek(0)
+    file.name = 'question.png'
+    return file
+
+
+class CatalogEndpointsTest(EndpointBenchmark):
+    def test_catalog(self):
+        quiz = self.seeded.quiz
+        theme = QuestionCategory.objects.filter(quiz=quiz).first()
+        question = Question.objects.filter(category=theme).first()
+        self.call('get', '/quiz/player_id', 0)
+        self.call('get', '/quiz/sections', 1)
+        self.call('get', '/quiz/sections', 0)
+        self.call('get', '/quiz/types', 1)
+        self.call('get', '/quiz/quiz_list', 1)
+        self.call('get', '/quiz/game_quiz_list', 1)
+        self.call('get', '/quiz/theme_list', 1, {'quiz_id': quiz.id})
+        self.call('get', '/quiz/question_list', 1, {'theme_id': theme.id})
+        self.call('get', '/quiz/theme_round', 1, {'theme_id': theme.id})
+        self.call('get', '/quiz/question_detail', 1, {'question_id': question.id})
+        self.call('get', '/quiz/ig_question_detail', 1, {'question_id': question.id, 'width': 480})
+        self.call('get', '/quiz/ig_question_detail', 0, {'question_id': question.id, 'width': 'wide'}, status=400)
+        self.call('get', '/quiz/quiz_upd_detail', 1, {'quiz_id': quiz.id})
+        self.call('get', '/quiz/theme_upd_detail', 1, {'theme_id': theme.id})
+        self.call('get', '/quiz/question_upd_detail', 1, {'question_id': question.id})
+
+    def test_anonymous_and_wrong_method_cost_nothing(self):
+        self.call('get', '/quiz/sections', 0, client=Client(), status=401)
+        self.call('post', '/quiz/sections', 0, status=405)
+
+    def test_metrics(self):
+        def sample(name: str) -> float:
+            return REGISTRY.get_sample_value(name, {'route': 'quiz/sections'}) or 0
+
+        queries, requests = sample('quiz_http_request_queries_sum'), sample('quiz_http_request_queries_count')
+        self.call('get', '/quiz/sections', 1)
+        self.assertEqual(sample('quiz_http_request_queries_sum') - queries, 1)
+        self.assertEqual(sample('quiz_http_request_queries_count') - requests, 1)
+        response = self.call('get', '/metrics', 0, client=Client())
+        self.assertIn(b'quiz_http_request_seconds_bucket{le="0.001",method="GET",route="quiz/sections"}',
+                      response.content)
+        # any verb a client makes up is counted under one label
+        self.assertEqual(self.client.generic('BREW', '/quiz/sections').status_code, 405)
+        self.assertEqual(REGISTRY.get_sample_value('quiz_http_responses_total', {
+            'route': 'quiz/sections', 'method': 'BREW', 'status': '405'}), None)
+        self.assertGreaterEqual(REGISTRY.get_sample_value('quiz_http_responses_total', {
+            'route': 'quiz/sections', 'method': 'other', 'status': '405'}), 1)
+
+    def test_media_is_handed_to_nginx(self):
+        response = self.call('get', '/media/assets/ab/cd/480.jpg', 0)
+        self.assertEqual(response['X-Accel-Redirect'], '/protected-media/assets/ab/cd/480.jpg')
+
+
+class EditorEndpointsTest(EndpointBenchmark):
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+
+    def test_editor(self):
+        section_id = self.seeded.quiz.section_id
+        quiz_id = self.call('post', '/quiz/quiz_cr', 1, {'title': 'new', 'section': section_id}, status=201).json()['id']
+        first = self.call('post', '/quiz/theme_cr', 4, {'quiz': quiz_id, 'name': 'first'}, status=201).json()['id']
+        second = self.call('post', '/quiz/theme_cr', 4, {'quiz': quiz_id, 'name': 'second'}, status=201).json()['id']
+        question = self.call('post', '/quiz/question_cr', 6, {'theme': first, 'text': 'picture', 'type': 2,
+                                                              'image': _png(1200, 800)},
+                             status=201, json_body=False).json()['id']
+        other = self.call('post', '/quiz/question_cr', 6, {'theme': first, 'text': 'text', 'type': 1},
+                          status=201, json_body=False).json()['id']
+        self.assertEqual(sorted(Question.objects.get(id=question).image_variants), ['1600', '480', '960'])
+        self.call('put', '/quiz/arrange_round', 6, {'theme_id': first, 'round': 1})
+        self.call('put', '/quiz/arrange_round', 6, {'theme_id': second, 'round': 2})
+        self.call('put', '/quiz/change_round', 8, {'theme_id': first, 'target_id': second})
+        self.call('put', '/quiz/change_value', 10, {'origin_id': question, 'destination_id': other})
+        self.call('put', f'/quiz/update_quiz/{quiz_id}', 4, {'title': 'renamed', 'section': section_id})
+        self.call('put', f'/quiz/update_theme/{first}', 4, {'name': 'renamed'})
+        self.call('post', f'/quiz/update_question/{question}', 5, {'text': 'renamed', 'image': _png(300, 200)},
+                  json_body=False)
+        with mock.patch.object(Image, 'MAX_IMAGE_PIXELS', 1000):
+            self.call('post', f'/quiz/update_question/{question}', 2, {'image': _png(300, 200)}, json_body=False,
+                      status=400)
+        self.call('delete', f'/quiz/update_question/{other}', 6, status=204)
+        self.call('delete', f'/quiz/update_theme/{second}', 5, status=204)
+        self.call('delete', f'/quiz/update_quiz/{quiz_id}', 12, status=204)
+
+
+    def test_uploads_are_processed_off_the_orm_thread(self):
+        # the test client runs the thread-sensitive calls, the ORM ones, on the main thread
+        threads = list()
+
+        def process(upload):
+            threads.append(threading.current_thread())
+            return {'960': 'assets/question.jpg'}
+
+        theme = self.seeded.quiz.q_category.first()
+        QuizGame.objects.filter(id=self.seeded.game.id).update(ended=True)
+        with mock.patch('quiz.media.process_image', side_effect=process):
+            self.call('post', '/quiz/question_cr', 6, {'theme': theme.id, 'text': 'picture',
+                                                       'type': theme.questions.first().type_id,
+                                                       'image': _png(10, 10)}, status=201, json_body=False)
+        self.assertEqual(len(threads), 1)
+        self.assertIsNot(threads[0], threading.main_thread())
+
+    def test_audio_timeout_keeps_the_upload(self):
+        upload = SimpleUploadedFile('question.ogg', b'not really audio')
+        with mock.patch('quiz.media.shutil.which', return_value='ffmpeg'), \
+                mock.patch('quiz.media.subprocess.run', side_effect=subprocess.TimeoutExpired('ffmpeg', 1)):
+            self.assertTrue(media.process_audio(upload).endswith('/original.ogg'))
+
+
+class GameEndpointsTest(EndpointBenchmark):
+    def setUp(self):
+        super().setUp()
+        self.game_id = self.seeded.game.id
+        self.first = self.seeded.players[0]
+        self.questions = list(Question.objects.filter(category__quiz=self.seeded.quiz, category__round=1).values_list(
+            'id', flat=True))
+
+    def test_lobby(self):
+        self.call('get', '/quiz/games_available', 1)
+        self.call('get', '/quiz/room', 1, {'role': 'creator'})
+        for player in self.seeded.players:
+            self.call('post', '/quiz/connect', 2, {'game_id': self.game_id}, client=self.login(player))
+        self.call('post', '/quiz/start_game', 2, {'game_id': self.game_id})
+        self.call('get', '/quiz/quiz_game_players', 1, {'quiz_game_id': self.game_id})
+        self.call('get', '/quiz/room', 1, {'role': 'player'}, client=self.login(self.first))
+
+    def test_round_board(self):
+        self.call('get', '/quiz/quiz_game_round', 1, {'quiz_game_id': self.game_id, 'round': 1, 'width': 960})
+        self.call('get', '/quiz/quiz_game_round', 0, {'quiz_game_id': self.game_id, 'round': 1})
+        etag = self.call('get', '/quiz/round_media', 0, {'quiz_game_id': self.game_id, 'round': 1})['ETag']
+        # a new board version with the same files, as another backend would build it, keeps the ETag
+        caches['default'].clear()
+        self.assertEqual(self.client.get('/quiz/round_media', {'quiz_game_id': self.game_id, 'round': 1},
+                                         HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+    def test_scoring(self):
+        question, player = self.questions[0], self.first.id
+        self.call('get', '/quiz/quiz_game_round', 1, {'quiz_game_id': self.game_id, 'round': 1})
+        self.call('post', '/quiz/wrong_answer', 2, {'question_id': question, 'player_id': player})
+        score = self.call('post', '/quiz/corr_answer', 4, {'question_id': question, 'player_id': player}).json()
+        # the question is closed: a second correct click awards nothing, a wrong answer still costs the points
+        self.assertEqual(self.call('post', '/quiz/corr_answer', 3, {'question_id': question,
+                                                                    'player_id': player}).content, b'')
+        penalized = self.call('post', '/quiz/wrong_answer', 1, {'question_id': question, 'player_id': player})
+        self.assertLess(penalized.json()['score'], score['score'])
+        # the cached board is patched from the stale markers, not rebuilt
+        board = self.call('get', '/quiz/quiz_game_round', 0, {'quiz_game_id': self.game_id, 'round': 1}).json()
+        self.assertFalse(next(q['fresh'] for theme in board.values() for q in theme if q['id'] == question))
+
+    def test_nobody(self):
+        # a client without game_id closes the question in the game master's live game that plays it
+        self.call('post', '/quiz/nobody', 1, {'question_id': self.questions[0]}, client=self.login(self.first),
+                  status=400)
+        self.call('post', '/quiz/nobody', 6, {'question_id': self.questions[0]}, status=204)
+        self.assertTrue(AnsweredQuestion.objects.filter(game_id=self.game_id, question_id=self.questions[0]).exists())
+        self.assertTrue(self.call('get', '/quiz/round_completed', 2,
+                                  {'quiz_game_id': self.game_id, 'round': 1}).json()['alive'])
+        for question in self.questions:
+            self.call('post', '/quiz/nobody', 4, {'question_id': question, 'game_id': self.game_id}, status=204)
+        self.assertFalse(self.call('get', '/quiz/round_completed', 2,
+                                   {'quiz_game_id': self.game_id, 'round': 1}).json()['alive'])
+
+    def test_standings(self):
+        self.call('post', '/quiz/corr_answer', 5, {'question_id': self.questions[0], 'player_id': self.first.id})
+        self.call('get', '/quiz/player_score', 3, {'quiz_game_id': self.game_id}, client=self.login(self.first))
+        self.call('get', '/quiz/players_dashboard', 1, {'quiz_game_id': self.game_id})
+        top = self.call('get', '/quiz/players_dashboard', 0, {'quiz_game_id': self.game_id, 'top': 3}).json()
+        self.assertEqual(len(top), 3)
+        self.call('get', '/quiz/players_dashboard', 0, {'quiz_game_id': self.game_id, 'top': 'three'}, status=400)
+
+    def test_super_round(self):
+        super_question = Question.objects.filter(category__quiz=self.seeded.quiz, category__round=3).first()
+        for player in self.seeded.players:
+            client = self.login(player)
+            self.call('post', '/quiz/bet_super', 1, {'bet': 100}, client=client)
+            self.call('post', '/quiz/answer_super', 1, {'answer': 'answer'}, client=client)
+        answers = self.call('get', '/quiz/get_answers', 5, {'game_id': self.game_id, 'q_id': super_question.id})
+        self.assertEqual(len(answers.json()['answers']), self.players)
+        participants = list(Participant.objects.filter(game_id=self.game_id).values_list('id', flat=True))
+        self.call('post', '/quiz/corr_answer_super', 2, {'player_id': participants[0]})
+        self.call('post', '/quiz/wrong_answer_super', 1, {'player_id': participants[1]})
+        self.assertEqual(Participant.objects.get(id=participants[0]).score
+                         - Participant.objects.get(id=participants[1]).score, 200)
+
+    def test_end_game(self):
+        self.call('post', '/quiz/corr_answer', 5, {'question_id': self.questions[0], 'player_id': self.first.id})
+        live = self.call('get', '/quiz/results_table', 2, {'quiz_game_id': self.game_id})
+        self.call('post', '/quiz/end_game', 7, {'game_id': self.game_id})
+        self.assertTrue(QuizGame.objects.get(id=self.game_id).ended)
+        self.assertFalse(Participant.objects.filter(game_id=self.game_id, active=True).exists())
+        self.assertEqual(self.call('get', '/quiz/results_table', 0, {'quiz_game_id': self.game_id}).json(),
+                         live.json())
+        self.assertEqual(async_to_sync(lifecycle.reap)(), 1)
+        self.assertFalse(QuizGame.objects.filter(id=self.game_id).exists())
+        self.assertFalse(Participant.objects.filter(game_id__in=[self.game_id, None]).exists())
+        caches['default'].clear()
+        self.assertEqual(self.call('get', '/quiz/results_table', 1, {'quiz_game_id': self.game_id}).json(),
+                         live.json())
+
+    def test_reaper(self):
+        idle = timezone.now() - lifecycle.ABANDONED_AFTER - timedelta(minutes=1)
+        games = [QuizGame.objects.create(name=f'idle {number}', quiz=self.seeded.quiz, last_activity=idle)
+                 for number in range(3)]
+        player = Participant.objects.create(user=self.seeded.players[0], game=games[0], score=300)
+        # a game created before games ran on the prototype leaves its clone behind
+        clone = Quiz.objects.create(title='clone', section=self.seeded.quiz.section, completed=True)
+        games.append(QuizGame.objects.create(name='on a clone', quiz=clone, last_activity=idle))
+        # a game scored only over HTTP is still played
+        scored = QuizGame.objects.create(name='scored', quiz=self.seeded.quiz, last_activity=idle)
+        user = CustomUser.objects.create(email='scored@bench.local', username='scored')
+        Participant.objects.create(user=user, game=scored)
+        question = Question.objects.filter(category__quiz=self.seeded.quiz).first()
+        self.call('post', '/quiz/wrong_answer', 2, {'question_id': question.id, 'player_id': user.id})
+        self.assertEqual(async_to_sync(lifecycle.reap)(batch=2), 4)
+        self.assertFalse(Quiz.objects.filter(id=clone.id).exists())
+        self.assertTrue(QuizGame.objects.filter(id=scored.id).exists())
+        self.assertFalse(QuizGame.objects.filter(id__in=[game.id for game in games]).exists())
+        self.assertFalse(Participant.objects.filter(id=player.id).exists())
+        self.assertTrue(QuizGame.objects.filter(id=self.seeded.game.id).exists())
+        # abandoned games are archived on the way out, an empty table stays empty
+        caches['default'].clear()
+        self.assertEqual(self.call('get', '/quiz/results_table', 1, {'quiz_game_id': games[0].id}).json(),
+                         [{'id': player.id, 'name': player.user.username, 'score': 300, 'percent': '0 %'}])
+        self.assertEqual(self.call('get', '/quiz/results_table', 1, {'quiz_game_id': games[1].id}).json(), [])
+
+    def test_quiz_in_play_is_frozen(self):
+        quiz = Quiz.objects.create(creator=self.seeded.game_master, title='small', section=self.seeded.quiz.section,
+                                   completed=True)
+        theme = QuestionCategory.objects.create(name='theme', round=1, quiz=quiz)
+        question = Question.objects.create(text='question', value=100, category=theme,
+                                           type_id=self.seeded.quiz.q_category.first().questions.first().type_id)
+        game = QuizGame.objects.create(name='small', quiz=quiz, game_master=self.seeded.game_master)
+        Participant.objects.create(user=self.seeded.players[0], game=game, active=False)
+        other = Question.objects.create(text='other', value=200, category=theme, type_id=question.type_id)
+        # points are awarded from the prototype's values and rounds, edits wait for the game to end
+        self.call('put', f'/quiz/update_quiz/{quiz.id}', 2, {'title': 'renamed'}, status=409)
+        self.call('put', f'/quiz/update_theme/{theme.id}', 2, {'name': 'renamed'}, status=409)
+        self.call('post', f'/quiz/update_question/{question.id}', 2, {'text': 'renamed'}, json_body=False, status=409)
+        self.call('post', '/quiz/theme_cr', 1, {'quiz': quiz.id, 'name': 'new'}, status=409)
+        self.call('post', '/quiz/question_cr', 3, {'theme': theme.id, 'text': 'new', 'type': question.type_id},
+                  json_body=False, status=409)
+        self.call('put', '/quiz/arrange_round', 2, {'theme_id': theme.id, 'round': 2}, status=409)
+        self.call('put', '/quiz/change_round', 3, {'theme_id': theme.id, 'target_id': theme.id}, status=409)
+        self.call('put', '/quiz/change_value', 3, {'origin_id': question.id, 'destination_id': other.id}, status=409)
+        self.assertEqual(Question.objects.get(id=question.id).value, 100)
+        self.call('delete', f'/quiz/update_question/{question.id}', 2, status=409)
+        self.call('delete', f'/quiz/update_theme/{theme.id}', 2, status=409)
+        self.call('delete', f'/quiz/update_quiz/{quiz.id}', 2, status=409)
+        self.assertTrue(Question.objects.filter(id=question.id).exists())
+        # an ended game waits for the reaper, it doesn't hold the quiz
+        game.ended = True
+        game.save(update_fields=['ended'])
+        self.call('delete', f'/quiz/update_quiz/{quiz.id}', 19, status=204)
+        self.assertFalse(QuizGame.objects.filter(id=game.id).exists())
+
+    def test_score_recorded_while_the_board_builds(self):
+        async_to_sync(self.build_and_record)()
+
+    async def build_and_record(self):
+        game_id = self.seeded.game.id
+        participants = Participant.objects.select_related('user').filter(game_id=game_id)
+        participant = await sync_to_async(participants.earliest)('id')
+        building = asyncio.ensure_future(leaderboard.top(game_id, 1))
+        await asyncio.sleep(0)
+        # written to the database after the build read the scores
+        await leaderboard.record(game_id, [(participant.id, 1000, 1, 1)])
+        self.assertEqual(await building, [{'id': participant.id, 'name': participant.user.username, 'score': 1000}])
+
+    def test_create_game(self):
+        self.call('post', '/quiz/game_quiz_cr', 1, {'data_id': self.seeded.quiz.id, 'game_name': 'bench'})
+
+    def test_board_does_not_grow_with_questions(self):
+        # the round board used to run a query per theme and per question
+        game = QuizGame.objects.create(name='board', quiz=self.seeded.quiz, game_master=self.seeded.game_master)
+        self.call('get', '/quiz/quiz_game_round', 1, {'quiz_game_id': game.id, 'round': 2})
+        theme = QuestionCategory.objects.create(name='extra', round=2, quiz=self.seeded.quiz)
+        Question.objects.bulk_create([Question(text='extra', value=value, type_id=self.seeded.quiz.q_category.first()
+                                               .questions.first().type_id, category=theme)
+                                      for value in range(100, 600, 100)])
+        self.call('get', '/quiz/quiz_game_round', 1, {'quiz_game_id': game.id, 'round': 2})
+
+
+@override_settings(**BENCHMARK_SETTINGS)
+class GameStateMigrationTest(TransactionTestCase):
+    before = [('quiz', '0021_alter_quizgame_room_name')]
+    after = [('quiz', '0022_auto_20261018_2003')]
+
+    def tearDown(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes())
+
+    def test_clones_keep_their_answered_questions(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.before)
+        apps = executor.loader.project_state(self.before).apps
+        section = apps.get_model('quiz', 'Section').objects.create(name='section', special_color='red')
+        question_type = apps.get_model('quiz', 'QuestionType').objects.create(name='text')
+        played, orphan = [apps.get_model('quiz', 'Quiz').objects.create(title=title, section=section, completed=True)
+                          for title in ('played', 'orphan')]
+        game = apps.get_model('quiz', 'QuizGame').objects.create(name='game', quiz=played)
+        for quiz in (played, orphan):
+            theme = apps.get_model('quiz', 'QuestionCategory').objects.create(name='theme', round=1, quiz=quiz)
+            for value, fresh in ((100, False), (200, True)):
+                apps.get_model('quiz', 'InGameQuestion').objects.create(text=str(value), value=value, fresh=fresh,
+                                                                        type=question_type, category=theme)
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.after)
+        apps = executor.loader.project_state(self.after).apps
+        self.assertEqual(list(apps.get_model('quiz', 'Quiz').objects.values_list('id', flat=True)), [played.id])
+        self.assertEqual(sorted(apps.get_model('quiz', 'Question').objects.filter(
+            category__quiz_id=played.id).values_list('value', flat=True)), [100, 200])
+        self.assertEqual(list(apps.get_model('quiz', 'AnsweredQuestion').objects.filter(game_id=game.id).values_list(
+            'question__value', flat=True)), [100])
+
+
+@override_settings(**BENCHMARK_SETTINGS)
+class ConsumerMetricsTest(TransactionTestCase):
+    room = 'metricsroom'
+
+    @staticmethod
+    def sample(name: str, **labels) -> float:
+        return REGISTRY.get_sample_value(name, labels) or 0
+
+    def test_room_metrics(self):
+        async_to_sync(self.play)()
+
+    async def play(self):
+        before = {name: self.sample(name, **labels) for name, labels in [
+            ('quiz_layer_group_fanout_count', {}), ('quiz_layer_group_fanout_sum', {}),
+            ('quiz_ws_received_total', {'kind': 'ready'}),
+            ('quiz_ws_delivery_seconds_count', {'event': 'block_buttons'})]}
+        sockets = list()
+        for number in range(2):
+            socket = WebsocketCommunicator(GameRoomConsumer.as_asgi(), f'/ws/game/{self.room}/')
+            socket.scope['url_route'] = {'kwargs': {'gamename': self.room}}
+            socket.scope['user'] = CustomUser(id=number + 1, username=f'player{number}')
+            connected, _ = await socket.connect()
+            self.assertTrue(connected)
+            sockets.append(socket)
+        self.assertEqual(self.sample('quiz_ws_room_sockets', room=self.room), 2)
+        await sockets[0].send_json_to({'message': 'ready', 'question_id': 1})
+        for socket in sockets:
+            self.assertEqual((await socket.receive_json_from())['message'], 'block')
+        self.assertEqual(self.sample('quiz_layer_group_fanout_count') - before['quiz_layer_group_fanout_count'], 1)
+        self.assertEqual(self.sample('quiz_layer_group_fanout_sum') - before['quiz_layer_group_fanout_sum'], 2)
+        self.assertEqual(self.sample('quiz_ws_received_total', kind='ready')
+                         - before['quiz_ws_received_total'], 1)
+        self.assertEqual(self.sample('quiz_ws_delivery_seconds_count', event='block_buttons')
+                         - before['quiz_ws_delivery_seconds_count'], 2)
+        for socket in sockets:
+            await socket.disconnect()
+        self.assertIsNone(REGISTRY.get_sample_value('quiz_ws_room_sockets', {'room': self.room}))
+
+
+class ShardedLayerTest(SimpleTestCase):
+    """Runs against the Redis of ``CHANNEL_REDIS_HOSTS``, two databases of it stand for two shards."""
+
+    def setUp(self):
+        host = settings.CHANNEL_REDIS_HOSTS[0]
+        self.hosts = [f'redis://{host}/{db}' for db in (3, 4)]
+        try:
+            async_to_sync(self.ping)()
+        except OSError:
+            self.skipTest(f'no Redis at {host}')
+
+    async def ping(self):
+        layer = layers.ShardedRedisChannelLayer(hosts=self.hosts[:1])
+        async with layer.connection(0) as connection:
+            await connection.ping()
+        await layer.close_pools()
+
+    @staticmethod
+    def sample(path: str) -> float:
+        return REGISTRY.get_sample_value('quiz_layer_deliveries_total', {'path': path}) or 0
+
+    def test_version_is_checked(self):
+        with mock.patch('channels_redis.__version__', '4.0.0'), self.assertRaises(ImproperlyConfigured):
+            layers.ShardedRedisChannelLayer(hosts=self.hosts)
+
+    def test_local_members_skip_redis(self):
+        async_to_sync(self.deliver)()
+
+    async def deliver(self):
+        # two layers are two worker processes
+        here, there = [layers.ShardedRedisChannelLayer(hosts=self.hosts[:1]) for _ in range(2)]
+        local, remote = await here.new_channel(), await there.new_channel()
+        await here.group_add('game_local', local)
+        await there.group_add('game_local', remote)
+        before = {path: self.sample(path) for path in ('local', 'redis')}
+        await here.group_send('game_local', {'type': 'event'})
+        self.assertEqual((await here.receive(local))['type'], 'event')
+        self.assertEqual((await there.receive(remote))['type'], 'event')
+        self.assertEqual({path: self.sample(path) - before[path] for path in before}, {'local': 1, 'redis': 1})
+        await here.send(local, {'type': 'direct'})
+        self.assertEqual((await here.receive(local))['type'], 'direct')
+        self.assertEqual(self.sample('local') - before['local'], 2)
+        for layer in (here, there):
+            layer.reader[1].cancel()
+            await layer.flush()
+            await layer.close_pools()
+
+    def test_group_lives_on_its_shard(self):
+        async_to_sync(self.place)()
+
+    async def place(self):
+        layer = layers.ShardedRedisChannelLayer(hosts=self.hosts)
+        groups = dict()
+        for number in range(100):
+            groups.setdefault(layer.consistent_hash(f'game_{number}'), f'game_{number}')
+        self.assertEqual(sorted(groups), [0, 1])
+        channel = await layer.new_channel()
+        for shard, group in groups.items():
+            await layer.group_add(group, channel)
+            for index in range(2):
+                async with layer.connection(index) as connection:
+                    self.assertEqual(await connection.zcard(layer._group_key(group)), int(index == shard))
+        await layer.flush()
+        await layer.close_pools()
+
+
+@override_settings(**BENCHMARK_SETTINGS)
+class ProtocolTest(TransactionTestCase):
+    def test_binary_frames(self):
+        async_to_sync(self.play)(seed_game(players=1))
+
+    async def play(self, seeded):
+        room = seeded.game.room_name
+        binary = WebsocketCommunicator(GameRoomConsumer.as_asgi(), f'/ws/game/{room}/',
+                                       subprotocols=[protocol.MSGPACK_SUBPROTOCOL])
+        text = WebsocketCommunicator(GameRoomConsumer.as_asgi(), f'/ws/game/{room}/')
+        for user, socket in zip((seeded.game_master, seeded.players[0]), (binary, text)):
+            socket.scope['url_route'] = {'kwargs': {'gamename': room}}
+            socket.scope['user'] = user
+        self.assertEqual(await binary.connect(), (True, protocol.MSGPACK_SUBPROTOCOL))
+        self.assertEqual(await text.connect(), (True, None))
+
+        block = {'username': seeded.game_master.username, 'user_id': seeded.game_master.id}
+        await binary.send_to(bytes_data=msgpack.packb([protocol.CODES['ready'], {'question_id': 1}]))
+        self.assertEqual(msgpack.unpackb(await binary.receive_from()), [[protocol.CODES['block'], block]])
+        self.assertEqual(await text.receive_json_from(), dict(block, message='block'))
+
+        layer = get_channel_layer()
+        await layer.group_send(f'game_{room}', {'type': 'unlock_buttons', 'message': 'unlocked'})
+        await layer.group_send(f'game_{room}', {'type': 'update_buttons', 'message': 'updated'})
+        self.assertEqual(msgpack.unpackb(await binary.receive_from()),
+                         [[protocol.CODES['unlocked'], {}], [protocol.CODES['updated'], {}]])
+        self.assertEqual((await text.receive_json_from())['message'], 'unlocked')
+        self.assertEqual((await text.receive_json_from())['message'], 'updated')
+
+        await binary.send_to(bytes_data=msgpack.packb([127, {}]))
+        self.assertTrue(await binary.receive_nothing())
+        # malformed frames are dropped the same way and the socket stays open
+        for frame in (b'\xc1', msgpack.packb(5), msgpack.packb([1, 2, 3]), msgpack.packb([[1], {}]),
+                      msgpack.packb([1, 'fields']), msgpack.packb([1, {}]) + b'\x00'):
+            await binary.send_to(bytes_data=frame)
+            self.assertTrue(await binary.receive_nothing())
+        await binary.send_to(bytes_data=msgpack.packb([protocol.CODES['unlock'], {}]))
+        self.assertEqual(msgpack.unpackb(await binary.receive_from()), [[protocol.CODES['unlocked'], {}]])
+        for socket in (binary, text):
+            await socket.disconnect()
+
+
+@override_settings(**BENCHMARK_SETTINGS)
+class BuzzTest(TransactionTestCase):
+    def test_first_press_wins(self):
+        seeded = seed_game(players=2)
+        question = Question.objects.filter(category__quiz=seeded.quiz).values_list('id', flat=True).first()
+        async_to_sync(self.press)(seeded, question)
+
+    async def press(self, seeded, question):
+        sockets = list()
+        for user in [seeded.game_master] + seeded.players:
+            socket = WebsocketCommunicator(GameRoomConsumer.as_asgi(), f'/ws/game/{seeded.game.room_name}/')
+            socket.scope['url_route'] = {'kwargs': {'gamename': seeded.game.room_name}}
+            socket.scope['user'] = user
+            await socket.connect()
+            sockets.append(socket)
+        master, first, second = sockets
+        first_id, second_id = (user.id for user in seeded.players)
+        await first.send_json_to({'message': 'ready', 'question_id': question})
+        self.assertEqual((await master.receive_json_from())['user_id'], first_id)
+        # later presses in the same window are dropped, whatever question they name
+        for press in ({'message': 'ready', 'question_id': question}, {'message': 'ready', 'question_id': 0},
+                      {'message': 'ready'}):
+            await second.send_json_to(press)
+            self.assertTrue(await master.receive_nothing())
+        # only the game master's verdict or unlock releases the lock
+        await second.send_json_to({'message': 'correct', 'player_id': second_id, 'question_id': question})
+        await second.send_json_to({'message': 'ready', 'question_id': question})
+        self.assertTrue(await master.receive_nothing())
+        for release in ('unlock', 'update'):
+            await second.send_json_to({'message': release})
+            await second.send_json_to({'message': 'ready', 'question_id': question})
+            self.assertTrue(await master.receive_nothing())
+        await master.send_json_to({'message': 'correct', 'player_id': first_id, 'question_id': question})
+        self.assertEqual((await master.receive_json_from())['message'], 'delta')
+        self.assertEqual((await master.receive_json_from())['message'], 'updated')
+        await second.send_json_to({'message': 'ready', 'question_id': question + 1})
+        self.assertEqual((await master.receive_json_from())['user_id'], second_id)
+        for socket in sockets:
+            await socket.disconnect()
+
+
+class TimerTest(TestCase):
+    def test_wheel(self):
+        async_to_sync(self.spin)()
+
+    async def spin(self):
+        # 8 slots of 10 ms, the longer timers go round the wheel a few times
+        wheel = timers.TimerWheel(tick=0.01, slots=8)
+        fired = list()
+        scheduled = [wheel.schedule(0.01 * (n % 20 + 1), fired.append, n) for n in range(2000)]
+        for timer in scheduled[::2]:
+            timer.cancel()
+        self.assertEqual(wheel.pending, 1000)
+        await wheel.task
+        self.assertEqual(sorted(fired), list(range(1, 2000, 2)))
+        self.assertEqual([n % 20 for n in fired], sorted(n % 20 for n in fired))
+
+    def test_windows(self):
+        async_to_sync(self.windows)()
+
+    async def windows(self):
+        layer = InMemoryChannelLayer()
+        channel = await layer.new_channel()
+        await layer.group_add('game_timerroom', channel)
+        engine = room_engine.RoomEngine('timerroom', layer)
+        engine.loaded, engine.timer, engine.game_master_id = True, True, 1
+        engine.start()
+        with mock.patch.object(room_engine, 'ANSWER_SECONDS', 0.2), mock.patch.object(room_engine, 'BET_SECONDS', 0.2):
+            engine.post({'message': 'buzzed', 'question_id': 5, 'user_id': 2})
+            started = await layer.receive(channel)
+            self.assertEqual((started['type'], started['timer'], started['user_id']), ('timer_started', 'answer', 2))
+            expired = await asyncio.wait_for(layer.receive(channel), 1)
+            self.assertEqual((expired['type'], expired['timer'], expired['question_id']),
+                             ('timer_expired', 'answer', 5))
+
+            # a verdict closes the window before it runs out
+            engine.post({'message': 'buzzed', 'question_id': 6, 'user_id': 2})
+            self.assertEqual((await layer.receive(channel))['type'], 'timer_started')
+            engine.post({'message': 'unlock', 'sender_id': 2})
+            engine.post({'message': 'unlock', 'sender_id': 1})
+            self.assertEqual((await layer.receive(channel))['type'], 'unlock_buttons')
+            with self.assertRaises(asyncio.TimeoutError):
+                await asyncio.wait_for(layer.receive(channel), 0.4)
+
+            engine.post({'message': 'bets_open', 'sender_id': 2})
+            engine.post({'message': 'bets_open', 'sender_id': 1})
+            self.assertEqual((await layer.receive(channel))['timer'], 'bet')
+            self.assertEqual((await asyncio.wait_for(layer.receive(channel), 1))['type'], 'timer_expired')
+        await engine.stop()
+
+
+@override_settings(**BENCHMARK_SETTINGS)
+class RoomEngineTest(TransactionTestCase):
+    def setUp(self):
+        self.seeded = seed_game(players=2)
+        self.players = list(Participant.objects.filter(game=self.seeded.game).order_by('id'))
+        self.question = Question.objects.filter(category__quiz=self.seeded.quiz, category__round=1).select_related(
+            'category').first()
+        self.points = self.question.value * self.question.category.round
+
+    async def play(self, *messages):
+        layer = InMemoryChannelLayer()
+        channel = await layer.new_channel()
+        await layer.group_add(f'game_{self.seeded.game.room_name}', channel)
+        engine = room_engine.RoomEngine(self.seeded.game.room_name, layer)
+        engine.start()
+        engine.post({'message': 'snapshot', 'reply_to': channel})
+        self.assertEqual((await layer.receive(channel))['type'], 'room_state')
+        # the HTTP scoring views change a score while the room is loaded
+        await sync_to_async(Participant.objects.filter(id=self.players[0].id).update)(score=F('score') + 7)
+        for message in messages:
+            engine.post(dict(message, sender_id=self.seeded.game_master.id))
+        while (await layer.receive(channel))['type'] != 'update_buttons':
+            pass
+        await engine.stop()
+        return engine
+
+    def verdicts(self) -> list:
+        first, second = (player.user_id for player in self.players)
+        return [{'message': 'correct', 'player_id': first, 'question_id': self.question.id},
+                {'message': 'wrong', 'player_id': second, 'question_id': self.question.id}]
+
+    def assertScored(self):
+        self.assertEqual([(p.score, p.answer_attempts, p.correct_answers)
+                          for p in Participant.objects.filter(game=self.seeded.game).order_by('id')],
+                         [(7 + self.points, 1, 1), (-self.points, 1, 0)])
+        self.assertTrue(AnsweredQuestion.objects.filter(game=self.seeded.game, question=self.question).exists())
+
+    def test_flush_adds_to_the_stored_scores(self):
+        engine = async_to_sync(self.play)(*self.verdicts())
+        self.assertScored()
+        self.assertEqual(engine.players[self.players[0].id]['score'], 7 + self.points)
+
+    def test_failed_flush_is_retried(self):
+        flush_room = room_engine._flush_room
+        calls = list()
+
+        def flaky(*args):
+            calls.append(args)
+            if len(calls) == 1:
+                raise DatabaseError('connection lost')
+            return flush_room(*args)
+
+        with mock.patch.object(room_engine, '_flush_room', flaky), \
+                mock.patch.object(room_engine, 'FLUSH_RETRY_SECONDS', 0.1), \
+                self.assertLogs('quiz.room_engine', 'ERROR'):
+            async_to_sync(self.play)(*self.verdicts())
+        self.assertEqual(len(calls), 2)
+        self.assertScored()
+
+
+    def test_snapshot_reads_what_other_workers_wrote(self):
+        async_to_sync(self.snapshot)()
+
+    async def snapshot(self):
+        layer = InMemoryChannelLayer()
+        channel = await layer.new_channel()
+        engine = room_engine.RoomEngine(self.seeded.game.room_name, layer)
+        engine.start()
+        engine.post({'message': 'snapshot', 'reply_to': channel})
+        self.assertEqual((await layer.receive(channel))['stale'], [])
+        synced = engine.synced
+        # a player can't make the engine reload the room
+        engine.post({'message': 'sync', 'sender_id': self.players[0].user_id})
+        engine.post({'message': 'snapshot', 'reply_to': channel})
+        await layer.receive(channel)
+        self.assertEqual(engine.synced, synced)
+        # the engine of another worker closes a question and scores it
+        await sync_to_async(AnsweredQuestion.objects.create)(game=self.seeded.game, question=self.question)
+        await sync_to_async(Participant.objects.filter(id=self.players[0].id).update)(score=self.points)
+        with mock.patch.object(room_engine, 'SNAPSHOT_SECONDS', 0):
+            engine.post({'message': 'snapshot', 'reply_to': channel})
+            state = await layer.receive(channel)
+        self.assertEqual(state['stale'], [self.question.id])
+        self.assertIn({'id': self.players[0].id, 'user_id': self.players[0].user_id, 'score': self.points},
+                      state['scores'])
+        await engine.stop()
+
+
+    def test_engine_stops_when_the_game_is_over(self):
+        async_to_sync(self.end)()
+        self.assertEqual([(p.score, p.answer_attempts) for p in Participant.objects.filter(game=self.seeded.game)],
+                         [(0, 0), (0, 0)])
+
+    async def end(self):
+        layer = InMemoryChannelLayer()
+        channel = await layer.new_channel()
+        engine = room_engine.RoomEngine(self.seeded.game.room_name, layer)
+        engine.start()
+        engine.post({'message': 'snapshot', 'reply_to': channel})
+        await layer.receive(channel)
+        await sync_to_async(QuizGame.objects.filter(id=self.seeded.game.id).update)(ended=True)
+        with self.assertLogs('quiz.room_engine', 'INFO') as logs:
+            for message in self.verdicts():
+                engine.post(dict(message, sender_id=self.seeded.game_master.id))
+            await engine.stop()
+        self.assertTrue(engine.ended)
+        self.assertEqual([record.levelname for record in logs.records], ['INFO'])
+
+
+@override_settings(**BENCHMARK_SETTINGS)
+class SuperRoundTest(TransactionTestCase):
+    def test_collect(self):
+        seeded = seed_game(players=3)
+        players = [player.id for player in seeded.players]
+        async_to_sync(self.collect)(seeded, players)
+        self.assertEqual(sorted(Participant.objects.filter(game=seeded.game).values_list('super_bet', 'super_answer')),
+                         [(100, 'answer 0'), (101, 'answer 1'), (102, 'answer 2')])
+
+    async def collect(self, seeded, players):
+        layer = InMemoryChannelLayer()
+        channel = await layer.new_channel()
+        await layer.group_add(f'game_{seeded.game.room_name}', channel)
+        engine = room_engine.RoomEngine(seeded.game.room_name, layer)
+        engine.start()
+        for number, user_id in enumerate(players):
+            engine.post({'message': 'super_bet', 'bet': 100 + number, 'sender_id': user_id})
+        for number, user_id in enumerate(players[:2]):
+            engine.post({'message': 'super_answer', 'answer': f'answer {number}', 'sender_id': user_id})
+        engine.post({'message': 'super_answers', 'sender_id': seeded.game_master.id, 'reply_to': channel})
+        self.assertEqual(await layer.receive(channel), {'type': 'super_answers', 'to': seeded.game_master.id,
+                                                        'message': 'answers', 'ready': False})
+        self.assertEqual(await sync_to_async(Participant.objects.filter(super_bet__isnull=False).count)(), 0)
+
+        engine.post({'message': 'super_answer', 'answer': 'answer 2', 'sender_id': players[2]})
+        engine.post({'message': 'super_bet', 'bet': 500, 'sender_id': players[0]})
+        pushed = await layer.receive(channel)
+        self.assertEqual((pushed['type'], pushed['to'], pushed['ready']),
+                         ('super_answers', seeded.game_master.id, True))
+        self.assertEqual(sorted((entry['bet'], entry['answer']) for entry in pushed['answers']),
+                         [(100, 'answer 0'), (101, 'answer 1'), (102, 'answer 2')])
+        await engine.stop()
+
+    def test_http_bets_and_the_bet_window(self):
+        seeded = seed_game(players=3)
+        QuizGame.objects.filter(id=seeded.game.id).update(timer=True)
+        question = Question.objects.filter(category__quiz=seeded.quiz, category__round=3).first()
+        with mock.patch.object(room_engine, 'BET_SECONDS', 0.2):
+            pushed = async_to_sync(self.close_window)(seeded, question)
+        # the third player never bet and is left out once the window closed
+        self.assertEqual([(entry['name'], entry['bet']) for entry in pushed['answers']],
+                         [(seeded.players[0].username, 100), (seeded.players[1].username, 200)])
+        self.assertTrue(AnsweredQuestion.objects.filter(game=seeded.game, question=question).exists())
+
+    async def close_window(self, seeded, question):
+        layer = InMemoryChannelLayer()
+        channel = await layer.new_channel()
+        await layer.group_add(f'game_{seeded.game.room_name}', channel)
+        engine = room_engine.RoomEngine(seeded.game.room_name, layer)
+        engine.start()
+        engine.post({'message': 'bets_open', 'question_id': question.id, 'sender_id': seeded.game_master.id})
+        self.assertEqual((await layer.receive(channel))['type'], 'timer_started')
+        engine.post({'message': 'super_bet', 'bet': 100, 'sender_id': seeded.players[0].id})
+        engine.post({'message': 'super_answer', 'answer': 'engine', 'sender_id': seeded.players[0].id})
+        # the second player bets and answers over HTTP after the room was loaded
+        await sync_to_async(Participant.objects.filter(user=seeded.players[1], active=True).update)(
+            super_bet=200, super_answer='http')
+        while True:
+            pushed = await layer.receive(channel)
+            if pushed['type'] == 'super_answers':
+                break
+        await engine.stop()
+        return pushed
@@ -0,0 +1,90 @@
+import asyncio
+import logging
+import math
+import weakref
+from typing import Callable, Optional, Set
+
+from quiz.metrics import TIMERS_PENDING
+
+TICK_SECONDS = 0.1
+WHEEL_SLOTS = 512
+
+_wheels = weakref.WeakKeyDictionary()
+
+logger = logging.getLogger(__name__)
+
+
+class Timer:
+    __slots__ = ('wheel', 'due', 'callback', 'args', 'slot')
+
+    def __init__(self, wheel: 'TimerWheel', due: int, callback: Callable, args: tuple):
+        self.wheel = wheel
+        self.due = due
+        self.callback = callback
+        self.args = args
+        self.slot: Optional[Set['Timer']] = None
+
+    def cancel(self) -> None:
+        self.wheel.cancel(self)
+
+
+class TimerWheel:
+    """
+    Hashed timer wheel: a timer due in ``n`` ticks sits in slot
+    ``(now + n) % WHEEL_SLOTS`` and one task walks the slots a tick at a
+    time, so scheduling and cancelling are O(1) and a worker wakes up once a
+    tick however many countdowns it runs. The task only lives while there
+    are timers. Callbacks run on the wheel task and must not block.
+    """
+
+    def __init__(self, tick: float = TICK_SECONDS, slots: int = WHEEL_SLOTS):
+        self.tick = tick
+        self.slots = [set() for _ in range(slots)]
+        self.now = 0
+        self.pending = 0
+        self.task = None
+
+    def schedule(self, delay: float, callback: Callable, *args) -> Timer:
+        timer = Timer(self, self.now + max(1, math.ceil(delay / self.tick)), callback, args)
+        timer.slot = self.slots[timer.due % len(self.slots)]
+        timer.slot.add(timer)
+        self.pending += 1
+        if self.task is None or self.task.done():
+            self.task = asyncio.ensure_future(self.run())
+        return timer
+
+    def cancel(self, timer: Timer) -> None:
+        if timer.slot is not None:
+            timer.slot.discard(timer)
+            timer.slot = None
+            self.pending -= 1
+
+    async def run(self) -> None:
+        loop = asyncio.get_event_loop()
+        started, start_tick = loop.time(), self.now
+        while self.pending:
+            await asyncio.sleep(max(0.0, started + (self.now + 1 - start_tick) * self.tick - loop.time()))
+            self.now += 1
+            slot = self.slots[self.now % len(self.slots)]
+            # timers a full turn or more away share the slot, they stay for a later pass
+            for timer in [timer for timer in slot if timer.due <= self.now]:
+                self.cancel(timer)
+                try:
+                    timer.callback(*timer.args)
+                except Exception:
+                    logger.exception('timer callback %r failed', timer.callback)
+
+
+def wheel() -> TimerWheel:
+    """The wheel of the running event loop."""
+    loop = asyncio.get_event_loop()
+    if loop not in _wheels:
+        _wheels[loop] = TimerWheel()
+    return _wheels[loop]
+
+
+def schedule(delay: float, callback: Callable, *args) -> Timer:
+    return wheel().schedule(delay, callback, *args)
+
+
+TIMERS_PENDING.set_function(lambda: sum(wheel.pending for wheel in list(_wheels.values())))
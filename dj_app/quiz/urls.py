@@ -22,6 +22,7 @@ urlpatterns = [
     path('game_quiz_cr', views.game_quiz_cr, name='game_quiz_cr'),
     path('quiz_game_players', views.quiz_game_players, name='quiz_game_players'),
     path('quiz_game_round', views.quiz_game_round, name='quiz_game_round'),
+    path('round_media', views.round_media, name='round_media'),
     path('round_completed', views.round_completed, name='round_completed'),
     path('players_dashboard', views.players_dashboard, name='players_dashboard'),
     path('start_game', views.start_game, name='start_game'),
@@ -1,257 +1,401 @@
 import json
-from asyncio import gather
+import mimetypes
+import posixpath
+from urllib.parse import quote
 
-from django.http import JsonResponse, HttpResponse, HttpRequest
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import JsonResponse, HttpResponse, HttpRequest, Http404
+from django.views.static import serve
+from prometheus_client import generate_latest, CONTENT_TYPE_LATEST
 
-from quiz.async_methods import check_user_auth, get_sections, get_quiz_list, get_game_quiz_list, get_themes, \
+from quiz.async_methods import get_sections, get_quiz_list, get_game_quiz_list, get_themes, \
     get_question_list, get_theme_round, get_question_detail, get_ig_question_detail, quiz_cr, theme_cr, question_cr, \
     quiz_upd, theme_upd, question_upd, round_change, g_quiz_cr, qg_players, round_arrange, round_qg, corr_ans, \
     r_completed, wrong_ans, super_corr_ans, super_wrong_ans, game_start, score_pl, dashboard, get_ans, g_list, \
     connect_player, bet, super_ans, res_table, game_end, no_body, q_detail, th_detail, quiz_det, check_room, get_types, \
-    get_player
+    get_player, round_mf, value_change, IN_PLAY
+from quiz.media import RejectedUpload
+from users.decorators import endpoint
 
 
-async def check_method(request: HttpRequest, expected: list) -> HttpResponse:
-    if await check_user_auth(request):
-        return HttpResponse(status=401)
-    if request.method not in expected:
-        return HttpResponse(status=405)
+def _positive(value: str) -> int:
+    """A positive integer query parameter; ValueError for anything else."""
+    number = int(value)
+    if number <= 0:
+        raise ValueError(value)
+    return number
 
 
+@endpoint(['GET'])
 async def sections(request: HttpRequest):
-    info = await gather(check_method(request, ['GET']), get_sections())
-    return JsonResponse(info[1])
+    info = await get_sections()
+    return HttpResponse(info, content_type='application/json')
 
 
+@endpoint(['GET'], auth=False)
 async def player_id(request: HttpRequest):
     return JsonResponse(await get_player(request))
 
 
+@endpoint(['GET'])
 async def types(request: HttpRequest):
-    info = await gather(check_method(request, ['GET']), get_types())
-    return JsonResponse(info[1])
+    info = await get_types()
+    return HttpResponse(info, content_type='application/json')
 
 
+@endpoint(['GET'])
 async def quiz_list(request: HttpRequest):
-    info = await gather(check_method(request, ['GET']), get_quiz_list(request))
-    return JsonResponse(info[1], safe=False)
+    info = await get_quiz_list(request)
+    return JsonResponse(info, safe=False)
 
 
+@endpoint(['GET'])
 async def game_quiz_list(request: HttpRequest):
-    info = await gather(check_method(request, ['GET']), get_game_quiz_list())
-    return JsonResponse(info[1], safe=False)
+    info = await get_game_quiz_list()
+    return HttpResponse(info, content_type='application/json')
 
 
+@endpoint(['GET'])
 async def theme_list(request: HttpRequest) -> HttpResponse:
     quiz_id = request.GET.get(key='quiz_id')
-    info = await gather(check_method(request, ['GET']), get_themes(quiz_id))
-    return JsonResponse(info[1], safe=False)
+    info = await get_themes(quiz_id)
+    return JsonResponse(info, safe=False)
 
 
+@endpoint(['GET'])
 async def question_list(request: HttpRequest):
     theme_id = request.GET.get('theme_id')
-    info = await gather(check_method(request, ['GET']), get_question_list(theme_id))
-    return JsonResponse(info[1], safe=False)
+    info = await get_question_list(theme_id)
+    return JsonResponse(info, safe=False)
 
 
+@endpoint(['GET'])
 async def theme_round(request: HttpRequest):
     theme_id = request.GET.get('theme_id')
-    info = await gather(check_method(request, ['GET']), get_theme_round(theme_id))
-    return JsonResponse(info[1])
+    info = await get_theme_round(theme_id)
+    return JsonResponse(info)
 
 
+@endpoint(['GET'])
 async def question_detail(request: HttpRequest):
     question_id = request.GET.get('question_id')
-    info = await gather(check_method(request, ['GET']), get_question_detail(question_id))
-    return JsonResponse(info[1])
+    width = request.GET.get('width')
+    try:
+        width = _positive(width) if width else None
+    except ValueError:
+        return JsonResponse({"detail": "Wrong width"}, status=400)
+    info = await get_question_detail(question_id, width)
+    return JsonResponse(info)
 
 
+@endpoint(['GET'])
 async def ig_question_detail(request: HttpRequest):
     question_id = request.GET.get('question_id')
-    info = await gather(check_method(request, ['GET']), get_ig_question_detail(question_id))
-    return JsonResponse(info[1], status=200)
+    width = request.GET.get('width')
+    try:
+        width = _positive(width) if width else None
+    except ValueError:
+        return JsonResponse({"detail": "Wrong width"}, status=400)
+    info = await get_ig_question_detail(question_id, width)
+    return JsonResponse(info, status=200)
 
 
+@endpoint(['POST'])
 async def create_quiz(request: HttpRequest):
     data = json.loads(request.body)
-    info = await gather(check_method(request, ['POST']), quiz_cr(data['title'], data['section'], request))
-    return JsonResponse(info[1], status=201)
+    info = await quiz_cr(data['title'], data['section'], request)
+    return JsonResponse(info, status=201)
 
 
+@endpoint(['POST'])
 async def create_theme(request: HttpRequest):
     data = json.loads(request.body)
-    info = await gather(check_method(request, ['POST']), theme_cr(data['quiz'], data['name']))
-    return JsonResponse(info[1], status=201 if "id" in info[1].keys() else 200)
+    info = await theme_cr(data['quiz'], data['name'])
+    if info is IN_PLAY:
+        return JsonResponse(info, status=409)
+    return JsonResponse(info, status=201 if "id" in info.keys() else 200)
 
 
+@endpoint(['POST'])
 async def create_question(request: HttpRequest):
-    info = await gather(check_method(request, ['POST']), question_cr(request))
-    return JsonResponse(info[1], status=201)
+    try:
+        info = await question_cr(request)
+    except RejectedUpload as error:
+        return JsonResponse({"detail": str(error)}, status=400)
+    if info is IN_PLAY:
+        return JsonResponse(info, status=409)
+    return JsonResponse(info, status=201)
 
 
+@endpoint(['PUT', 'DELETE'])
 async def update_quiz(request: HttpRequest, quiz_id: int):
-    await gather(check_method(request, ['PUT', 'DELETE']), quiz_upd(request, quiz_id))
+    info = await quiz_upd(request, quiz_id)
+    if info is not None:
+        return JsonResponse(info, status=409)
     return HttpResponse(status=200 if request.method == 'PUT' else 204)
 
 
+@endpoint(['PUT', 'DELETE'])
 async def update_theme(request: HttpRequest, theme_id: int):
-    await gather(check_method(request, ['PUT', 'DELETE']), theme_upd(request, theme_id))
+    info = await theme_upd(request, theme_id)
+    if info is not None:
+        return JsonResponse(info, status=409)
     return HttpResponse(status=200 if request.method == 'PUT' else 204)
 
 
+@endpoint(['POST', 'DELETE'])
 async def update_question(request: HttpRequest, question_id: int):
-    await gather(check_method(request, ['POST', 'DELETE']), question_upd(request, question_id))
+    try:
+        info = await question_upd(request, question_id)
+    except RejectedUpload as error:
+        return JsonResponse({"detail": str(error)}, status=400)
+    if info is not None:
+        return JsonResponse(info, status=409)
     return HttpResponse(status=200 if request.method == 'POST' else 204)
 
 
+@endpoint(['PUT'])
 async def arrange_theme_round(request: HttpRequest):
     data = json.loads(request.body)
-    info = await gather(check_method(request, ['PUT']), round_arrange(data))
-    return JsonResponse(info[1], status=200)
+    info = await round_arrange(data)
+    if info is IN_PLAY:
+        return JsonResponse(info, status=409)
+    return JsonResponse(info, status=200)
 
 
+@endpoint(['PUT'])
 async def change_value(request: HttpRequest):
     data = json.loads(request.body)
-    await gather(check_method(request, ['PUT']), round_arrange(data))
+    info = await value_change(data)
+    if info is not None:
+        return JsonResponse(info, status=409)
     return JsonResponse({"detail": "Success"}, status=200)
 
 
+@endpoint(['PUT'])
 async def change_round(request: HttpRequest):
     data = json.loads(request.body)
-    await gather(check_method(request, ['PUT']), round_change(data))
+    info = await round_change(data)
+    if info is not None:
+        return JsonResponse(info, status=409)
     return JsonResponse({"detail": "Success"}, status=200)
 
 
+@endpoint(['POST'])
 async def game_quiz_cr(request: HttpRequest):
-    info = await gather(check_method(request, ['POST']), g_quiz_cr(request))
-    return JsonResponse(info[1], status=200)
+    info = await g_quiz_cr(request)
+    return JsonResponse(info, status=200)
 
 
+@endpoint(['GET'])
 async def quiz_game_players(request: HttpRequest):
     quiz_game_id = request.GET.get('quiz_game_id')
-    info = await gather(check_method(request, ['GET']), qg_players(quiz_game_id))
-    return JsonResponse(info[1], safe=False)
+    info = await qg_players(quiz_game_id)
+    return JsonResponse(info, safe=False)
 
 
+@endpoint(['GET'])
 async def quiz_game_round(request: HttpRequest):
     quiz_game_id = request.GET.get('quiz_game_id')
     current_round = request.GET.get('round')
-    info = await gather(check_method(request, ['GET']), round_qg(quiz_game_id, current_round))
-    return JsonResponse(info[1])
+    width = request.GET.get('width')
+    try:
+        width = _positive(width) if width else None
+    except ValueError:
+        return JsonResponse({"detail": "Wrong width"}, status=400)
+    info = await round_qg(quiz_game_id, current_round, width)
+    return JsonResponse(info)
 
 
+@endpoint(['GET'])
+async def round_media(request: HttpRequest):
+    quiz_game_id = request.GET.get('quiz_game_id')
+    current_round = request.GET.get('round')
+    width = request.GET.get('width')
+    try:
+        width = _positive(width) if width else None
+    except ValueError:
+        return JsonResponse({"detail": "Wrong width"}, status=400)
+    info = await round_mf(quiz_game_id, current_round, width)
+    etag = f'"{info["version"]}"'
+    if request.headers.get('If-None-Match') == etag:
+        response = HttpResponse(status=304)
+    else:
+        response = JsonResponse(info)
+    response['ETag'] = etag
+    response['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+@endpoint(['GET'])
 async def round_completed(request: HttpRequest):
-    await check_method(request, ['GET'])
     quiz_game_id = request.GET.get('quiz_game_id')
     current_round = request.GET.get('round')
-    info = await gather(check_method(request, ['GET']), r_completed(quiz_game_id, current_round))
-    return JsonResponse(info[1])
+    info = await r_completed(quiz_game_id, current_round)
+    return JsonResponse(info)
 
 
+@endpoint(['POST'])
 async def corr_answer(request: HttpRequest):
     data = json.loads(request.body)
-    await gather(check_method(request, ['POST']), corr_ans(data))
-    return HttpResponse(status=200)
+    info = await corr_ans(data)
+    if info is None:
+        return HttpResponse(status=200)
+    return JsonResponse(info, status=200)
 
 
+@endpoint(['POST'])
 async def wrong_answer(request: HttpRequest):
     data = json.loads(request.body)
-    await gather(check_method(request, ['POST']), wrong_ans(data))
-    return HttpResponse(status=200)
+    info = await wrong_ans(data)
+    if info is None:
+        return HttpResponse(status=200)
+    return JsonResponse(info, status=200)
 
 
+@endpoint(['POST'])
 async def corr_answer_super(request: HttpRequest):
     data = json.loads(request.body)
-    await gather(check_method(request, ['POST']), super_corr_ans(data))
-    return HttpResponse(status=200)
+    info = await super_corr_ans(data)
+    if info is None:
+        return HttpResponse(status=200)
+    return JsonResponse(info, status=200)
 
 
+@endpoint(['POST'])
 async def wrong_answer_super(request: HttpRequest):
     data = json.loads(request.body)
-    await gather(check_method(request, ['POST']), super_wrong_ans(data))
-    return HttpResponse(status=200)
+    info = await super_wrong_ans(data)
+    if info is None:
+        return HttpResponse(status=200)
+    return JsonResponse(info, status=200)
 
 
+@endpoint(['POST'])
 async def start_game(request: HttpRequest):
     data = json.loads(request.body)
-    await gather(check_method(request, ['POST']), game_start(data))
+    await game_start(data)
     return HttpResponse(status=200)
 
 
+@endpoint(['GET'])
 async def player_score(request: HttpRequest):
-    info = await gather(check_method(request, ['GET']), score_pl(request))
-    return JsonResponse(info[1])
+    info = await score_pl(request)
+    return JsonResponse(info)
 
 
+@endpoint(['GET'])
 async def players_dashboard(request: HttpRequest):
     quiz_game_id = request.GET.get('quiz_game_id')
-    info = await gather(check_method(request, ['GET']), dashboard(quiz_game_id))
-    return JsonResponse(info[1], safe=False)
+    top = request.GET.get('top')
+    try:
+        top = _positive(top) if top else None
+    except ValueError:
+        return JsonResponse({"detail": "Wrong top"}, status=400)
+    info = await dashboard(quiz_game_id, top)
+    return JsonResponse(info, safe=False)
 
 
+@endpoint(['GET'])
 async def get_answers(request: HttpRequest):
     quiz_game_id = request.GET.get('game_id')
     q_id = request.GET.get('q_id')
-    info = await gather(check_method(request, ['GET']), get_ans(quiz_game_id, q_id))
-    return JsonResponse(info[1])
+    info = await get_ans(quiz_game_id, q_id)
+    return JsonResponse(info)
 
 
+@endpoint(['GET'])
 async def games_available(request: HttpRequest):
-    info = await gather(check_method(request, ['GET']), g_list())
-    return JsonResponse(info[1], safe=False)
+    info = await g_list()
+    return JsonResponse(info, safe=False)
 
 
+@endpoint(['POST'])
 async def connect(request: HttpRequest):
-    await gather(check_method(request, ['POST']), connect_player(request))
+    await connect_player(request)
     return HttpResponse(status=200)
 
 
+@endpoint(['POST'])
 async def bet_super(request: HttpRequest):
-    await gather(check_method(request, ['POST']), bet(request))
+    await bet(request)
     return HttpResponse(status=200)
 
 
+@endpoint(['POST'])
 async def answer_super(request: HttpRequest):
-    await gather(check_method(request, ['POST']), super_ans(request))
+    await super_ans(request)
     return HttpResponse(status=200)
 
 
+@endpoint(['GET'])
 async def results_table(request: HttpRequest):
     game_id = request.GET.get('quiz_game_id')
-    info = await gather(check_method(request, ['GET']), res_table(game_id))
-    return JsonResponse(info[1], safe=False)
+    info = await res_table(game_id)
+    return JsonResponse(info, safe=False)
 
 
+@endpoint(['POST'])
 async def end_game(request: HttpRequest):
     data = json.loads(request.body)
-    await gather(check_method(request, ['POST']), game_end(data))
+    await game_end(data)
     return HttpResponse(status=200)
 
 
+@endpoint(['POST'])
 async def nobody(request: HttpRequest):
     data = json.loads(request.body)
-    await gather(check_method(request, ['POST']), no_body(data['question_id']))
+    info = await no_body(request, data)
+    if info is not None:
+        return JsonResponse(info, status=400)
     return HttpResponse(status=204)
 
 
+@endpoint(['GET'])
 async def question_upd_detail(request: HttpRequest):
     question_id = request.GET.get("question_id")
-    info = await gather(check_method(request, ['GET']), q_detail(question_id))
-    return JsonResponse(info[1])
+    info = await q_detail(question_id)
+    return JsonResponse(info)
 
 
+@endpoint(['GET'])
 async def theme_upd_detail(request: HttpRequest):
     theme_id = request.GET.get("theme_id")
-    info = await gather(check_method(request, ['GET']), th_detail(theme_id))
-    return JsonResponse(info[1])
+    info = await th_detail(theme_id)
+    return JsonResponse(info)
 
 
+@endpoint(['GET'])
 async def quiz_upd_detail(request: HttpRequest):
     quiz_id = request.GET.get("quiz_id")
-    info = await gather(check_method(request, ['GET']), quiz_det(quiz_id))
-    return JsonResponse(info[1])
+    info = await quiz_det(quiz_id)
+    return JsonResponse(info)
 
 
+@endpoint(['GET'])
 async def room(request: HttpRequest):
-    info = await gather(check_method(request, ['GET']), check_room(request))
-    return JsonResponse(info[1])
+    info = await check_room(request)
+    return JsonResponse(info)
+
+
+@endpoint(['GET', 'HEAD'])
+async def media(request: HttpRequest, path: str):
+    """
+    Authorizes the download and lets nginx send the file, with ranges and
+    sendfile, so audio streams don't hold daphne workers.
+    """
+    if settings.MEDIA_ACCEL_PREFIX is None:
+        return await sync_to_async(serve)(request, path, document_root=settings.MEDIA_ROOT)
+    path = posixpath.normpath(path).lstrip('/')
+    if path.startswith('..'):
+        raise Http404
+    response = HttpResponse(content_type=mimetypes.guess_type(path)[0] or 'application/octet-stream')
+    response['X-Accel-Redirect'] = quote(settings.MEDIA_ACCEL_PREFIX + path)
+    return response
+
+
+@endpoint(['GET'], auth=False)
+async def metrics(request: HttpRequest):
+    """Prometheus scrapes the backend directly, nginx doesn't proxy this path."""
+    return HttpResponse(generate_latest(), content_type=CONTENT_TYPE_LATEST)
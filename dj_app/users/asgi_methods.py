@@ -27,7 +27,7 @@ async def check_pwd(password: str, email: str) -> Coroutine:
 
 def _player_login(request: HttpRequest, email: str) -> dict:
     user = CustomUser.objects.get(email=email)
-    login(request=request, user=user)
+    login(request=request, user=user, backend='users.backends.CachedModelBackend')
 
 
 async def player_login(request: HttpRequest, email: str) -> Coroutine:
@@ -45,7 +45,7 @@ async def player_logout(request: HttpRequest) -> Coroutine:
 def _player_register(request: HttpRequest) -> None:
     data = json.loads(request.body)
     user = CustomUser.objects.create_user(email=data['email'], password=data['password'], username=data['username'])
-    login(request=request, user=user)
+    login(request=request, user=user, backend='users.backends.CachedModelBackend')
 
 
 async def player_register(request: HttpRequest) -> Coroutine:
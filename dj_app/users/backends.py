@@ -0,0 +1,26 @@
+from django.conf import settings
+from django.contrib.auth.backends import ModelBackend
+from django.core.cache import caches
+
+USER_CACHE_TTL = 60
+
+
+def user_cache_key(user_id) -> str:
+    return f'user:{user_id}'
+
+
+class CachedModelBackend(ModelBackend):
+    """
+    ModelBackend whose get_user, called for every HTTP request and every
+    WebSocket connect, is served from a short-lived snapshot in the session
+    cache.
+    """
+
+    def get_user(self, user_id):
+        cache = caches[settings.SESSION_CACHE_ALIAS]
+        user = cache.get(user_cache_key(user_id))
+        if user is None:
+            user = super().get_user(user_id)
+            if user is not None:
+                cache.set(user_cache_key(user_id), user, USER_CACHE_TTL)
+        return user
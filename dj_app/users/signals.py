@@ -0,0 +1,28 @@
+from django.conf import settings
+from django.contrib.auth.signals import user_logged_in, user_logged_out
+from django.core.cache import caches
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from users.backends import user_cache_key, USER_CACHE_TTL
+from users.models import CustomUser
+
+
+def forget_user(user_id) -> None:
+    caches[settings.SESSION_CACHE_ALIAS].delete(user_cache_key(user_id))
+
+
+@receiver(user_logged_in)
+def user_logged_in_handler(sender, request, user, **kwargs):
+    caches[settings.SESSION_CACHE_ALIAS].set(user_cache_key(user.id), user, USER_CACHE_TTL)
+
+
+@receiver(user_logged_out)
+def user_logged_out_handler(sender, request, user, **kwargs):
+    if user is not None:
+        forget_user(user.id)
+
+
+@receiver([post_save, post_delete], sender=CustomUser)
+def user_changed(sender, instance, **kwargs):
+    forget_user(instance.id)
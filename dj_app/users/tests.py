@@ -1,3 +1,25 @@
-from django.test import TestCase
+from django.test import Client
 
-# Create your tests here.
+from quiz.tests import EndpointBenchmark
+
+
+class UserEndpointsTest(EndpointBenchmark):
+    players = 1
+
+    def test_session(self):
+        client = Client()
+        self.call('get', '/user/check_logged', 0, client=client)
+        self.call('post', '/user/register', 9, {'email': 'new@bench.local', 'password': 'secret', 'username': 'new'},
+                  client=client, status=201)
+        self.assertTrue(self.call('get', '/user/check_logged', 0, client=client).json()['logged'])
+        self.call('post', '/user/logout', 2, client=client)
+        self.assertFalse(self.call('get', '/user/check_logged', 0, client=client).json()['logged'])
+        self.call('post', '/user/login', 11, {'email': 'new@bench.local', 'password': 'secret'}, client=client)
+        self.call('get', '/user/check_logged', 0, client=client)
+
+    def test_logged_in_requests_skip_the_user_query(self):
+        self.call('get', '/quiz/player_id', 0)
+        self.call('get', '/user/check_logged', 0)
+
+    def test_anonymous_player_id(self):
+        self.assertEqual(self.call('get', '/quiz/player_id', 0, client=Client()).json(), {'id': None})